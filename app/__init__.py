@@ -22,8 +22,86 @@ else:
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///../db.sqlite'
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///db.sqlite"
+
+# Connection pool settings (ignored by SQLite)
+app.config['DB_POOL_SIZE'] = int(os.getenv('db_pool_size', '10'))
+app.config['DB_MAX_OVERFLOW'] = int(os.getenv('db_max_overflow', '20'))
+# Seconds before a connection is replaced, below MySQL's wait_timeout
+app.config['DB_POOL_RECYCLE'] = int(os.getenv('db_pool_recycle', '1800'))
+# Check connections are alive before handing them out
+app.config['DB_POOL_PRE_PING'] = os.getenv('db_pool_pre_ping', '1') != '0'
+# Milliseconds before a query is cancelled (0 to disable)
+app.config['DB_STATEMENT_TIMEOUT'] = int(
+    os.getenv('db_statement_timeout', '30000'))
+# Seconds a SQLite writer waits for the lock before failing
+app.config['SQLITE_BUSY_TIMEOUT'] = float(
+    os.getenv('sqlite_busy_timeout', '30'))
+
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'connect_args': {
+            'timeout': app.config['SQLITE_BUSY_TIMEOUT'],
+        },
+    }
+else:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': app.config['DB_POOL_PRE_PING'],
+    }
 
 # Temporary for testing, add proper secret key in .env file later
 app.config['SECRET_KEY'] = "UhzAQJY9PH"
+
+# Apply pending schema migrations when the app is imported.
+# Set auto_migrate=0 to run them with `python -m app.migrations` instead.
+app.config['AUTO_MIGRATE'] = os.getenv('auto_migrate', '1') != '0'
+
+# Seconds a logged in user is kept in the per-process user cache
+app.config['USER_CACHE_TTL'] = float(os.getenv('user_cache_ttl', '5'))
+# Users kept in it at most, the least recently used are dropped first
+app.config['USER_CACHE_SIZE'] = int(os.getenv('user_cache_size', '10000'))
+
+# Listings whose booked dates are kept in the per-process availability
+# engine, the least recently used are dropped first
+app.config['AVAILABILITY_CACHE_SIZE'] = int(
+    os.getenv('availability_cache_size', '10000'))
+
+# Characters of rendered listing rows kept in the per-process cache
+app.config['FRAGMENT_CACHE_SIZE'] = int(
+    os.getenv('fragment_cache_size', str(16 * 1024 * 1024)))
+
+# Backend of the model function cache (see app/cache.py): '' (disabled),
+# 'memory://' or 'redis://host:port/db', and seconds the values are kept
+app.config['CACHE_URL'] = os.getenv('cache_url', '')
+app.config['CACHE_TTL'] = float(os.getenv('cache_ttl', '60'))
+
+# Time the requests, their SQL statements and templates, and serve the
+# histograms at /metrics (see app/metrics.py)
+app.config['METRICS_ENABLED'] = os.getenv('metrics', '1') != '0'
+# Bearer token of the scrapers of /metrics, not served if empty
+app.config['METRICS_TOKEN'] = os.getenv('metrics_token', '')
+
+# Log the SQL statements slower than this many ms, with their plan, at
+# most SLOW_QUERY_LOG_RATE per minute: 0 to disable
+# (see app/slow_queries.py)
+app.config['SLOW_QUERY_MS'] = float(os.getenv('slow_query_ms', '200'))
+app.config['SLOW_QUERY_LOG_RATE'] = int(os.getenv('slow_query_log_rate',
+                                                  '10'))
+# Log the values of their parameters, not only their types: off by
+# default, the parameters hold passwords and emails
+app.config['SLOW_QUERY_LOG_PARAMETERS'] = os.getenv(
+    'slow_query_log_parameters', '0') != '0'
+
+# Emails of the users allowed to call /debug/profile, comma-separated
+app.config['ADMIN_EMAILS'] = frozenset(
+    email.strip() for email in os.getenv('admin_emails', '').split(',')
+    if email.strip())
+
+# Profile every request with cProfile, and keep the stats of those slower
+# than PROFILE_MIN_MS in PROFILE_DIR (see app/profiler.py)
+app.config['PROFILE_REQUESTS'] = os.getenv('profile_requests', '0') != '0'
+app.config['PROFILE_DIR'] = os.getenv('profile_dir', 'profiles')
+app.config['PROFILE_MIN_MS'] = float(os.getenv('profile_min_ms', '0'))
 app.app_context().push()
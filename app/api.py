@@ -0,0 +1,310 @@
+from datetime import datetime
+from flask import Blueprint, jsonify, request, session
+from app import app
+from app.models import login, create_listing, update_listing, update_user, \
+    create_booking, browse_listings_page, find_listing_fields, \
+    find_listings_fields, find_bookings_fields, find_listing_by_title, \
+    search_listings, suggest_titles, create_property, location_facets, \
+    LISTING_FIELDS, BOOKING_FIELDS, PAGE_SIZE
+from app.controllers import load_user, export_value, location_filters
+from app.user_cache import user_cache
+
+'''
+JSON API for the mobile client, mirroring the HTML routes under /api/v1.
+The client logs in with POST /api/v1/login and keeps the session cookie.
+
+The listings and bookings are loaded as column-only rows, and every GET
+accepts ?fields=id,title,price to load and return only those columns
+(e.g. to leave out the descriptions of a browse page).
+'''
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Columns of a property
+PROPERTY_FIELDS = ('id', 'address', 'size', 'guests', 'city', 'state',
+                   'country', 'zip_code', 'owner_id', 'latitude',
+                   'longitude')
+
+# Columns of the user profile (never the password)
+PROFILE_FIELDS = ('id', 'username', 'email', 'real_name', 'billing_address',
+                  'postal_code', 'balance')
+
+
+class ApiError(Exception):
+    '''
+    Raised by the API routes to answer with a JSON error
+    '''
+
+    def __init__(self, message, status=400):
+        Exception.__init__(self, message)
+        self.message = message
+        self.status = status
+
+
+@api.errorhandler(ApiError)
+def api_error(error):
+    return jsonify(error=error.message), error.status
+
+
+def api_authenticate(inner_function):
+    '''
+    Like authenticate in app/controllers.py, but answers 401
+    instead of redirecting to the login page
+    '''
+
+    def wrapped_inner(*args, **kwargs):
+        user_id = session.get('logged_in')
+        user = None
+        if isinstance(user_id, int):
+            user = user_cache.get(user_id, load_user)
+        if not user:
+            raise ApiError('Login required', 401)
+        return inner_function(user, *args, **kwargs)
+
+    wrapped_inner.__name__ = inner_function.__name__
+    return wrapped_inner
+
+
+def requested_fields(allowed):
+    '''
+    Read the ?fields= parameter
+      Parameters:
+        allowed (tuple):    the columns that can be selected
+      Returns:
+        The list of columns, all of them if the parameter is missing
+    '''
+    fields = request.args.get('fields')
+    if not fields:
+        return list(allowed)
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown or not fields:
+        raise ApiError('Unknown fields: {}. Allowed: {}'.format(
+            ', '.join(unknown), ', '.join(allowed)))
+    return fields
+
+
+def serialize(row, fields):
+    '''
+    Turn a row (or any object with the fields as attributes) into a dict
+    '''
+    return {field: export_value(getattr(row, field)) for field in fields}
+
+
+def json_body():
+    '''
+    The JSON object sent by the client
+    '''
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ApiError('Expected a JSON object')
+    return body
+
+
+def string_field(body, name, default=None):
+    '''
+    A text field of the body, `default` if it is missing
+    '''
+    value = body.get(name, default)
+    if not isinstance(value, str):
+        raise ApiError('Invalid {}'.format(name.replace('_', ' ')))
+    return value
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ApiError('Dates must be YYYY-MM-DD')
+
+
+@api.route('/login', methods=['POST'])
+def api_login():
+    body = json_body()
+    user = login(body.get('email'), body.get('password'))
+    if not user:
+        raise ApiError('Incorrect email or password', 401)
+    session['logged_in'] = user.id
+    return jsonify(serialize(user, PROFILE_FIELDS))
+
+
+@api.route('/logout', methods=['POST'])
+def api_logout():
+    session.pop('logged_in', None)
+    return '', 204
+
+
+@api.route('/user', methods=['GET'])
+@api_authenticate
+def get_profile(user):
+    return jsonify(serialize(user, requested_fields(PROFILE_FIELDS)))
+
+
+# Update the profile: the fields missing from the body are unchanged
+@api.route('/user', methods=['PATCH'])
+@api_authenticate
+def patch_profile(user):
+    body = json_body()
+    success = update_user(
+        user.username,
+        string_field(body, 'username', user.username),
+        string_field(body, 'email', user.email),
+        string_field(body, 'billing_address', user.billing_address),
+        string_field(body, 'postal_code', user.postal_code),
+        string_field(body, 'password', user.password))
+    if not success:
+        raise ApiError('Update failed')
+    user = user_cache.get(user.id, load_user)
+    return jsonify(serialize(user, PROFILE_FIELDS))
+
+
+# Listings of the logged in user
+@api.route('/user/listings', methods=['GET'])
+@api_authenticate
+def get_own_listings(user):
+    fields = requested_fields(LISTING_FIELDS)
+    return jsonify(listings=[serialize(row, fields) for row in
+                             find_listings_fields(user.id, fields)])
+
+
+# Bookings made by the logged in user
+@api.route('/user/bookings', methods=['GET'])
+@api_authenticate
+def get_own_bookings(user):
+    fields = requested_fields(BOOKING_FIELDS)
+    return jsonify(bookings=[serialize(row, fields) for row in
+                             find_bookings_fields(user.id, fields)])
+
+
+# Browse the listings of the other users, one page at a time
+# (same parameters as /browse-listings)
+@api.route('/listings', methods=['GET'])
+@api_authenticate
+def get_listings(user):
+    fields = requested_fields(LISTING_FIELDS)
+    listings, next_cursor = browse_listings_page(
+        user.id, sort=request.args.get('sort', 'price'),
+        after=request.args.get('after'),
+        min_price=request.args.get('min_price', type=float),
+        max_price=request.args.get('max_price', type=float),
+        title_prefix=request.args.get('q', ''),
+        limit=request.args.get('limit', PAGE_SIZE, type=int),
+        fields=fields, **location_filters())
+    return jsonify(listings=[serialize(row, fields) for row in listings],
+                   next=next_cursor)
+
+
+# Number of listings of the other users by country, by state of
+# ?country=, or by city of ?country= and ?state=
+@api.route('/locations', methods=['GET'])
+@api_authenticate
+def get_locations(user):
+    facets = location_facets(user.id, request.args.get('country'),
+                             request.args.get('state'))
+    return jsonify(locations=[{'name': name, 'listings': count}
+                              for name, count in facets])
+
+
+# Create a property of the logged in user, to attach listings to
+@api.route('/properties', methods=['POST'])
+@api_authenticate
+def post_property(user):
+    body = json_body()
+    prop = create_property(
+        body.get('address'), body.get('size'), body.get('guests'),
+        body.get('city'), body.get('state'), body.get('country'),
+        body.get('zip_code'), user.id, body.get('latitude'),
+        body.get('longitude'))
+    if prop is None:
+        raise ApiError('Creation failed')
+    return jsonify(serialize(prop, PROPERTY_FIELDS)), 201
+
+
+# Full-text search of the listings of the other users, best match first
+@api.route('/listings/search', methods=['GET'])
+@api_authenticate
+def get_search(user):
+    fields = requested_fields(LISTING_FIELDS)
+    listings = search_listings(
+        request.args.get('q', ''), user.id,
+        limit=request.args.get('limit', PAGE_SIZE, type=int), fields=fields)
+    return jsonify(listings=[serialize(row, fields) for row in listings])
+
+
+# Titles of the listings of the other users starting with ?q=
+# (any case), for autocompletion
+@api.route('/listings/suggest', methods=['GET'])
+@api_authenticate
+def get_suggestions(user):
+    suggestions = suggest_titles(request.args.get('q', ''), user.id,
+                                 limit=request.args.get('limit', 10, type=int))
+    return jsonify(suggestions=[{'id': listing_id, 'title': title}
+                                for listing_id, title in suggestions])
+
+
+@api.route('/listings/<int:listing_id>', methods=['GET'])
+@api_authenticate
+def get_listing(user, listing_id):
+    fields = requested_fields(LISTING_FIELDS)
+    listing = find_listing_fields(listing_id, fields)
+    if listing is None:
+        raise ApiError('Listing not found', 404)
+    return jsonify(serialize(listing, fields))
+
+
+@api.route('/listings', methods=['POST'])
+@api_authenticate
+def post_listing(user):
+    body = json_body()
+    title = string_field(body, 'title')
+    description = string_field(body, 'description')
+    property_id = body.get('property_id')
+    if property_id is not None and not isinstance(property_id, int):
+        raise ApiError('Invalid property')
+    if not create_listing(title, description, str(body.get('price')),
+                          str(user.id), property_id):
+        raise ApiError('Creation failed')
+    listing = find_listing_by_title(title)[0]
+    return jsonify(serialize(listing, LISTING_FIELDS)), 201
+
+
+# Update a listing of the logged in user: the fields missing from
+# the body are unchanged
+@api.route('/listings/<int:listing_id>', methods=['PATCH'])
+@api_authenticate
+def patch_listing(user, listing_id):
+    listing = find_listing_fields(listing_id)
+    if listing is None:
+        raise ApiError('Listing not found', 404)
+    if listing.owner_id != user.id:
+        raise ApiError('Not the owner of the listing', 403)
+    body = json_body()
+    try:
+        price = float(body.get('price', listing.price))
+    except (TypeError, ValueError):
+        raise ApiError('Invalid price')
+    if not update_listing(listing_id,
+                          string_field(body, 'title', listing.title),
+                          string_field(body, 'description',
+                                       listing.description),
+                          listing.price, price, user.id):
+        raise ApiError('Update failed')
+    return jsonify(serialize(find_listing_fields(listing_id),
+                             LISTING_FIELDS))
+
+
+# Book a listing for the logged in user
+@api.route('/listings/<int:listing_id>/bookings', methods=['POST'])
+@api_authenticate
+def post_booking(user, listing_id):
+    body = json_body()
+    start = parse_date(body.get('start'))
+    end = parse_date(body.get('end'))
+    if find_listing_fields(listing_id, ['id']) is None:
+        raise ApiError('Listing not found', 404)
+    if not create_booking(listing_id, user.id, start, end):
+        raise ApiError('Booking failed', 409)
+    return jsonify(start=start.isoformat(), end=end.isoformat()), 201
+
+
+app.register_blueprint(api)
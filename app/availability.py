@@ -0,0 +1,181 @@
+import threading
+from collections import OrderedDict
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+'''
+This file defines the availability engine used to check booking conflicts
+'''
+
+
+def as_date(value):
+    # The booking form gives datetimes, the database gives dates
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+class Availability:
+    """
+    The booked date ranges of one listing, kept as sorted lists of
+    non-overlapping closed intervals [start, end].
+    Since the intervals do not overlap, sorting them by start also
+    sorts them by end, so both lists can be searched with bisect.
+    """
+
+    def __init__(self, intervals=()):
+        self.starts = []
+        self.ends = []
+        # Merge overlapping ranges, which only old data can contain
+        for start, end in sorted(intervals):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def is_free(self, start, end):
+        '''
+        Check if no booked range overlaps [start, end]
+          Parameters:
+            start (date):   first day
+            end   (date):   last day
+          Returns:
+            True if the range is free otherwise False
+        '''
+        start, end = as_date(start), as_date(end)
+        # Last booked range starting on or before the end
+        i = bisect_right(self.starts, end)
+        return i == 0 or self.ends[i - 1] < start
+
+    def add(self, start, end):
+        '''
+        Record a booked range (must be free)
+        '''
+        start, end = as_date(start), as_date(end)
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+
+    def next_free_window(self, nights, after):
+        '''
+        Find the first free range of the given length
+          Parameters:
+            nights (int):   length of the stay, the range is
+                            [start, start + nights]
+            after  (date):  earliest possible start
+          Returns:
+            A tuple (start, end) of the first free range
+        '''
+        after = as_date(after)
+        length = timedelta(days=nights)
+        one_day = timedelta(days=1)
+        start = after
+        i = bisect_right(self.starts, start)
+        # Move past the range containing the start, if any
+        if i > 0 and self.ends[i - 1] >= start:
+            start = self.ends[i - 1] + one_day
+        # Then past every range that does not leave enough room
+        while i < len(self.starts) and self.starts[i] <= start + length:
+            start = max(start, self.ends[i] + one_day)
+            i += 1
+        return start, start + length
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class AvailabilityEngine:
+    """
+    The availability of the listings, built lazily from the bookings.
+    Each listing's intervals are tagged with the version of the listing
+    row, which every booking bumps. The callers holding the row pass its
+    version, the others read it by primary key, and the intervals are
+    rebuilt when bookings were made by another process. Bookings deleted
+    outside the model functions need invalidate.
+    At most `max_listings` listings are kept, the least recently used
+    are dropped first.
+    """
+
+    def __init__(self, load, version, max_listings=10000):
+        '''
+          Parameters:
+            load         (function):  listing id -> list of (start, end)
+            version      (function):  listing id -> version of the listing
+            max_listings (int):       listings kept at most
+        '''
+        self.load = load
+        self.version = version
+        self.max_listings = max_listings
+        # listing id -> (version, Availability), least recently used first
+        self.listings = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, listing_id, version=None):
+        '''
+          Parameters:
+            listing_id (int):   listing id
+            version    (int):   current version of the listing, read
+                                from the database if None
+          Returns:
+            The up to date Availability of the listing
+        '''
+        if version is None:
+            version = self.version(listing_id)
+        with self.lock:
+            entry = self.listings.get(listing_id)
+            if entry is not None and entry[0] == version:
+                self.listings.move_to_end(listing_id)
+                return entry[1]
+        availability = Availability(self.load(listing_id))
+        with self.lock:
+            self.store(listing_id, version, availability)
+        return availability
+
+    def store(self, listing_id, version, availability):
+        # Called with the lock held
+        self.listings[listing_id] = (version, availability)
+        self.listings.move_to_end(listing_id)
+        while len(self.listings) > self.max_listings:
+            self.listings.popitem(last=False)
+
+    def is_free(self, listing_id, start, end, version=None):
+        availability = self.get(listing_id, version)
+        # Hold the lock so a concurrent insert is never half seen
+        with self.lock:
+            return availability.is_free(start, end)
+
+    def next_free_window(self, listing_id, nights, after):
+        availability = self.get(listing_id)
+        with self.lock:
+            return availability.next_free_window(nights, after)
+
+    def added(self, listing_id, start, end, version):
+        '''
+        Keep the intervals in sync after a booking was committed
+          Parameters:
+            listing_id (int):    id of the booked listing
+            start      (date):   first day
+            end        (date):   last day
+            version    (int):    version of the listing the booking
+                                 wrote
+        '''
+        with self.lock:
+            entry = self.listings.get(listing_id)
+            # The booking checked the intervals of the version it bumped
+            if entry is None or entry[0] != version - 1:
+                self.listings.pop(listing_id, None)
+                return
+            availability = entry[1]
+            availability.add(start, end)
+            self.store(listing_id, version, availability)
+
+    def invalidate(self, listing_id=None):
+        '''
+        Forget one listing (or all of them), it is rebuilt on next use
+        '''
+        with self.lock:
+            if listing_id is None:
+                self.listings.clear()
+            else:
+                self.listings.pop(listing_id, None)
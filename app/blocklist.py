@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from collections import deque
+
+from app import package_dir
+
+'''
+This file defines the SQL injection blocklist used by the input validators
+'''
+
+# Default location of the generic SQL injection strings
+SQLI_FILE = os.path.join(
+    os.path.dirname(package_dir), "app_test", "Generic_SQLI.txt"
+)
+
+# Minimum number of seconds between two checks of the file's mtime
+CHECK_INTERVAL = 1.0
+
+
+class PatternMatcher:
+    """
+    A multi-pattern substring matcher (Aho-Corasick automaton).
+    Scanning a text costs time proportional to its length plus the
+    number of matches, no matter how many patterns are loaded.
+    """
+
+    def __init__(self, patterns):
+        # Each state is a dict of transitions, with a failure link and
+        # the list of patterns that end in that state
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+
+        for pattern in patterns:
+            if not pattern:
+                continue
+            state = 0
+            for c in pattern:
+                nxt = self.goto[state].get(c)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][c] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].append(pattern)
+
+        # Breadth first traversal to compute the failure links
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and c not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(c, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find(self, text):
+        '''
+        Find every pattern occurring in the text
+          Parameters:
+            text (string):     text to scan
+          Returns:
+            The set of patterns found in the text
+        '''
+        found = set()
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for c in text:
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class Blocklist:
+    """
+    A set of blocked strings loaded from a file (one entry per line).
+    The file is read once and re-read only when its mtime changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.checked_at = 0.0
+        self.entries = frozenset()
+        self.matcher = PatternMatcher(())
+        self.lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        '''
+        Read the file again if it changed since the last load
+        '''
+        with self.lock:
+            self.checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                return
+            if mtime == self.mtime:
+                return
+            with open(self.path, "r") as f:
+                # Only strip the line break, leading spaces are significant
+                entries = [line.rstrip("\r\n") for line in f]
+            entries = frozenset(e for e in entries if e)
+            # Swap both structures together so readers never see a mix
+            self.entries, self.matcher = entries, PatternMatcher(entries)
+            self.mtime = mtime
+
+    def refresh(self):
+        # Avoid a stat call on every lookup
+        if time.monotonic() - self.checked_at >= CHECK_INTERVAL:
+            self.reload()
+
+    def is_blocked(self, text):
+        '''
+        Check if the text is one of the blocked strings
+          Parameters:
+            text (string):     text to check
+          Returns:
+            True if the text is blocked otherwise False
+        '''
+        self.refresh()
+        return text in self.entries
+
+    def find(self, text):
+        '''
+        Find the blocked strings contained anywhere in the text
+          Parameters:
+            text (string):     text to scan
+          Returns:
+            The set of blocked strings found in the text
+        '''
+        self.refresh()
+        return self.matcher.find(text)
+
+
+sqli_blocklist = Blocklist(SQLI_FILE)
+
+
+def is_blocked(text):
+    '''
+    Check if the text is a generic SQL injection string
+      Parameters:
+        text (string):     text to check
+      Returns:
+        True if the text is blocked otherwise False
+    '''
+    return sqli_blocklist.is_blocked(text)
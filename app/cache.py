@@ -0,0 +1,520 @@
+import functools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+from app import app
+
+'''
+This file defines the cache layer shared by the model functions.
+
+A Cache stores values in a backend:
+    - NullBackend:  stores nothing (caching disabled, the default)
+    - LRUBackend:   in-process, least recently used entries dropped
+    - RedisBackend: a Redis (or compatible) server, shared by all the
+                    worker processes (see app/cache_server.py for a
+                    stand-in for local development)
+chosen with the cache_url environment variable: '', 'memory://',
+'memory://?size=50000' or 'redis://localhost:6379/0'.
+
+Entries can carry tags. Invalidating a tag replaces its token, which
+makes every entry stored with the old token a miss, in every process.
+
+Model functions opt in with the decorator:
+
+    @cache.cached(tags=lambda listing_id: ['listing:%d' % listing_id])
+    def find_listing_by_id(listing_id):
+        ...
+
+A backend that fails (e.g. the server is down) is counted as an error
+and treated as a miss, so the app keeps working from the database.
+
+The Redis backend stores the values as JSON (see dumps), never pickles:
+whoever can write to the server must not be able to run code in the
+workers. Tuples come back as lists.
+'''
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the keys holding the tag tokens
+TAG_PREFIX = '__tag__:'
+
+# Returned by Cache.call when the backend failed
+FAILED = object()
+
+
+class CacheError(Exception):
+    '''
+    Raised by the backends when the server answers with an error
+    '''
+
+
+def encode(value):
+    # json.dumps default: the types of the cached rows JSON lacks
+    if isinstance(value, SimpleNamespace):
+        return {'__namespace__': vars(value)}
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    raise TypeError('{} values are not cached'.format(
+        type(value).__name__))
+
+
+def decode(obj):
+    # json.loads object_hook, the inverse of encode
+    if len(obj) == 1:
+        if '__namespace__' in obj:
+            return SimpleNamespace(**obj['__namespace__'])
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        if '__date__' in obj:
+            return date.fromisoformat(obj['__date__'])
+    return obj
+
+
+def dumps(value):
+    '''
+    Serialize a value stored on a cache server
+      Returns:
+        JSON bytes, with the plain copies of the rows (SimpleNamespace),
+        dates and datetimes tagged
+      Raises:
+        CacheError if the value holds another type
+    '''
+    try:
+        return json.dumps(value, default=encode,
+                          separators=(',', ':')).encode()
+    except (TypeError, ValueError) as error:
+        raise CacheError(str(error))
+
+
+def loads(data):
+    '''
+    The value serialized by dumps
+      Raises:
+        CacheError if the data is not such a value
+    '''
+    try:
+        return json.loads(data, object_hook=decode)
+    except (TypeError, ValueError) as error:
+        raise CacheError('Invalid cached value: {}'.format(error))
+
+
+class NullBackend:
+    """
+    A backend that stores nothing
+    """
+
+    enabled = False
+    evictions = 0
+
+    def get_many(self, keys):
+        return {}
+
+    def set_many(self, mapping, ttl=None):
+        pass
+
+    def delete_many(self, keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUBackend:
+    """
+    An in-process backend keeping at most `max_entries` entries. The
+    least recently used entries are dropped first, and the expired
+    ones when they are read. Each worker process has its own copy.
+    """
+
+    enabled = True
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        # key -> (expiry time or None, value)
+        self.entries = OrderedDict()
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] is not None and entry[0] <= now:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = entry[1]
+        return found
+
+    def set_many(self, mapping, ttl=None):
+        expiry = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            for key, value in mapping.items():
+                self.entries[key] = (expiry, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisBackend:
+    """
+    A backend storing JSON values (see dumps) on a server speaking the
+    Redis protocol (RESP). Each thread keeps its own connection, opened on
+    first use, and reopened in a forked worker process.
+    Eviction is done by the server (its maxmemory-policy), so the
+    evictions are not counted here.
+    """
+
+    enabled = True
+    evictions = 0
+
+    def __init__(self, host='localhost', port=6379, db=0, timeout=1.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self):
+        local = self.local
+        # A connection inherited from the parent process is not ours
+        if getattr(local, 'pid', None) != os.getpid():
+            sock = socket.create_connection((self.host, self.port),
+                                            timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            local.sock = sock
+            local.reader = sock.makefile('rb')
+            local.pid = os.getpid()
+            if self.db:
+                self.execute(['SELECT', self.db])
+        return local
+
+    def close(self):
+        local = self.local
+        if getattr(local, 'pid', None) == os.getpid():
+            local.reader.close()
+            local.sock.close()
+        local.pid = None
+
+    def execute(self, *commands):
+        '''
+        Send the commands at once (pipelining), and read their replies
+          Parameters:
+            commands (list):  each a list of str, bytes or int arguments
+          Returns:
+            The list of replies
+        '''
+        data = []
+        for command in commands:
+            data.append(b'*%d\r\n' % len(command))
+            for arg in command:
+                if not isinstance(arg, bytes):
+                    arg = str(arg).encode()
+                data.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        try:
+            local = self.connection()
+            local.sock.sendall(b''.join(data))
+            replies = [self.read_reply(local.reader) for _ in commands]
+        except (OSError, ValueError):
+            # The connection is in an unknown state
+            self.close()
+            raise
+        errors = [reply for reply in replies if isinstance(reply, CacheError)]
+        if errors:
+            raise errors[0]
+        return replies
+
+    def read_reply(self, reader):
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise OSError('Connection closed by the cache server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            return CacheError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            return reader.read(length + 2)[:-2]
+        if kind == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self.read_reply(reader) for _ in range(length)]
+        raise OSError('Unexpected reply from the cache server')
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.execute(['MGET'] + keys)[0]
+        return {key: loads(value)
+                for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, mapping, ttl=None):
+        commands = []
+        for key, value in mapping.items():
+            command = ['SET', key, dumps(value)]
+            if ttl:
+                command += ['PX', int(ttl * 1000)]
+            commands.append(command)
+        if commands:
+            self.execute(*commands)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        if keys:
+            self.execute(['DEL'] + keys)
+
+    def clear(self):
+        self.execute(['FLUSHDB'])
+
+
+def backend_from_url(url):
+    '''
+    Build the backend described by a cache url
+      Parameters:
+        url (string):   '', 'memory://[?size=N]' or
+                        'redis://host[:port][/db][?timeout=seconds]'
+      Returns:
+        The backend
+    '''
+    if not url:
+        return NullBackend()
+    parsed = urlparse(url)
+    options = parse_qs(parsed.query)
+    if parsed.scheme == 'memory':
+        return LRUBackend(int(options.get('size', ['10000'])[0]))
+    if parsed.scheme == 'redis':
+        return RedisBackend(
+            host=parsed.hostname or 'localhost', port=parsed.port or 6379,
+            db=int(parsed.path.strip('/') or 0),
+            timeout=float(options.get('timeout', ['1'])[0]))
+    raise ValueError('Unknown cache url: {}'.format(url))
+
+
+class Cache:
+    """
+    Get, set and delete values in a backend, with a time to live,
+    a namespace (prefix of the keys) and tags. The namespaces made
+    with namespace() share the backend and the counters of their root.
+    """
+
+    def __init__(self, backend, default_ttl=60, prefix='', root=None):
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+        self.root = root or self
+        if root is None:
+            self.backend = backend
+            self.counters = {'hits': 0, 'misses': 0, 'sets': 0,
+                             'errors': 0}
+            self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.root.backend.enabled
+
+    def namespace(self, name):
+        '''
+        A view of the cache whose keys are prefixed with the name
+        '''
+        return Cache(None, self.default_ttl,
+                     '{}{}:'.format(self.prefix, name), self.root)
+
+    def count(self, counter, amount=1):
+        with self.root.lock:
+            self.root.counters[counter] += amount
+
+    def call(self, method, *args):
+        '''
+        Call the backend, counting a failure as an error
+          Returns:
+            The result, or FAILED if the backend failed
+        '''
+        try:
+            return getattr(self.root.backend, method)(*args)
+        except (OSError, CacheError) as error:
+            self.count('errors')
+            logger.warning('Cache %s failed: %s', method, error)
+            return FAILED
+
+    def tag_tokens(self, tags):
+        '''
+        The current token of each tag, created if missing
+          Returns:
+            A dict tag -> token, or None if the backend failed
+        '''
+        keys = [TAG_PREFIX + tag for tag in tags]
+        tokens = self.call('get_many', keys)
+        if tokens is FAILED:
+            return None
+        missing = {key: uuid.uuid4().hex for key in keys
+                   if key not in tokens}
+        if missing:
+            if self.call('set_many', missing) is FAILED:
+                return None
+            tokens.update(missing)
+        return {tag: tokens[TAG_PREFIX + tag] for tag in tags}
+
+    def get_many(self, keys):
+        '''
+        Find values in the cache
+          Parameters:
+            keys (list):    keys of the values
+          Returns:
+            A dict with the keys found, and their values
+        '''
+        keys = list(keys)
+        entries = self.call('get_many', [self.prefix + key for key in keys])
+        found = {}
+        if entries and entries is not FAILED:
+            tags = {tag for entry in entries.values() for tag in entry[1]}
+            tokens = self.call('get_many',
+                               [TAG_PREFIX + tag for tag in tags]) \
+                if tags else {}
+            for key in keys:
+                entry = entries.get(self.prefix + key)
+                # Stale if one of its tags was invalidated since
+                if entry is not None and tokens is not FAILED and all(
+                        tokens.get(TAG_PREFIX + tag) == token
+                        for tag, token in entry[1].items()):
+                    found[key] = entry[0]
+        self.count('hits', len(found))
+        self.count('misses', len(keys) - len(found))
+        return found
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, mapping, ttl=None, tags=(), tokens=None):
+        '''
+        Store values in the cache
+          Parameters:
+            mapping (dict):     key -> value
+            ttl     (float):    seconds before they expire, the default
+                                ttl if None, never if 0
+            tags    (list):     tags of the values
+            tokens  (dict):     tokens of the tags, read before the
+                                values were computed (optional)
+        '''
+        if tokens is None:
+            tokens = self.tag_tokens(tags) if tags else {}
+        if tokens is None:
+            return
+        if ttl is None:
+            ttl = self.default_ttl
+        self.call('set_many', {self.prefix + key: (value, tokens)
+                               for key, value in mapping.items()}, ttl)
+        self.count('sets', len(mapping))
+
+    def set(self, key, value, ttl=None, tags=()):
+        self.set_many({key: value}, ttl, tags)
+
+    def delete_many(self, keys):
+        self.call('delete_many', [self.prefix + key for key in keys])
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def invalidate_tags(self, *tags):
+        '''
+        Make every value stored with one of the tags a miss
+        '''
+        if tags and self.enabled:
+            self.call('set_many', {TAG_PREFIX + tag: uuid.uuid4().hex
+                                   for tag in tags})
+
+    def clear(self):
+        '''
+        Remove everything from the backend, and reset the counters
+        '''
+        self.call('clear')
+        with self.root.lock:
+            for counter in self.root.counters:
+                self.root.counters[counter] = 0
+
+    def stats(self):
+        '''
+        Returns:
+            The hit, miss, set, error and eviction counters,
+            and the hit ratio
+        '''
+        with self.root.lock:
+            stats = dict(self.root.counters)
+        stats['evictions'] = self.root.backend.evictions
+        total = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / total if total else 0.0
+        return stats
+
+    def cached(self, ttl=None, tags=(), prepare=None, cache_if=None):
+        '''
+        Decorator caching the results of a function, by arguments
+          Parameters:
+            ttl      (float):       seconds the results are kept
+            tags     (list or function): tags of the results, or a
+                                    function of the arguments giving them
+            prepare  (function):    converts the result into what is
+                                    stored and returned, e.g. ORM objects
+                                    into plain copies (not called while
+                                    caching is disabled)
+            cache_if (function):    only results for which it returns
+                                    True are stored (optional)
+        '''
+        def decorator(function):
+            name = '{}.{}:'.format(function.__module__, function.__name__)
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                key = name + repr((args, sorted(kwargs.items())))
+                found = self.get_many([key])
+                if key in found:
+                    return found[key]
+                entry_tags = tags(*args, **kwargs) if callable(tags) \
+                    else tags
+                # Read the tokens first: an invalidation while the
+                # function runs makes this result stale right away
+                tokens = self.tag_tokens(entry_tags) if entry_tags else {}
+                result = function(*args, **kwargs)
+                if prepare is not None:
+                    result = prepare(result)
+                if cache_if is None or cache_if(result):
+                    self.set_many({key: result}, ttl, tokens=tokens)
+                return result
+
+            wrapper.uncached = function
+            return wrapper
+        return decorator
+
+
+cache = Cache(backend_from_url(app.config['CACHE_URL']),
+              default_ttl=app.config['CACHE_TTL'])
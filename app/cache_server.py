@@ -0,0 +1,132 @@
+import argparse
+import socketserver
+import threading
+import time
+
+'''
+A small stand-in for a Redis server, for local development and tests
+of the redis:// cache backend when no Redis is installed:
+
+    python -m app.cache_server --port 6379
+    cache_url=redis://localhost:6379 python -m app
+
+It keeps the values in memory and only knows the commands used by
+RedisBackend (PING, GET, MGET, SET with EX/PX, DEL, FLUSHDB, SELECT,
+DBSIZE). Use a real Redis in production.
+'''
+
+
+class CacheServer(socketserver.ThreadingTCPServer):
+    """
+    The server: one thread per client connection, sharing the values
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        socketserver.ThreadingTCPServer.__init__(self, address,
+                                                 CacheHandler)
+        # key -> (expiry time or None, value)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def lookup(self, key, now):
+        # Called with the lock held
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= now:
+            del self.values[key]
+            return None
+        return entry[1]
+
+
+class CacheHandler(socketserver.StreamRequestHandler):
+    """
+    Reads the commands of a client and writes the replies
+    """
+
+    def handle(self):
+        while True:
+            try:
+                command = self.read_command()
+            except (OSError, ValueError):
+                return
+            if command is None:
+                return
+            self.wfile.write(self.run(command))
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            raise ValueError('Expected an array')
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def run(self, command):
+        name = command[0].upper().decode()
+        args = command[1:]
+        server = self.server
+        now = time.monotonic()
+        with server.lock:
+            if name == 'PING':
+                return b'+PONG\r\n'
+            if name == 'SELECT' or name == 'FLUSHDB' and not args:
+                if name == 'FLUSHDB':
+                    server.values.clear()
+                return b'+OK\r\n'
+            if name == 'DBSIZE':
+                return b':%d\r\n' % len(server.values)
+            if name == 'GET' and len(args) == 1:
+                return bulk(server.lookup(args[0], now))
+            if name == 'MGET' and args:
+                return b'*%d\r\n' % len(args) + b''.join(
+                    bulk(server.lookup(key, now)) for key in args)
+            if name == 'DEL' and args:
+                deleted = sum(server.values.pop(key, None) is not None
+                              for key in args)
+                return b':%d\r\n' % deleted
+            if name == 'SET' and len(args) in (2, 4):
+                expiry = None
+                if len(args) == 4:
+                    unit = args[2].upper()
+                    if unit not in (b'EX', b'PX'):
+                        return b'-ERR syntax error\r\n'
+                    expiry = now + int(args[3]) / (
+                        1000 if unit == b'PX' else 1)
+                server.values[args[0]] = (expiry, args[1])
+                return b'+OK\r\n'
+        return b'-ERR unknown command or wrong number of arguments\r\n'
+
+
+def bulk(value):
+    if value is None:
+        return b'$-1\r\n'
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m app.cache_server',
+        description='In-memory stand-in for a Redis cache server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args(argv)
+    server = CacheServer((args.host, args.port))
+    print('Cache server listening on {}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,29 @@
-from flask import render_template, request, session, redirect
+from flask import render_template, request, session, redirect, url_for, \
+    jsonify, Response, stream_with_context
 from app.models import create_listing, login, User, register, update_listing, \
-    update_user, find_listings, find_listing_by_id, browse_listings, \
-    find_bookings, create_booking, find_booked_listing
+    update_user, find_listing_by_id, browse_listings_page, create_booking, \
+    load_dashboard, find_availability, PAGE_SIZE, iter_user_bookings, \
+    iter_user_listings, BOOKING_EXPORT_COLUMNS, LISTING_EXPORT_COLUMNS, \
+    browse_version, search_listings
 
 from app import app
-from datetime import datetime
+from app.user_cache import user_cache, snapshot
+from datetime import datetime, date
+import csv
+import hashlib
+import io
+import json
+
+
+def load_user(user_id):
+    """
+    Load the user stored in the session, for the user cache.
+    Returns a snapshot of the user, or None if it does not exist.
+    """
+    user = User.query.filter_by(id=user_id).one_or_none()
+    if user is None:
+        return None
+    return snapshot(user)
 
 
 def authenticate(inner_function):
@@ -24,9 +43,13 @@ def authenticate(inner_function):
 
         # check did we store the key in the session
         if 'logged_in' in session:
-            email = session['logged_in']
+            user_id = session['logged_in']
+            # Sessions created before the id was stored hold the email
+            if not isinstance(user_id, int):
+                session.pop('logged_in', None)
+                return redirect('/login')
             try:
-                user = User.query.filter_by(email=email).one_or_none()
+                user = user_cache.get(user_id, load_user)
                 if user:
                     # if the user exists, call the inner_function
                     # with user as parameter
@@ -44,6 +67,41 @@ def authenticate(inner_function):
     return wrapped_inner
 
 
+def make_etag(*parts):
+    """
+    Strong ETag of a page, from the versions of what it shows
+    """
+    key = '/'.join(str(part) for part in parts)
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def not_modified(etag):
+    """
+    Answer a conditional GET without rendering the page.
+    Returns a 304 response if the client's copy is current, else None.
+    Only the ETag is validated: the modified dates of the listings have
+    no time, so If-Modified-Since cannot tell two copies of a day apart.
+    """
+    if not request.if_none_match or \
+            not request.if_none_match.contains(etag):
+        return None
+    return cache_headers(app.response_class(status=304), etag)
+
+
+def cache_headers(response, etag):
+    """
+    Set the validator of a page. The pages depend on the logged in
+    user, so shared caches must not store them, and browsers must
+    revalidate them.
+    """
+    if not isinstance(response, app.response_class):
+        response = app.make_response(response)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
 @app.route('/login', methods=['GET'])
 def login_get():
     return render_template('login.html',
@@ -56,15 +114,16 @@ def login_post():
     password = request.form.get('password')
     user = login(email, password)
     if user:
-        session['logged_in'] = user.email
+        session['logged_in'] = user.id
         """
         Session is an object that contains sharing information
         between a user's browser and the end server.
         Typically it is packed and stored in the browser cookies.
         They will be past along between every request the browser made
-        to this services. Here we store the user object into the
+        to this services. Here we store the user id into the
         session, so we can tell if the client has already login
-        in the following sessions.
+        in the following sessions. The id never changes, unlike
+        the email.
         """
         # success! go back to the home page
         # code 303 is to force a 'GET' request
@@ -82,9 +141,7 @@ def home(user):
     # by using @authenticate, we don't need to re-write
     # the login checking code all the time for other
     # front-end portals
-    listings = find_listings(user.id)
-    bookings = find_bookings(user.id)
-    bookedListings = find_booked_listing(user.id)
+    listings, bookings, bookedListings = load_dashboard(user.id)
 
     return render_template('index.html', user=user, listings=listings,
                            bookings=bookings, bookedListings=bookedListings)
@@ -173,11 +230,17 @@ def post_update_user(user):
 @app.route('/update-listing/<int:listing_id>', methods=['GET'])
 def get_update_listing(listing_id):
     listing = find_listing_by_id(listing_id)
+    # The page only changes with the listing
+    etag = make_etag('update-listing', listing[0].id, listing[0].version)
+    response = not_modified(etag)
+    if response:
+        return response
     # Return the template with the listing's current information
-    return render_template(
+    return cache_headers(render_template(
         'update_listing.html',
         listing=listing[0],
-        msg="Please modify the information you want to update below.")
+        msg="Please modify the information you want to update below."),
+        etag)
 
 
 # Route to receive the updated listing information
@@ -236,26 +299,92 @@ def post_create_listing(user):
         msg="Creation Failed!")
 
 
-# Route to browse all listings
+def location_filters():
+    '''
+    Read the location filters of the browse pages from the query
+    string: country, state, city, zip (prefix), and lat, lon and km
+    for a radius (ignored unless all three are valid)
+      Returns:
+        The keyword arguments of browse_listings_page
+    '''
+    args = request.args
+    filters = {name: args.get(name, '').strip() or None
+               for name in ('country', 'state', 'city')}
+    filters['zip_prefix'] = args.get('zip', '').strip() or None
+    latitude = args.get('lat', type=float)
+    longitude = args.get('lon', type=float)
+    km = args.get('km', type=float)
+    filters['near'] = None
+    if latitude is not None and longitude is not None and km and \
+            -90 <= latitude <= 90 and -180 <= longitude <= 180 and km > 0:
+        filters['near'] = (latitude, longitude, km)
+    return filters
+
+
+# Route to browse the listings, one page at a time
 @app.route('/browse-listings', methods=['GET'])
 @authenticate
 def get_browse_listings(user):
-    listings = browse_listings(user.id)
-    return render_template(
+    # The page changes with the listings and the user's balance: check
+    # the last listing change before querying and rendering the page
+    etag = make_etag('browse-listings', user.id, user.version, user.balance,
+                     browse_version())
+    response = not_modified(etag)
+    if response:
+        return response
+
+    # Filters, sort order and cursor come from the query string
+    sort = request.args.get('sort', 'price')
+    min_price = request.args.get('min_price', type=float)
+    max_price = request.args.get('max_price', type=float)
+    title_prefix = request.args.get('q', '')
+    search = request.args.get('search', '')
+    limit = request.args.get('limit', PAGE_SIZE, type=int)
+
+    if search:
+        # Best matches of the words, on a single page
+        listings = search_listings(search, user.id, limit)
+        next_cursor = None
+    else:
+        listings, next_cursor = browse_listings_page(
+            user.id, sort=sort, after=request.args.get('after'),
+            min_price=min_price, max_price=max_price,
+            title_prefix=title_prefix, limit=limit, **location_filters())
+
+    # Keep the filters in the link to the next page
+    next_url = None
+    if next_cursor:
+        args = request.args.to_dict()
+        args['after'] = next_cursor
+        next_url = url_for('get_browse_listings', **args)
+    return cache_headers(render_template(
         'browse_listings.html',
         user=user,
-        listings=listings)
+        listings=listings,
+        sort=sort,
+        min_price=min_price,
+        max_price=max_price,
+        title_prefix=title_prefix,
+        search=search,
+        location=request.args,
+        next_url=next_url), etag)
 
 
 # Route to send the booking template
 @app.route('/book-listing/<int:listing_id>/<int:user_id>', methods=['GET'])
 def get_book_listing(listing_id, user_id):
     listing = find_listing_by_id(listing_id)
+    # The page only changes with the listing
+    etag = make_etag('book-listing', listing[0].id, listing[0].version)
+    response = not_modified(etag)
+    if response:
+        return response
     # Return the template with the listing's current information
-    return render_template(
+    return cache_headers(render_template(
         'book_listing.html',
         listing=listing[0],
-        msg="Please enter the dates you would like to book.")
+        msg="Please enter the dates you would like to book."),
+        etag)
 
 
 # Route to receive the updated booking information
@@ -280,3 +409,115 @@ def post_book_listing(listing_id, user_id):
             'book_listing.html',
             listing=listing[0],
             msg="Booking Failed!")
+
+
+# Route to check the availability of a listing
+# Either ?start=YYYY-MM-DD&end=YYYY-MM-DD to check a date range,
+# or ?nights=N[&after=YYYY-MM-DD] to find the first free window
+@app.route('/listing-availability/<int:listing_id>', methods=['GET'])
+def get_listing_availability(listing_id):
+    if not find_listing_by_id(listing_id):
+        return jsonify(error='Listing not found'), 404
+    try:
+        if 'nights' in request.args:
+            nights = int(request.args['nights'])
+            after = request.args.get('after')
+            if after:
+                after = datetime.strptime(after, '%Y-%m-%d').date()
+            if nights < 0:
+                raise ValueError
+            start, end = find_availability(listing_id, nights=nights,
+                                           after=after)
+            return jsonify(start=start.isoformat(), end=end.isoformat())
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date()
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        return jsonify(error='Give start and end dates, or nights'), 400
+    free = find_availability(listing_id, start_date=start, end_date=end)
+    return jsonify(free=free)
+
+
+# Rows written to the response at a time by the exports
+EXPORT_CHUNK_ROWS = 500
+
+
+def export_value(value):
+    """
+    Dates are exported in the YYYY-MM-DD format
+    """
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def csv_chunks(columns, rows):
+    """
+    Encode the rows as CSV, a few hundred rows per chunk.
+    The header is sent before the query runs.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for number, row in enumerate(rows, start=1):
+        writer.writerow([export_value(value) for value in row])
+        if number % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_chunks(columns, rows):
+    """
+    Encode the rows as JSON lines, a few hundred rows per chunk
+    """
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(
+            {column: export_value(value)
+             for column, value in zip(columns, row)}) + '\n')
+        if len(lines) == EXPORT_CHUNK_ROWS:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+def export_response(chunks, mimetype, filename):
+    """
+    Stream the chunks to the client as a file download. The rows are
+    read from the database while the response is sent, so the memory
+    used does not depend on the number of rows.
+    """
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = \
+        'attachment; filename="{}"'.format(filename)
+    return response
+
+
+# Export the bookings the user made, and the bookings of their listings
+@app.route('/export/bookings.csv', methods=['GET'])
+@authenticate
+def export_bookings(user):
+    return export_response(
+        csv_chunks(BOOKING_EXPORT_COLUMNS, iter_user_bookings(user.id)),
+        'text/csv', 'bookings.csv')
+
+
+# Export the listings of the user
+@app.route('/export/listings.jsonl', methods=['GET'])
+@authenticate
+def export_listings(user):
+    return export_response(
+        jsonl_chunks(LISTING_EXPORT_COLUMNS, iter_user_listings(user.id)),
+        'application/x-ndjson', 'listings.jsonl')
+
+
+# Connect the JSON API routes (app/api.py)
+from app import api  # noqa: E402,F401
+# Time the requests (app/metrics.py)
+from app import metrics  # noqa: E402,F401
+# Profile the worker (app/profiler.py)
+from app import profiler  # noqa: E402,F401
@@ -0,0 +1,116 @@
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+from app import app
+
+'''
+This file defines the cache of rendered HTML fragments: the cells of
+the listing rows shown by the browse and profile pages. A listing's
+cells only change with its row version, so they are rendered once and
+then copied into every page that shows the listing.
+'''
+
+
+class FragmentCache:
+    """
+    A least recently used cache of rendered fragments, keyed by
+    (listing id, listing version). The total length of the fragments
+    is kept under `max_size` characters, by dropping the least
+    recently used ones. Each worker process has its own cache.
+    """
+
+    def __init__(self, max_size=16 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        # Cached versions of each listing, for invalidate
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, render):
+        '''
+        Find a fragment in the cache, rendering it on a miss
+          Parameters:
+            key     (tuple):      (listing id, listing version)
+            render  (function):   called on a miss, returns the HTML
+          Returns:
+            The fragment, as safe markup
+        '''
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+
+        html = Markup(render())
+        if len(html) > self.max_size:
+            return html
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = html
+                self.size += len(html)
+                self.versions.setdefault(key[0], set()).add(key[1])
+                while self.size > self.max_size:
+                    self.drop(next(iter(self.entries)))
+        return html
+
+    def drop(self, key):
+        # Called with the lock held
+        self.size -= len(self.entries.pop(key))
+        versions = self.versions[key[0]]
+        versions.discard(key[1])
+        if not versions:
+            del self.versions[key[0]]
+
+    def invalidate(self, listing_id):
+        '''
+        Drop the fragments of a listing after it was updated
+        '''
+        with self.lock:
+            for version in list(self.versions.get(listing_id, ())):
+                self.drop((listing_id, version))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        '''
+        Returns:
+            The hit and miss counters, the hit ratio, and the number
+            and total length of the cached fragments
+        '''
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'size': self.size,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+
+fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
+
+
+def listing_cells(listing):
+    '''
+    The title, description and price cells of a listing row, used by
+    the templates as {{ listing_cells(listing) }}
+    '''
+    return fragment_cache.get(
+        (listing.id, listing.version),
+        lambda: app.jinja_env.get_template('listing_cells.html').render(
+            listing=listing))
+
+
+app.jinja_env.globals['listing_cells'] = listing_cells
@@ -0,0 +1,137 @@
+import math
+
+'''
+This file defines the geohash grid used to find the properties near a
+point without reading all of them.
+
+A geohash names a cell of the grid: each character splits the cell of
+the previous ones in 32, so the properties of a cell are a range of
+the indexed Property.geohash column (the hashes starting with the
+cell's name). A radius query reads the cell of the point and its 8
+neighbours, at the finest precision whose cells are still larger than
+the radius, then keeps the properties within the distance.
+'''
+
+# Alphabet of the geohashes
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Characters stored in Property.geohash (cells of about 5 x 5 m)
+PRECISION = 9
+
+# Most cells read by a radius query: finer cells hold fewer properties
+# outside of the circle, but each one is another range of the index
+MAX_CELLS = 64
+
+# Mean radius of the Earth, and length of a degree of latitude
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    '''
+    Name the cell of a point
+      Parameters:
+        latitude   (float):  -90 to 90
+        longitude  (float):  -180 to 180
+        precision  (int):    length of the geohash
+      Returns:
+        The geohash
+    '''
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    # The bits alternate between the longitude and the latitude
+    even = True
+    while len(chars) < precision:
+        if even:
+            bounds, coordinate = lon_range, longitude
+        else:
+            bounds, coordinate = lat_range, latitude
+        middle = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    '''
+    Returns:
+        The height and width of the cells of a precision, in degrees
+    '''
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def covering_cells(latitude, longitude, km):
+    '''
+    Find the cells holding every point within a distance of a point
+      Parameters:
+        latitude   (float):  center of the circle
+        longitude  (float):  center of the circle
+        km         (float):  radius of the circle
+      Returns:
+        A set of at most MAX_CELLS geohash prefixes, or None if the
+        circle is too large for the grid or reaches a pole
+    '''
+    # Box around the circle: the degrees of longitude are shortest on
+    # the side of the circle farthest from the equator
+    dlat = km / KM_PER_DEGREE
+    edge = abs(latitude) + dlat
+    if edge >= 90:
+        return None
+    dlon = dlat / math.cos(math.radians(edge))
+    if dlon >= 180:
+        return None
+    south, west = latitude - dlat + 90, longitude - dlon + 180
+    north, east = latitude + dlat + 90, longitude + dlon + 180
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        first_row, first_column = int(south // height), int(west // width)
+        rows = int(north // height) - first_row + 1
+        columns = int(east // width) - first_column + 1
+        if rows * columns <= MAX_CELLS:
+            break
+    else:
+        return None
+    # Name each cell from its center
+    cells = set()
+    for row in range(first_row, first_row + rows):
+        for column in range(first_column, first_column + columns):
+            lon = ((column + 0.5) * width) % 360.0 - 180.0
+            cells.add(encode((row + 0.5) * height - 90, lon, precision))
+    return cells
+
+
+def within_km(latitude_column, longitude_column, latitude, longitude, km):
+    '''
+    Build the SQL condition "the point of the columns is within a
+    distance of a point", with only arithmetic so that it runs on every
+    database: the distance on the equirectangular projection centered
+    on the point, off the great-circle distance by less than 1% up to
+    100 km below the 60th parallels (the circle must not cross the
+    180th meridian)
+      Parameters:
+        latitude_column  (Column):  column of the latitudes
+        longitude_column (Column):  column of the longitudes
+        latitude         (float):   center of the circle
+        longitude        (float):   center of the circle
+        km               (float):   radius of the circle
+      Returns:
+        The condition, to filter a query with
+    '''
+    scale = math.cos(math.radians(latitude))
+    dlat = latitude_column - latitude
+    dlon = (longitude_column - longitude) * scale
+    return dlat * dlat + dlon * dlon <= (km / KM_PER_DEGREE) ** 2
@@ -0,0 +1,149 @@
+import argparse
+import csv
+import json
+import sys
+import time
+from itertools import islice
+from app.models import register_bulk, create_listings_bulk, \
+    create_bookings_bulk
+
+'''
+Command line importer of users, listings and bookings from CSV or
+JSON-lines files. Rows are streamed through a pipeline of generators
+(read, then validate and insert one chunk at a time), so the memory
+used does not depend on the size of the file:
+
+    python -m app.importer listings listings.csv
+    python -m app.importer users users.jsonl --errors rejected.txt
+
+The columns (CSV header, or JSON keys) are:
+    users:     name, email, real_name, password
+    listings:  title, description, price, owner_id
+    bookings:  listing_id, user_id, start_date, end_date (YYYY-MM-DD)
+'''
+
+# Bulk function of each kind of row
+LOADERS = {
+    'users': register_bulk,
+    'listings': create_listings_bulk,
+    'bookings': create_bookings_bulk,
+}
+
+
+def read_rows(file, file_format):
+    '''
+    Parse the rows of a file one at a time
+      Parameters:
+        file        (file):     open text file
+        file_format (string):   'csv' or 'jsonl'
+      Returns:
+        A generator of dicts
+    '''
+    if file_format == 'csv':
+        yield from csv.DictReader(file)
+        return
+    for line in file:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        # Keep the row numbers right, the row gets rejected
+        yield row if isinstance(row, dict) else {}
+
+
+def chunks(rows, size):
+    '''
+    Group the rows in lists of at most `size` rows
+    '''
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def import_rows(kind, rows, chunk_size=1000, on_error=None, progress=None):
+    '''
+    Validate and insert the rows, one chunk at a time
+      Parameters:
+        kind       (string):    'users', 'listings' or 'bookings'
+        rows       (iterable):  dicts with the columns of the kind
+        chunk_size (int):       rows validated and inserted together
+        on_error   (function):  called with (row number, reason) for
+                                each rejected row (optional)
+        progress   (function):  called with (rows read, rows imported)
+                                after each chunk (optional)
+      Returns:
+        A tuple (rows read, rows imported)
+    '''
+    load = LOADERS[kind]
+    total = imported = 0
+    for chunk in chunks(rows, chunk_size):
+        errors = load(chunk)
+        for number, error in enumerate(errors, start=total + 1):
+            if error is None:
+                imported += 1
+            elif on_error:
+                on_error(number, error)
+        total += len(chunk)
+        if progress:
+            progress(total, imported)
+    return total, imported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m app.importer',
+        description='Import users, listings or bookings from a CSV or '
+                    'JSON-lines file.')
+    parser.add_argument('kind', choices=sorted(LOADERS))
+    parser.add_argument('path', help="file to import, '-' for stdin")
+    parser.add_argument('--format', choices=['csv', 'jsonl'],
+                        help='default: from the file extension')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--errors', help='file to write rejected rows to')
+    args = parser.parse_args(argv)
+
+    file_format = args.format
+    if file_format is None:
+        file_format = 'csv' if args.path.endswith('.csv') else 'jsonl'
+
+    errors = open(args.errors, 'w') if args.errors else None
+    begin = time.perf_counter()
+
+    def on_error(number, reason):
+        if errors:
+            errors.write('{}: {}\n'.format(number, reason))
+
+    def progress(total, imported):
+        elapsed = time.perf_counter() - begin
+        print('\r{}: {} rows read, {} imported, {:.0f} rows/s'.format(
+            args.kind, total, imported, total / elapsed if elapsed else 0),
+            end='', file=sys.stderr, flush=True)
+
+    try:
+        if args.path == '-':
+            file = sys.stdin
+        else:
+            file = open(args.path, newline='', encoding='utf-8')
+        with file:
+            total, imported = import_rows(
+                args.kind, read_rows(file, file_format),
+                chunk_size=max(1, args.chunk_size),
+                on_error=on_error, progress=progress)
+    finally:
+        if errors:
+            errors.close()
+
+    elapsed = time.perf_counter() - begin
+    print('\n{}: {} of {} rows imported in {:.1f} s'.format(
+        args.kind, imported, total, elapsed), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, g, has_request_context, request, \
+    before_render_template, template_rendered
+from sqlalchemy import event
+from app import app
+from app.models import db
+from app.slow_queries import slow_query_log
+
+'''
+This file defines the request instrumentation: for every request, the
+wall time, the number of SQL statements and the time spent running
+them, and the time spent rendering templates.
+
+They are sent back in a Server-Timing header (shown by the network tab
+of the browsers), logged as one line per request by the app.metrics
+logger, and added to per-endpoint histograms served at /metrics in the
+Prometheus text format. The histograms are kept by each process: with
+several workers, each scrape sees the worker that answered it. /metrics
+is only served to the scrapers sending the METRICS_TOKEN of the
+environment (Authorization: Bearer <token>), and is not found while no
+token is set.
+Set metrics=0 in the environment to turn all of it off (the statements
+are still timed while the slow query log is on).
+'''
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """
+    Counts of the observed values below each bucket bound, with their
+    sum, for one set of label values. Not thread-safe, see Metrics.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One more count, for the values above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        '''
+        Returns:
+            The Prometheus text lines of the histogram
+        '''
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                name, labels, bound, total))
+        lines.append('{}_sum{{{}}} {!r}'.format(name, labels, self.sum))
+        lines.append('{}_count{{{}}} {}'.format(name, labels, self.count))
+        return lines
+
+
+class Metrics:
+    """
+    Per-endpoint histograms of the requests of this process
+    """
+
+    # name -> (help text, buckets)
+    HISTOGRAMS = {
+        'qbnb_request_duration_seconds': (
+            'Wall time of the requests, until the response headers',
+            SECONDS_BUCKETS),
+        'qbnb_request_db_seconds': (
+            'Time spent running SQL statements, per request',
+            SECONDS_BUCKETS),
+        'qbnb_request_db_statements': (
+            'Number of SQL statements, per request', COUNT_BUCKETS),
+        'qbnb_request_render_seconds': (
+            'Time spent rendering templates, per request', SECONDS_BUCKETS),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (name, endpoint, method) -> Histogram
+        self.histograms = {}
+        # (endpoint, method, status) -> number of requests
+        self.requests = {}
+
+    def observe(self, endpoint, method, status, timing):
+        '''
+        Record a finished request
+          Parameters:
+            endpoint (string):        Flask endpoint, or 'unmatched'
+            method   (string):        HTTP method
+            status   (int):           HTTP status
+            timing   (RequestTiming): measures of the request
+        '''
+        values = (('qbnb_request_duration_seconds', timing.duration),
+                  ('qbnb_request_db_seconds', timing.sql_time),
+                  ('qbnb_request_db_statements', timing.sql_count),
+                  ('qbnb_request_render_seconds', timing.render_time))
+        with self.lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for name, value in values:
+                histogram = self.histograms.get((name, endpoint, method))
+                if histogram is None:
+                    histogram = Histogram(self.HISTOGRAMS[name][1])
+                    self.histograms[(name, endpoint, method)] = histogram
+                histogram.observe(value)
+
+    def render(self):
+        '''
+        Returns:
+            The metrics in the Prometheus text format
+        '''
+        lines = ['# HELP qbnb_requests_total Requests answered',
+                 '# TYPE qbnb_requests_total counter']
+        with self.lock:
+            for (endpoint, method, status), count in \
+                    sorted(self.requests.items()):
+                lines.append('qbnb_requests_total{{{},status="{}"}} {}'
+                             .format(label_values(endpoint, method),
+                                     status, count))
+            for name, (help_text, _) in self.HISTOGRAMS.items():
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} histogram'.format(name))
+                for (metric, endpoint, method), histogram in \
+                        sorted(self.histograms.items()):
+                    if metric == name:
+                        lines.extend(histogram.lines(
+                            name, label_values(endpoint, method)))
+        return '\n'.join(lines) + '\n'
+
+
+def label_values(endpoint, method):
+    # The endpoints and methods are identifiers: nothing to escape
+    return 'endpoint="{}",method="{}"'.format(endpoint, method)
+
+
+class RequestTiming:
+    """
+    The measures of the current request, kept in flask.g
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+        self.render_started = None
+
+    def server_timing(self):
+        '''
+        Returns:
+            The value of the Server-Timing header, durations in ms
+        '''
+        return ('app;dur={:.1f}, db;dur={:.1f};desc="{} queries", '
+                'render;dur={:.1f}').format(
+                    self.duration * 1000, self.sql_time * 1000,
+                    self.sql_count, self.render_time * 1000)
+
+
+metrics = Metrics()
+
+
+def current_timing():
+    '''
+    Returns:
+        The RequestTiming of the current request, or None outside
+        of the instrumented requests
+    '''
+    if not has_request_context():
+        return None
+    return g.get('timing')
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    # Every statement is timed, in a request or not, for the slow
+    # query log (app/slow_queries.py)
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    timing = current_timing()
+    if timing is not None:
+        timing.sql_time += elapsed
+        timing.sql_count += 1
+    if slow_query_log.enabled() and elapsed >= slow_query_log.threshold:
+        slow_query_log.record(conn, statement, parameters, elapsed,
+                              executemany)
+
+
+def handle_error(context):
+    # The statement failed: after_cursor_execute is not called
+    started = context.connection.info.get('query_started') \
+        if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def render_started(sender, template, context, **extra):
+    timing = current_timing()
+    if timing is not None and timing.render_started is None:
+        timing.render_started = time.perf_counter()
+
+
+def render_finished(sender, template, context, **extra):
+    timing = current_timing()
+    if timing is not None and timing.render_started is not None:
+        timing.render_time += time.perf_counter() - timing.render_started
+        timing.render_started = None
+
+
+def start_timing():
+    g.timing = RequestTiming()
+
+
+def finish_timing(response):
+    timing = g.pop('timing', None)
+    if timing is None:
+        return response
+    timing.duration = time.perf_counter() - timing.started
+    endpoint = request.endpoint or 'unmatched'
+    response.headers['Server-Timing'] = timing.server_timing()
+    metrics.observe(endpoint, request.method, response.status_code, timing)
+    logger.info(
+        'method=%s path=%s endpoint=%s status=%d duration_ms=%.1f '
+        'sql_count=%d sql_ms=%.1f render_ms=%.1f', request.method,
+        request.path, endpoint, response.status_code,
+        timing.duration * 1000, timing.sql_count, timing.sql_time * 1000,
+        timing.render_time * 1000)
+    return response
+
+
+def get_metrics():
+    token = app.config['METRICS_TOKEN']
+    if not token:
+        return Response('Not Found\n', status=404, mimetype='text/plain')
+    sent = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(sent.encode(), b'Bearer ' + token.encode()):
+        response = Response('A metrics token is required\n', status=401,
+                            mimetype='text/plain')
+        response.headers['WWW-Authenticate'] = 'Bearer'
+        return response
+    return Response(metrics.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+if app.config['METRICS_ENABLED'] or slow_query_log.enabled():
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(db.engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(db.engine, 'handle_error', handle_error)
+if app.config['METRICS_ENABLED']:
+    before_render_template.connect(render_started, app)
+    template_rendered.connect(render_finished, app)
+    app.before_request(start_timing)
+    app.after_request(finish_timing)
+    app.add_url_rule('/metrics', 'get_metrics', get_metrics)
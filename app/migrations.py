@@ -0,0 +1,178 @@
+import sys
+from sqlalchemy import Column, Integer, MetaData, Table, inspect, select
+from app.models import db
+from app.search import create_fts_table
+
+'''
+This file defines the versioned schema migrations of the database.
+
+Each migration is applied once, in order, and the version of the last
+applied migration is stored in the schema_version table. To upgrade a
+database, run:
+
+    python -m app.migrations upgrade
+'''
+
+version_table = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, nullable=False),
+)
+
+
+def create_tables(conn):
+    '''
+    Create the tables that do not exist yet
+    (same behaviour as the former db.create_all())
+    '''
+    for table in db.metadata.sorted_tables:
+        table.create(bind=conn, checkfirst=True)
+
+
+def create_indexes(conn, names):
+    '''
+    Create indexes declared on the models, unless they exist.
+    Each migration lists the indexes it introduces, so that it never
+    needs a column added by a later migration.
+    Parameters:
+        conn  (Connection):   open connection
+        names (list):         names of the indexes
+    '''
+    indexes = {index.name: index for table in db.metadata.sorted_tables
+               for index in table.indexes}
+    for name in names:
+        indexes[name].create(bind=conn, checkfirst=True)
+
+
+def index_filtered_columns(conn):
+    '''
+    Index the columns the model lookups filter on
+    '''
+    create_indexes(conn, ['ix_user_username', 'ix_listing_owner_id',
+                          'ix_listing_title', 'ix_booking_user_id',
+                          'ix_booking_listing_dates',
+                          'ix_review_listing_id'])
+
+
+def index_sort_keys(conn):
+    '''
+    Index the sort keys of the browse pages
+    '''
+    create_indexes(conn, ['ix_listing_price_id', 'ix_listing_modified_id'])
+
+
+def index_booking_owners(conn):
+    '''
+    Index the owners of the bookings, read by the exports
+    '''
+    create_indexes(conn, ['ix_booking_owner_id'])
+
+
+def add_column(conn, table, column):
+    '''
+    Add a column declared on a model to an existing table,
+    unless the table was already created with it.
+    Parameters:
+        conn   (Connection):   open connection
+        table  (Table):        table of the model
+        column (String):       name of the column
+    '''
+    existing = [c['name'] for c in inspect(conn).get_columns(table.name)]
+    if column in existing:
+        return
+    col = table.c[column]
+    quote = conn.dialect.identifier_preparer
+    ddl = 'ALTER TABLE {} ADD COLUMN {} {}'.format(
+        quote.format_table(table), quote.format_column(col),
+        col.type.compile(dialect=conn.dialect))
+    if col.server_default is not None:
+        ddl += ' DEFAULT {}'.format(col.server_default.arg)
+    if not col.nullable:
+        ddl += ' NOT NULL'
+    conn.exec_driver_sql(ddl)
+
+
+def add_version_columns(conn):
+    '''
+    Add the row versions checked by create_booking
+    '''
+    add_column(conn, db.metadata.tables['user'], 'version')
+    add_column(conn, db.metadata.tables['listing'], 'version')
+
+
+def add_property_location(conn):
+    '''
+    Add the property coordinates, and index the locations
+    '''
+    for column in ('latitude', 'longitude', 'geohash'):
+        add_column(conn, db.metadata.tables['property'], column)
+    create_indexes(conn, ['ix_property_geohash', 'ix_property_location',
+                          'ix_property_zip_code', 'ix_listing_property_id'])
+
+
+def create_change_log(conn):
+    '''
+    Create the listing_change table, read by the in-process indexes
+    '''
+    db.metadata.tables['listing_change'].create(bind=conn, checkfirst=True)
+
+
+# Ordered list of (version, description, function)
+MIGRATIONS = [
+    (1, 'create the base tables', create_tables),
+    (2, 'index the filtered columns', index_filtered_columns),
+    (3, 'index the browse sort keys', index_sort_keys),
+    (4, 'add the user and listing row versions', add_version_columns),
+    (5, 'index the booking owners for the exports', index_booking_owners),
+    (6, 'create the full-text index of the listings', create_fts_table),
+    (7, 'add the property coordinates and location indexes',
+     add_property_location),
+    (8, 'log the listing changes', create_change_log),
+]
+
+
+def current_version(conn):
+    '''
+    Returns:
+        The version of the last applied migration (0 if none)
+    '''
+    version_table.create(bind=conn, checkfirst=True)
+    version = conn.execute(select(version_table.c.version)).scalar()
+    return version or 0
+
+
+def upgrade(target=None, engine=None):
+    '''
+    Apply the migrations that have not been applied yet
+    Parameters:
+        target (int):     version to stop at (latest if None)
+        engine (Engine):  database to upgrade (the app's if None)
+    Returns:
+        The version of the database after the upgrade
+    '''
+    with (engine or db.engine).begin() as conn:
+        version = current_version(conn)
+        for number, _, migrate in MIGRATIONS:
+            if number <= version or (target and number > target):
+                continue
+            migrate(conn)
+            version = number
+        conn.execute(version_table.delete())
+        conn.execute(version_table.insert().values(version=version))
+    return version
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else 'upgrade'
+    if command == 'upgrade':
+        print('Database at version', upgrade())
+    elif command == 'current':
+        with db.engine.connect() as conn:
+            print('Database at version', current_version(conn))
+    else:
+        print('Usage: python -m app.migrations [upgrade|current]')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
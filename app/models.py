@@ -1,7 +1,21 @@
 from app import app
+from app.blocklist import is_blocked
+from app.user_cache import user_cache, snapshot
+from app.cache import cache
+from app.fragments import fragment_cache
+from app.availability import AvailabilityEngine, Availability
+from app.search import ListingSearch, last_change
+from app.suggest import TitleSuggest
+from app.geo import encode, covering_cells, within_km
+from app.validation import desc_character_check, alphanumeric_check, \
+    real_name_check, postal_code_check
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, or_, func, event, insert, bindparam, select
+from sqlalchemy.exc import OperationalError
 from validate_email import validate_email
 from datetime import date
+import random
+import time
 
 
 '''
@@ -12,6 +26,24 @@ This file defines data models and related business logics
 db = SQLAlchemy(app)
 
 
+@event.listens_for(db.engine, 'connect')
+def configure_connection(dbapi_conn, record):
+    '''
+    Set up every new database connection:
+    SQLite uses write-ahead logging, so readers do not block the writer,
+    MySQL cancels the queries running longer than DB_STATEMENT_TIMEOUT.
+    '''
+    cursor = dbapi_conn.cursor()
+    if db.engine.dialect.name == 'sqlite':
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA busy_timeout={}'.format(
+            int(app.config['SQLITE_BUSY_TIMEOUT'] * 1000)))
+    elif db.engine.dialect.name == 'mysql':
+        cursor.execute('SET SESSION max_execution_time={}'.format(
+            app.config['DB_STATEMENT_TIMEOUT']))
+    cursor.close()
+
+
 class Property(db.Model):
     """A class to represent a qB&B property."""
 
@@ -28,10 +60,20 @@ class Property(db.Model):
     country = db.Column(db.String(80), nullable=False)
     # Stores the name of the state/province.
     state = db.Column(db.String(80), nullable=False)
-    # Stores the postal/zip code.
-    zip_code = db.Column(db.String(80), nullable=False)
+    # Stores the postal/zip code (uppercase).
+    zip_code = db.Column(db.String(80), nullable=False, index=True)
     # Stores the user who created the property
     owner_id = db.Column(db.Integer, nullable=False)
+    # Stores the coordinates (optional, for the radius searches)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    # Stores the geohash of the coordinates (see app/geo.py)
+    geohash = db.Column(db.String(12), nullable=True, index=True)
+
+    # Location facets: country, then state, then city
+    __table_args__ = (
+        db.Index('ix_property_location', 'country', 'state', 'city'),
+    )
 
     def __repr__(self):
         return "<Property %r>" % self.id
@@ -43,22 +85,47 @@ class Listing(db.Model):
     # Stores the corresponding property's id
     id = db.Column(db.Integer, primary_key=True)
     # Stores the title
-    title = db.Column(db.String(80), nullable=False)
+    title = db.Column(db.String(80), nullable=False, index=True)
     # Stores the description
     description = db.Column(db.String(200), nullable=False)
     # Stores the corresponding home owner's id
-    owner_id = db.Column(db.Integer, nullable=False)
+    owner_id = db.Column(db.Integer, nullable=False, index=True)
     # Stores decimal cost of listing
     price = db.Column(db.Float, nullable=False)
     # Stores the last modified date
     last_modified_date = db.Column(db.Date, nullable=False)
     # Stores the corresponding property id (not required)
-    property_id = db.Column(db.Integer, nullable=True)
+    property_id = db.Column(db.Integer, nullable=True, index=True)
+    # Stores the row version, incremented by each booking and update
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
+
+    # Sort keys of the paginated browse page
+    __table_args__ = (
+        db.Index('ix_listing_price_id', 'price', 'id'),
+        db.Index('ix_listing_modified_id', 'last_modified_date', 'id'),
+    )
 
     def __repr__(self):
         return "<Listing %r>" % self.id
 
 
+class ListingChange(db.Model):
+    """
+    The last change of each listing. A change gets a new id, and the
+    ids only grow, so the processes read the listings changed since the
+    last id they saw (see app/search.py).
+    """
+
+    # Never reused once deleted (AUTOINCREMENT on SQLite)
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    # Stores the id of the change
+    id = db.Column(db.Integer, primary_key=True)
+    # Stores the id of the changed listing
+    listing_id = db.Column(db.Integer, nullable=False, unique=True)
+
+
 class Booking(db.Model):
     """A class to represent a qB&B Booking."""
 
@@ -70,9 +137,9 @@ class Booking(db.Model):
     # Stores booking date of the listing
     date = db.Column(db.Date, nullable=False)
     # Stores the corresponding renter ID
-    user_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
     # Stores the corresponding owner ID (not required)
-    owner_id = db.Column(db.Integer, nullable=True)
+    owner_id = db.Column(db.Integer, nullable=True, index=True)
     # Stores the id of the review of the guest (not required)
     review_id = db.Column(db.Integer, nullable=True)
     # Stores start date of the listing (not required)
@@ -80,6 +147,12 @@ class Booking(db.Model):
     # Stores end date of the listing (not required)
     end_date = db.Column(db.Date, nullable=True)
 
+    # Used by the overlap check in create_booking
+    __table_args__ = (
+        db.Index('ix_booking_listing_dates',
+                 'listing_id', 'start_date', 'end_date'),
+    )
+
     def __repr__(self):
         return "<Booking %r>" % self.id
 
@@ -90,7 +163,7 @@ class User(db.Model):
     # Stores the id
     id = db.Column(db.Integer, primary_key=True)
     # Stores the username
-    username = db.Column(db.String(80), nullable=False)
+    username = db.Column(db.String(80), nullable=False, index=True)
     # Stores the email
     email = db.Column(db.String(120), unique=True, nullable=False)
     # Stores the amount of balance
@@ -103,6 +176,9 @@ class User(db.Model):
     postal_code = db.Column(db.String(100), nullable=False)
     # Stores the real name (not required)
     real_name = db.Column(db.String(80), unique=False, nullable=True)
+    # Stores the row version, incremented when the balance changes
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
 
     def __repr__(self):
         return "<User %r>" % self.id
@@ -116,7 +192,7 @@ class Review(db.Model):
     # Stores the corresponding reviewers id
     user_id = db.Column(db.Integer, nullable=False)
     # Stores the corresponding listing id
-    listing_id = db.Column(db.Integer, nullable=False)
+    listing_id = db.Column(db.Integer, nullable=False, index=True)
     # Stores the review of the guest in paragraph form
     review_text = db.Column(db.String(200), nullable=False)
     # Stores date of the review
@@ -128,8 +204,10 @@ class Review(db.Model):
         return "<Review %r>" % self.id
 
 
-# create all tables
-db.create_all()
+# Apply the pending schema migrations (see app/migrations.py)
+if app.config['AUTO_MIGRATE']:
+    from app.migrations import upgrade
+    upgrade()
 
 
 def register(name, email, real_name, password):
@@ -193,6 +271,60 @@ def register(name, email, real_name, password):
     return True
 
 
+def register_bulk(rows):
+    '''
+    Register many users at once, with the same rules as register.
+    The emails of the whole batch are checked with one query, and the
+    valid users are saved with one insert. Within the batch, an email
+    can only be used by its first user.
+      Parameters:
+        rows (list of dict):  users, with the keys name, email,
+                              real_name and password
+      Returns:
+        A list with, for each row, None if the user was registered,
+        otherwise the reason it was rejected
+    '''
+    errors = []
+    for row in rows:
+        name, email = row.get('name'), row.get('email')
+        real_name, password = row.get('real_name'), row.get('password')
+        if not isinstance(email, str) or not email_check(email):
+            errors.append('Invalid email')
+        elif not isinstance(password, str) or not pw_check(password):
+            errors.append('Invalid password')
+        elif real_name is not None and not isinstance(real_name, str) \
+                or not real_name_check(real_name):
+            errors.append('Invalid real name')
+        elif not isinstance(name, str) or not length_check(name, 3, 20) \
+                or not alphanumeric_check(name):
+            errors.append('Invalid user name')
+        else:
+            errors.append(None)
+
+    valid = [i for i, error in enumerate(errors) if error is None]
+    emails = find_existing(User.email, {rows[i]['email'] for i in valid})
+
+    users = []
+    for i in valid:
+        email = rows[i]['email']
+        if email in emails:
+            errors[i] = 'Email already used'
+            continue
+        # Later rows of the batch cannot reuse the email
+        emails.add(email)
+        users.append({
+            'username': rows[i]['name'], 'email': email,
+            'real_name': rows[i].get('real_name'),
+            'password': rows[i]['password'], 'balance': 100,
+            'billing_address': '', 'postal_code': '',
+        })
+
+    if users:
+        db.session.execute(insert(User), users)
+        db.session.commit()
+    return errors
+
+
 def login(email, password):
     '''
     Check login information:
@@ -245,26 +377,13 @@ def pw_check(password):
 
     # Since many SQL Injections are valid password inputs, ensure
     # the input is not a generic SQL Injection string:
-    f = open("app_test/Generic_SQLI.txt", "r")
-    lines = f.readlines()
-    if password in lines:
+    if is_blocked(password):
         return False
 
     # Only return true if all the flags got set to True at least once
     return has_upper and has_lower and has_special
 
 
-# Ensures the real name is less than 80 chars, and is either alpha or spaces
-def real_name_check(name):
-    # We don't need a real name, but if we have one, do the checks
-    if name is None:
-        return True
-
-    if len(name) > 80 or "\n" in name:
-        return False
-    return all(c.isalpha() or c.isspace() for c in name)
-
-
 # Uses the validate_email library to ensure the email is valid.
 # We can use this single line inside the methods that need it
 # instead of leaving it as its own function.
@@ -272,7 +391,7 @@ def email_check(email):
     return validate_email(email)
 
 
-def create_listing(title, description, price, owner_id):
+def create_listing(title, description, price, owner_id, property_id=None):
     '''
     Create a new listing object
       Parameters:
@@ -280,89 +399,185 @@ def create_listing(title, description, price, owner_id):
         description (string): description of listing
         price (float):        price of listing
         owner_id (int):       id of the owner
+        property_id (int):    id of a property of the owner (optional)
       Returns:
         True if the listing can be created, otherwise False
     '''
+    error, price, owner_id = listing_field_error(title, description, price,
+                                                 owner_id)
+    if error:
+        return False
+
+    # check the requirements that depend on the date and the database
+    if (date_check(date.today(), date(2021, 1, 2), date(2025, 1, 2))
+            and owner_check(owner_id) and unique_title_check(title, 0)
+            and property_check(property_id, owner_id)):
+        # create a new listing
+        listing = Listing(title=title, description=description, price=price,
+                          last_modified_date=date.today(), owner_id=owner_id,
+                          property_id=property_id)
+        # add it to the current database session
+        db.session.add(listing)
+        # get the id, for the in-process search index
+        db.session.flush()
+        index_listings([listing])
+        # actually save the user object
+        db.session.commit()
+        cache.invalidate_tags('listings')
+        return True
+    return False
 
+
+def listing_field_error(title, description, price, owner_id):
+    '''
+    Check the fields of a new listing (all but the database checks)
+      Parameters:
+        see create_listing
+      Returns:
+        A tuple (error message or None, price as a float,
+        owner id as an int)
+    '''
     # length should not exceed 8
     # (max price is 10000, add two digits for decimal)
     if (len(str(price)) > 8):
-        return False
+        return 'Invalid price', None, None
     # convert the price to a float
     try:
         price = float(price)
-    except ValueError:
-        return False
+    except (TypeError, ValueError):
+        return 'Invalid price', None, None
 
     # length should not exceed 5
     # (currently, we will not have more than 10000 users)
     if (len(str(owner_id)) > 5):
-        return False
+        return 'Invalid owner', None, None
     # convert the owner_id to an int
     try:
         owner_id = int(owner_id)
-    except ValueError:
-        return False
+    except (TypeError, ValueError):
+        return 'Invalid owner', None, None
     # Owner Id should be from 0 to 10000 (max users currently)
     if (owner_id < 0 or owner_id > 10000):
-        return False
+        return 'Invalid owner', None, None
 
+    if not isinstance(title, str) or not isinstance(description, str):
+        return 'Missing title or description', None, None
     if not (desc_character_check(description)):
-        return False
+        return 'Invalid description', None, None
 
     # check the requirements
-    if (alphanumeric_check(title) and
-            length_check(title, 0, 80) and length_check(description, 20, 2000)
-            and description_length_check(description, title) and
-            range_check(price, 10, 10000) and
-            date_check(date.today(), date(2021, 1, 2), date(2025, 1, 2))
-            and owner_check(owner_id) and unique_title_check(title, 0)):
-        # create a new listing
-        listing = Listing(title=title, description=description, price=price,
-                          last_modified_date=date.today(), owner_id=owner_id)
-        # add it to the current database session
-        db.session.add(listing)
-        # actually save the user object
-        db.session.commit()
-        return True
-    return False
+    if not (title and alphanumeric_check(title) and
+            length_check(title, 0, 80)):
+        return 'Invalid title', None, None
+    if not (length_check(description, 20, 2000) and
+            description_length_check(description, title)):
+        return 'Invalid description', None, None
+    if not range_check(price, 10, 10000):
+        return 'Invalid price', None, None
+    return None, price, owner_id
+
 
+# Maximum number of values in one IN (...) query
+# (older SQLite versions accept at most 999 parameters)
+IN_CHUNK_SIZE = 900
 
-def desc_character_check(description):
+
+def query_in(query, column, values):
     '''
-    Check if the given description satisfies:
-    R4-9: The description of the product has to be alphanumeric, and
-    the only other characters allowed are commas, periods, exclamation
-    marks, and spaces.
-    Parameters:
-        description (string):       description of the listing
-    Returns:
-        True if the requirements are meant, otherwise False
+    Run a query filtered on column IN (values), with one query
+    per IN_CHUNK_SIZE values
+      Parameters:
+        query  (Query):     query to filter
+        column (Column):    model column
+        values (iterable):  values to look for
+      Returns:
+        The rows of all the chunks
     '''
-    for element in range(0, len(description)):
-        if not (description[element].isalnum() or description[element] == " "
-                or description[element] == "." or description[element] == ","
-                or description[element] == "!"):
-            return False
-    return True
+    values = list(values)
+    for i in range(0, len(values), IN_CHUNK_SIZE):
+        yield from query.filter(column.in_(values[i:i + IN_CHUNK_SIZE]))
 
 
-def alphanumeric_check(title):
+def find_existing(column, values):
     '''
-    Check if the given title satisfies:
-    R4-1: The title of the product has to be alphanumeric-only,
-    and space allowed only if it is not as prefix and suffix.
-    Parameters:
-        title (string):       title of the listing
-    Returns:
-        True if the requirements are meant, otherwise False
+    Find which of the values are present in a column
+      Parameters:
+        column (Column):    model column
+        values (iterable):  values to look for
+      Returns:
+        The set of values found
     '''
-    if title[0] == " " or title[-1] == " ":
-        return False
-    for element in range(0, len(title)):
-        if not (title[element].isalnum() or title[element] == " "):
-            return False
-    return True
+    return {value for (value,) in query_in(
+        db.session.query(column).distinct(), column, values)}
+
+
+def create_listings_bulk(rows):
+    '''
+    Create many listings at once, with the same rules as create_listing.
+    The whole batch is checked with one query for the owners and one
+    for the titles, and the valid listings are saved with one insert.
+    Within the batch, a title can only be used by its first listing.
+      Parameters:
+        rows (list of dict):  listings, with the keys title, description,
+                              price and owner_id
+      Returns:
+        A list with, for each row, None if the listing was created,
+        otherwise the reason it was rejected
+    '''
+    today = date.today()
+    if not date_check(today, date(2021, 1, 2), date(2025, 1, 2)):
+        return ['Listings cannot be created today'] * len(rows)
+
+    errors = []
+    checked = []
+    for row in rows:
+        error, price, owner_id = listing_field_error(
+            row.get('title'), row.get('description'), row.get('price'),
+            row.get('owner_id'))
+        errors.append(error)
+        checked.append((price, owner_id))
+
+    valid = [i for i, error in enumerate(errors) if error is None]
+    owners = find_existing(User.id, {checked[i][1] for i in valid})
+    titles = find_existing(Listing.title, {rows[i]['title'] for i in valid})
+
+    listings = []
+    for i in valid:
+        title = rows[i]['title']
+        price, owner_id = checked[i]
+        if owner_id not in owners:
+            errors[i] = 'Owner does not exist'
+        elif title in titles:
+            errors[i] = 'Title already used'
+        else:
+            # Later rows of the batch cannot reuse the title
+            titles.add(title)
+            listings.append({
+                'title': title, 'description': rows[i]['description'],
+                'price': price, 'owner_id': owner_id,
+                'last_modified_date': today,
+            })
+
+    if listings:
+        db.session.execute(insert(Listing), listings)
+        # The titles are unique: log the new listings by title, in the
+        # database (replacing the change of a deleted listing with the
+        # same id), and find their ids for the in-process indexes
+        titles = [row['title'] for row in listings]
+        for i in range(0, len(titles), IN_CHUNK_SIZE):
+            new = select(Listing.id).where(
+                Listing.title.in_(titles[i:i + IN_CHUNK_SIZE]))
+            ListingChange.query.filter(ListingChange.listing_id.in_(
+                new.scalar_subquery())).delete(synchronize_session=False)
+            db.session.execute(insert(ListingChange).from_select(
+                ['listing_id'], new))
+        if listing_search.active() or title_suggest.active():
+            query = select_fields(Listing, ['id', 'title', 'description',
+                                            'owner_id'])
+            update_indexes(list(query_in(query, Listing.title, titles)))
+        db.session.commit()
+        cache.invalidate_tags('listings')
+    return errors
 
 
 def length_check(str, min, max):
@@ -456,6 +671,80 @@ def owner_check(owner_id):
     return False
 
 
+def property_check(property_id, owner_id):
+    '''
+    Check that a listing can be attached to the property
+    Parameters:
+        property_id (int):     id of the property, or None
+        owner_id (int):        id of the owner of the listing
+    Returns:
+        True if there is no property, or the owner owns it
+    '''
+    if property_id is None:
+        return True
+    found = db.session.get(Property, property_id)
+    return found is not None and found.owner_id == owner_id
+
+
+def create_property(address, size, guests, city, state, country, zip_code,
+                    owner_id, latitude=None, longitude=None):
+    '''
+    Create a new property, that listings can then be attached to
+      Parameters:
+        address (string):     street address
+        size (int):           size in square feet
+        guests (int):         number of guests
+        city (string):        city
+        state (string):       state or province
+        country (string):     country
+        zip_code (string):    postal or zip code
+        owner_id (int):       id of the owner
+        latitude (float):     coordinates (optional, both or none)
+        longitude (float):
+      Returns:
+        The property if it can be created, otherwise None
+    '''
+    for name in (address, city, state, country, zip_code):
+        if not isinstance(name, str) or not name.strip():
+            return None
+    if not (length_check(address, 1, 120) and length_check(city, 1, 80) and
+            length_check(state, 1, 80) and length_check(country, 1, 80) and
+            length_check(zip_code, 1, 12)):
+        return None
+    # Zip codes are looked up by prefix, without case
+    zip_code = zip_code.strip().upper()
+    if not zip_code.replace(' ', '').replace('-', '').isalnum():
+        return None
+    try:
+        size = int(size)
+        guests = int(guests)
+    except (TypeError, ValueError):
+        return None
+    if size <= 0 or guests <= 0:
+        return None
+    geohash = None
+    if latitude is not None or longitude is not None:
+        try:
+            latitude = float(latitude)
+            longitude = float(longitude)
+        except (TypeError, ValueError):
+            return None
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return None
+        geohash = encode(latitude, longitude)
+    if not owner_check(owner_id):
+        return None
+
+    prop = Property(address=address.strip(), size=size, guests=guests,
+                    city=city.strip(), state=state.strip(),
+                    country=country.strip(), zip_code=zip_code,
+                    owner_id=owner_id, latitude=latitude,
+                    longitude=longitude, geohash=geohash)
+    db.session.add(prop)
+    db.session.commit()
+    return prop
+
+
 def update_user(curr_name, new_name, new_email, new_addr, new_postal, new_pw):
     '''
     R3-1, R3-4: Allow user to update username, password, email,
@@ -495,12 +784,17 @@ def update_user(curr_name, new_name, new_email, new_addr, new_postal, new_pw):
                 return False
             # If they're unique, update all the fields
             else:
+                old_email = valid[0].email
                 valid[0].username = new_name
                 valid[0].email = new_email
                 valid[0].billing_address = new_addr
                 valid[0].postal_code = new_postal
                 valid[0].password = new_pw
                 db.session.commit()
+                user_cache.invalidate(valid[0].id)
+                # The balances are cached by email
+                cache.invalidate_tags('balance:%s' % old_email,
+                                      'balance:%s' % new_email)
                 return True
         else:
             # If any of the fields are not formatted properly, return False
@@ -510,31 +804,6 @@ def update_user(curr_name, new_name, new_email, new_addr, new_postal, new_pw):
         return False
 
 
-def postal_code_check(postal_code):
-    '''
-    R3-2, R3-3: Ensures postal code is a valid Canadian postal code.
-    Parameters:
-        postal_code (String):   new or updated code
-    Returns:
-        True if the postal code is valid, False otherwise
-    '''
-    if len(postal_code) != 7:
-        return False
-
-    if (
-        (not postal_code[0].isalpha()) or
-        (not postal_code[1].isnumeric()) or
-        (not postal_code[2].isalpha()) or
-        (not postal_code[3] == " ") or
-        (not postal_code[4].isnumeric()) or
-        (not postal_code[5].isalpha()) or
-        (not postal_code[6].isnumeric())
-    ):
-        return False
-    else:
-        return True
-
-
 def not_empty(word):
     '''
     Checks R1-1 if the email
@@ -578,6 +847,8 @@ def update_listing(listing_id, new_title, new_desc, curr_price, new_price,
             listing[0].title = new_title
             listing[0].description = new_desc
             listing[0].price = new_price
+            # Incremented in SQL, so a concurrent booking is not lost
+            listing[0].version = Listing.version + 1
 
             # When the update operations are successful,
             # update the modified date
@@ -585,7 +856,12 @@ def update_listing(listing_id, new_title, new_desc, curr_price, new_price,
             if (date_check(date.today(), date(2021, 1, 2), date(2025, 1, 2))):
                 # Update the modified date
                 listing[0].last_modified_date = date.today()
+                updated_id = listing[0].id
+                index_listings([listing[0]])
                 db.session.commit()
+                # The cached rows of the old version are no longer shown
+                fragment_cache.invalidate(updated_id)
+                cache.invalidate_tags('listing:%d' % updated_id, 'listings')
                 return True
 
             # Modified date does not follow requirements
@@ -600,6 +876,14 @@ def update_listing(listing_id, new_title, new_desc, curr_price, new_price,
     return False
 
 
+def snapshots(rows):
+    '''
+    Plain copies of ORM objects, which can be cached and shared
+    between the requests
+    '''
+    return [snapshot(row) for row in rows]
+
+
 # Returns the listing when the owner id is passed in
 def find_listing(owner_id):
     listing = Listing.query.filter_by(owner_id=owner_id).all()
@@ -620,6 +904,8 @@ def find_listings(owner_id):
     return listings
 
 
+@cache.cached(tags=lambda listing_id: ['listing:%s' % listing_id],
+              prepare=snapshots, cache_if=bool)
 def find_listing_by_id(listing_id):
     '''
     Find listing of a certain id
@@ -644,6 +930,70 @@ def find_listing_by_title(title):
     return listing
 
 
+def load_booked_dates(listing_id):
+    '''
+    Find the booked date ranges of a listing
+    Parameters:
+        listing_id  (int):  listing id
+    Returns:
+        A list of (start date, end date)
+    '''
+    return db.session.query(Booking.start_date, Booking.end_date).filter(
+        Booking.listing_id == listing_id,
+        Booking.start_date.isnot(None),
+        Booking.end_date.isnot(None)).all()
+
+
+def listing_version(listing_id):
+    '''
+    Find the version of a listing, which every booking bumps
+    Parameters:
+        listing_id  (int):  listing id
+    Returns:
+        The version, or None if the listing does not exist
+    '''
+    return db.session.query(Listing.version).filter(
+        Listing.id == listing_id).scalar()
+
+
+# Booked date ranges of each listing, kept in sorted lists so that
+# conflicts are found with a binary search instead of the former
+# three-way overlap query. Built lazily from the Booking table.
+booked_dates = AvailabilityEngine(load_booked_dates, listing_version,
+                                  app.config['AVAILABILITY_CACHE_SIZE'])
+
+
+def find_availability(listing_id, start_date=None, end_date=None,
+                      nights=None, after=None):
+    '''
+    Check the availability of a listing
+    Parameters:
+        listing_id  (int):   listing id
+        start_date  (date):  first day of the range to check
+        end_date    (date):  last day of the range to check
+        nights      (int):   length of the stay to find a window for
+        after       (date):  earliest start of the window (today if None)
+    Returns:
+        True/False if the range [start_date, end_date] is free, or the
+        first free window (start, end) of the given number of nights
+    '''
+    if nights is not None:
+        return booked_dates.next_free_window(listing_id, nights,
+                                             after or date.today())
+    return booked_dates.is_free(listing_id, start_date, end_date)
+
+
+# Number of attempts of a booking that lost a race with another one.
+# An attempt only fails when another booking of the same listing or
+# by the same user committed first, so this also bounds the number of
+# concurrent bookings that are sure to go through.
+BOOKING_ATTEMPTS = 10
+
+
+class BookingConflict(Exception):
+    """Raised when a row changed while a booking was being made."""
+
+
 def create_booking(listing_id, uid, start_date, end_date):
     '''
     Allows user to book one of the listings
@@ -660,61 +1010,209 @@ def create_booking(listing_id, uid, start_date, end_date):
     if not isinstance(listing_id, int) or not isinstance(uid, int):
         return False
 
-    # Check if the listing and user exists
-    users = User.query.filter_by(id=uid).all()
-    listings = Listing.query.filter_by(id=listing_id).all()
-    if len(users) == 0 or len(listings) == 0:
+    # First ensure that the date formats are correct
+    if not isinstance(start_date, date) or not isinstance(end_date, date):
         return False
 
-    user = users[0]
-    listing = listings[0]
+    # Concurrent bookings of the same listing, or by the same user, are
+    # detected when the transaction is written (see book_listing).
+    # The loser starts over and sees the winner's booking and balance.
+    for attempt in range(BOOKING_ATTEMPTS):
+        try:
+            booking = book_listing(listing_id, uid, start_date, end_date)
+        except (BookingConflict, OperationalError):
+            db.session.rollback()
+            # Random backoff so the retries do not collide again
+            time.sleep(random.uniform(0, 0.01 * (attempt + 1)))
+            continue
+        if booking is None:
+            # Release the row locks
+            db.session.rollback()
+            return False
+        return True
+    return False
+
+
+def book_listing(listing_id, uid, start_date, end_date):
+    '''
+    Make a booking in a single transaction.
+    The listing and user rows are locked (SELECT ... FOR UPDATE, on the
+    databases that support it) and their version columns are checked
+    when written, so two transactions cannot both book the same dates
+    or both spend the same balance.
+    Parameters:
+        see create_booking
+    Returns:
+        The new booking, or None if the booking is not allowed
+    Raises:
+        BookingConflict if the listing or the user changed meanwhile
+    '''
+    # Check if the listing and user exists
+    # Always lock the listing before the user to avoid deadlocks
+    listing = Listing.query.filter_by(id=listing_id).with_for_update() \
+        .one_or_none()
+    user = User.query.filter_by(id=uid).with_for_update().one_or_none()
+    if user is None or listing is None:
+        return None
 
     # Ensure it's not the user's own listing
     if listing.owner_id == user.id:
-        return False
+        return None
 
     # Ensure the user can afford the booking
     # Note: this assumes a set listing price regardless of length of stay.
     # The current listing model does not specify the meaning of the price.
     if user.balance - listing.price < 0:
-        return False
-
-    # First ensure that the date formats are correct
-    if not isinstance(start_date, date) or not isinstance(end_date, date):
-        return False
+        return None
 
     # Ensure the listing is not already booked during those times
-    # We query the db to find all bookings for the given listing
-    # We then have 3 scenarios to check:
-    # 1) Starts before an existing booking and ends after the existing booking
-    # 2) Ends during an existing booking
-    # 3) Starts during an existing booking
-    num_conflicts = Booking.query.filter(
-        (Booking.listing_id == listing_id),
-        (
-            ((start_date <= Booking.start_date) & (end_date >= Booking.
-                                                   end_date))
-            | ((end_date <= Booking.end_date) & (end_date >= Booking.
-                                                 start_date))
-            | ((start_date >= Booking.start_date) & (start_date <= Booking.
-                                                     end_date))
-        ),
-    ).count()
-    if num_conflicts > 0:
-        return False
+    # (see booked_dates for how the booked ranges are kept), with the
+    # version of the locked row: no query when the ranges are current
+    version, email = listing.version, user.email
+    if not booked_dates.is_free(listing_id, start_date, end_date, version):
+        return None
+
+    # Bump the versions only if nobody else did since we read them
+    if Listing.query.filter_by(id=listing_id, version=version) \
+            .update({Listing.version: Listing.version + 1},
+                    synchronize_session=False) != 1:
+        raise BookingConflict()
+    if User.query.filter_by(id=uid, version=user.version).update(
+            {User.balance: User.balance - listing.price,
+             User.version: User.version + 1},
+            synchronize_session=False) != 1:
+        raise BookingConflict()
+    # The pages showing the listing change with its version
+    record_changes([listing_id])
 
     booking = Booking(listing_id=listing_id, price=listing.price,
                       date=date.today(), user_id=uid,
                       owner_id=listing.owner_id, start_date=start_date,
                       end_date=end_date)
-
-    user.balance = user.balance - listing.price
-
     db.session.add(booking)
     db.session.commit()
-    return True
+    booked_dates.added(listing_id, start_date, end_date, version + 1)
+    # The balance and the listing version changed
+    user_cache.invalidate(uid)
+    cache.invalidate_tags('listing:%d' % listing_id, 'balance:%s' % email)
+    return booking
+
+
+def create_bookings_bulk(rows):
+    '''
+    Create many bookings at once, with the same rules as create_booking:
+    the user and listing exist, the user does not own the listing and
+    can afford it, and the dates are free (also within the batch).
+    The users, listings and booked dates of the batch are loaded with
+    one query each, and the bookings are saved with one insert.
+      Parameters:
+        rows (list of dict):  bookings, with the keys listing_id,
+                              user_id, start_date and end_date
+                              (dates or 'YYYY-MM-DD' strings)
+      Returns:
+        A list with, for each row, None if the booking was created,
+        otherwise the reason it was rejected
+    '''
+    errors = []
+    parsed = []
+    for row in rows:
+        try:
+            listing_id = int(row.get('listing_id'))
+            uid = int(row.get('user_id'))
+            start, end = row.get('start_date'), row.get('end_date')
+            if isinstance(start, str):
+                start = date.fromisoformat(start)
+            if isinstance(end, str):
+                end = date.fromisoformat(end)
+        except (TypeError, ValueError):
+            errors.append('Invalid ids or dates')
+            parsed.append(None)
+            continue
+        if not isinstance(start, date) or not isinstance(end, date):
+            errors.append('Invalid ids or dates')
+            parsed.append(None)
+            continue
+        errors.append(None)
+        parsed.append((listing_id, uid, start, end))
+
+    valid = [i for i, error in enumerate(errors) if error is None]
+    listing_ids = {parsed[i][0] for i in valid}
+    user_ids = {parsed[i][1] for i in valid}
+    listings = {id: (owner_id, price) for id, owner_id, price in query_in(
+        db.session.query(Listing.id, Listing.owner_id, Listing.price),
+        Listing.id, listing_ids)}
+    users, emails = {}, {}
+    for uid, balance, email in query_in(
+            db.session.query(User.id, User.balance, User.email),
+            User.id, user_ids):
+        users[uid], emails[uid] = balance, email
+    intervals = {}
+    for listing_id, start, end in query_in(
+            db.session.query(Booking.listing_id, Booking.start_date,
+                             Booking.end_date).filter(
+                Booking.start_date.isnot(None),
+                Booking.end_date.isnot(None)),
+            Booking.listing_id, listings):
+        intervals.setdefault(listing_id, []).append((start, end))
+    booked = {listing_id: Availability(intervals.get(listing_id, ()))
+              for listing_id in listings}
+
+    bookings = []
+    spent = {}
+    today = date.today()
+    for i in valid:
+        listing_id, uid, start, end = parsed[i]
+        if listing_id not in listings or uid not in users:
+            errors[i] = 'User or listing does not exist'
+            continue
+        owner_id, price = listings[listing_id]
+        if owner_id == uid:
+            errors[i] = 'User owns the listing'
+        elif users[uid] - price < 0:
+            errors[i] = 'Balance too low'
+        elif not booked[listing_id].is_free(start, end):
+            errors[i] = 'Dates already booked'
+        else:
+            users[uid] -= price
+            spent[uid] = spent.get(uid, 0) + price
+            booked[listing_id].add(start, end)
+            bookings.append({
+                'listing_id': listing_id, 'price': price, 'date': today,
+                'user_id': uid, 'owner_id': owner_id,
+                'start_date': start, 'end_date': end,
+            })
+
+    if bookings:
+        booked_ids = {booking['listing_id'] for booking in bookings}
+        db.session.execute(insert(Booking), bookings)
+        # Charge the users, and bump the versions checked by
+        # create_booking so a concurrent booking starts over
+        conn = db.session.connection()
+        users_table, listings_table = User.__table__, Listing.__table__
+        conn.execute(
+            users_table.update().where(
+                users_table.c.id == bindparam('uid')).values(
+                balance=users_table.c.balance - bindparam('spent'),
+                version=users_table.c.version + 1),
+            [{'uid': uid, 'spent': amount} for uid, amount in spent.items()])
+        conn.execute(
+            listings_table.update().where(
+                listings_table.c.id == bindparam('lid')).values(
+                version=listings_table.c.version + 1),
+            [{'lid': listing_id} for listing_id in booked_ids])
+        record_changes(booked_ids)
+        db.session.commit()
+        for listing_id in booked_ids:
+            booked_dates.invalidate(listing_id)
+        for uid in spent:
+            user_cache.invalidate(uid)
+        cache.invalidate_tags(
+            *['balance:%s' % emails[uid] for uid in spent] +
+            ['listing:%d' % listing_id for listing_id in booked_ids])
+    return errors
 
 
+@cache.cached(tags=['listings'], prepare=snapshots)
 def browse_listings(user_id):
     '''
     Find all listings where the user is not the owner
@@ -727,6 +1225,342 @@ def browse_listings(user_id):
     return listings
 
 
+# Columns that can be selected in the column-only queries
+LISTING_FIELDS = ('id', 'title', 'description', 'price', 'last_modified_date',
+                  'owner_id', 'property_id')
+BOOKING_FIELDS = ('id', 'listing_id', 'user_id', 'owner_id', 'price', 'date',
+                  'start_date', 'end_date')
+
+
+def select_fields(model, fields):
+    '''
+    Query some columns of a model instead of whole objects: the rows
+    are light tuples, with no identity map or change tracking
+    Parameters:
+        model   (class):    Listing or Booking
+        fields  (list):     column names, duplicates are ignored
+    Returns:
+        The query, whose rows have the columns as attributes
+    '''
+    names = list(dict.fromkeys(fields))
+    return db.session.query(*[getattr(model, name) for name in names])
+
+
+def find_listing_fields(listing_id, fields=LISTING_FIELDS):
+    '''
+    Find some columns of the listing of a certain id
+    Parameters:
+        listing_id  (int):      listing id
+        fields      (list):     names of the LISTING_FIELDS to load
+    Returns:
+        The row, or None if the listing does not exist
+    '''
+    return select_fields(Listing, fields).filter(
+        Listing.id == listing_id).one_or_none()
+
+
+def find_listings_fields(owner_id, fields=LISTING_FIELDS):
+    '''
+    Find some columns of the listings of a certain owner
+    Parameters:
+        owner_id    (int):      owner id
+        fields      (list):     names of the LISTING_FIELDS to load
+    Returns:
+        The rows, by id
+    '''
+    return select_fields(Listing, fields).filter(
+        Listing.owner_id == owner_id).order_by(Listing.id).all()
+
+
+def find_bookings_fields(user_id, fields=BOOKING_FIELDS):
+    '''
+    Find some columns of the bookings where the user is the renter
+    Parameters:
+        user_id     (int):      user id
+        fields      (list):     names of the BOOKING_FIELDS to load
+    Returns:
+        The rows, by id
+    '''
+    return select_fields(Booking, fields).filter(
+        Booking.user_id == user_id).order_by(Booking.id).all()
+
+
+def browse_version():
+    '''
+    Version of the browsed listings, which changes whenever a listing is
+    created, updated or booked: the id of the last listing change, read
+    from the primary key of the listing_change table.
+    Returns:
+        The id of the last listing change (0 if none)
+    '''
+    return last_change(db.session)
+
+
+# Default and maximum number of listings on a browse page
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def browse_listings_page(user_id, sort='price', after=None, min_price=None,
+                         max_price=None, title_prefix=None,
+                         limit=PAGE_SIZE, fields=None, country=None,
+                         state=None, city=None, zip_prefix=None, near=None):
+    '''
+    Find one page of the listings where the user is not the owner.
+    Pages are found with a cursor on the sort key (keyset pagination),
+    so a deep page costs as much as the first one.
+    Parameters:
+        user_id      (int):     user id
+        sort         (string):  'price' (cheapest first) or
+                                'newest' (last modified first)
+        after        (string):  cursor returned with the previous page
+        min_price    (float):   minimum price (optional)
+        max_price    (float):   maximum price (optional)
+        title_prefix (string):  start of the title (optional)
+        limit        (int):     page size, capped to MAX_PAGE_SIZE
+        fields       (list):    names of the LISTING_FIELDS to load,
+                                instead of the whole listings (optional)
+        country, state, city (string):
+                                location of the property (optional)
+        zip_prefix   (string):  start of the zip code (optional)
+        near         (tuple):   (latitude, longitude, km): only the
+                                properties within that distance
+                                (optional)
+    Returns:
+        A tuple (listings, cursor of the next page or None)
+    '''
+    if sort == 'newest':
+        key = Listing.last_modified_date
+        order = (Listing.last_modified_date.desc(), Listing.id.desc())
+    else:
+        key = Listing.price
+        order = (Listing.price, Listing.id)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if fields is None:
+        query = Listing.query
+    else:
+        # The cursor is built from the id and the sort key
+        query = select_fields(Listing, list(fields) + ['id', key.key])
+    query = query.filter(Listing.owner_id != user_id)
+    if min_price is not None:
+        query = query.filter(Listing.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Listing.price <= max_price)
+    if title_prefix:
+        query = query.filter(
+            Listing.title.startswith(title_prefix, autoescape=True))
+    query = filter_location(query, country, state, city, zip_prefix, near)
+
+    cursor = decode_cursor(after, sort)
+    if cursor is not None:
+        value, last_id = cursor
+        if sort == 'newest':
+            query = query.filter(or_(key < value, and_(
+                key == value, Listing.id < last_id)))
+        else:
+            query = query.filter(or_(key > value, and_(
+                key == value, Listing.id > last_id)))
+
+    # Fetch one more row to know if there is a next page
+    listings = query.order_by(*order).limit(limit + 1).all()
+    if len(listings) <= limit:
+        return listings, None
+    listings = listings[:limit]
+    return listings, encode_cursor(listings[-1], sort)
+
+
+def prefix_range(column, prefix):
+    '''
+    Condition "the column starts with the prefix", as a range of the
+    index of the column (LIKE does not use it on SQLite, where it
+    ignores the case). The upper bound is the prefix with its last
+    character incremented, which every charset can store as long as
+    the prefix is ASCII (the zip codes are uppercased alphanumerics,
+    the geohashes base32). Other prefixes fall back to LIKE.
+    '''
+    if not prefix or not prefix.isascii() or prefix[-1] == '\x7f':
+        return column.startswith(prefix, autoescape=True)
+    return and_(column >= prefix,
+                column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def filter_location(query, country=None, state=None, city=None,
+                    zip_prefix=None, near=None):
+    '''
+    Keep the listings whose property is at a location
+    (see browse_listings_page for the parameters)
+    Returns:
+        The filtered query, unchanged without location
+    '''
+    if country or state or city or zip_prefix:
+        query = query.join(Property, Property.id == Listing.property_id)
+    if country:
+        query = query.filter(Property.country == country)
+    if state:
+        query = query.filter(Property.state == state)
+    if city:
+        query = query.filter(Property.city == city)
+    if zip_prefix:
+        query = query.filter(prefix_range(Property.zip_code,
+                                          zip_prefix.strip().upper()))
+    if near:
+        latitude, longitude, km = near
+        # Read the grid cells around the point, not every property
+        nearby = select(Property.id).where(within_km(
+            Property.latitude, Property.longitude, latitude, longitude, km))
+        cells = covering_cells(latitude, longitude, km)
+        if cells:
+            nearby = nearby.where(or_(*[prefix_range(Property.geohash, cell)
+                                        for cell in sorted(cells)]))
+        # As a subquery: the planner cannot tell how few properties
+        # the cells hold, and would rather scan all the listings in
+        # the order of the page
+        query = query.filter(Listing.property_id.in_(nearby))
+    return query
+
+
+def location_facets(user_id, country=None, state=None):
+    '''
+    Count the listings of the other users by location, one level
+    below the given one: the countries, the states of a country, or
+    the cities of a state
+    Parameters:
+        user_id  (int):     user id
+        country  (string):  country (optional)
+        state    (string):  state, with the country (optional)
+    Returns:
+        A list of (name, number of listings), by name
+    '''
+    if country and state:
+        column = Property.city
+    elif country:
+        column = Property.state
+    else:
+        column = Property.country
+    query = db.session.query(column, func.count(Listing.id)) \
+        .join(Property, Property.id == Listing.property_id) \
+        .filter(Listing.owner_id != user_id)
+    if country:
+        query = query.filter(Property.country == country)
+        if state:
+            query = query.filter(Property.state == state)
+    return [tuple(row) for row in
+            query.group_by(column).order_by(column).all()]
+
+
+# Full-text index of the listing titles and descriptions
+listing_search = ListingSearch(lambda: db.session)
+# Prefix index of the listing titles
+title_suggest = TitleSuggest(lambda: db.session)
+
+
+def index_listings(listings):
+    '''
+    Log new or updated listings in the listing_change table, and tell
+    the in-process indexes about them, before the commit
+    Parameters:
+        listings (list):    objects or rows with the id, title,
+                            description and owner_id
+    '''
+    record_changes([listing.id for listing in listings])
+    update_indexes(listings)
+
+
+def update_indexes(listings):
+    '''
+    Tell the in-process indexes about new or updated listings
+    Parameters:
+        listings (list):    see index_listings
+    '''
+    listing_search.indexed(listings)
+    title_suggest.indexed(listings)
+
+
+def record_changes(listing_ids):
+    '''
+    Give the listings a new change id, in the transaction changing them.
+    Their former change is deleted: the table keeps one row per listing.
+    Parameters:
+        listing_ids (list):     ids of the changed listings
+    '''
+    listing_ids = list(set(listing_ids))
+    for i in range(0, len(listing_ids), IN_CHUNK_SIZE):
+        ListingChange.query.filter(ListingChange.listing_id.in_(
+            listing_ids[i:i + IN_CHUNK_SIZE])).delete(
+            synchronize_session=False)
+    if listing_ids:
+        db.session.execute(insert(ListingChange), [
+            {'listing_id': listing_id} for listing_id in listing_ids])
+
+
+def search_listings(query, user_id=None, limit=PAGE_SIZE, fields=None):
+    '''
+    Find the listings best matching a text (see app/search.py)
+    Parameters:
+        query    (string):  words that the title or description must have
+                            (but the stop words, see app/search.py)
+        user_id  (int):     leave out the listings of this user (optional)
+        limit    (int):     number of results, capped to MAX_PAGE_SIZE
+        fields   (list):    names of the LISTING_FIELDS to load,
+                            instead of the whole listings (optional)
+    Returns:
+        The listings, best match first
+    '''
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    ids = listing_search.search(query, limit, exclude_owner=user_id)
+    if not ids:
+        return []
+    if fields is None:
+        query = Listing.query
+    else:
+        query = select_fields(Listing, list(fields) + ['id'])
+    found = {row.id: row for row in query.filter(Listing.id.in_(ids))}
+    return [found[listing_id] for listing_id in ids if listing_id in found]
+
+
+def suggest_titles(prefix, user_id=None, limit=10):
+    '''
+    Complete the start of a listing title (see app/suggest.py)
+    Parameters:
+        prefix   (string):  start of the title, any case
+        user_id  (int):     leave out the listings of this user (optional)
+        limit    (int):     number of suggestions, capped to MAX_PAGE_SIZE
+    Returns:
+        A list of (listing id, title), in alphabetical order
+    '''
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return title_suggest.lookup(prefix, limit, exclude_owner=user_id)
+
+
+def encode_cursor(listing, sort):
+    '''
+    Build the cursor pointing after the given listing
+    '''
+    if sort == 'newest':
+        return '{}_{}'.format(listing.last_modified_date.isoformat(),
+                              listing.id)
+    return '{!r}_{}'.format(listing.price, listing.id)
+
+
+def decode_cursor(cursor, sort):
+    '''
+    Read a cursor built by encode_cursor
+    Returns:
+        A tuple (sort key value, listing id), or None if the
+        cursor is missing or malformed
+    '''
+    if not cursor:
+        return None
+    try:
+        value, last_id = cursor.rsplit('_', 1)
+        if sort == 'newest':
+            return date.fromisoformat(value), int(last_id)
+        return float(value), int(last_id)
+    except ValueError:
+        return None
+
+
 def find_bookings(user_id):
     '''
     Find all bookings where the user is the renter
@@ -747,14 +1581,73 @@ def find_booked_listing(user_id):
     Returns:
         The listings the user has booked
     '''
-    bookings = find_bookings(user_id)
-    listings = []
-    for x in range(len(bookings)):
-        listing = Listing.query.filter_by(id=bookings[x].listing_id).all()[0]
-        listings.append(listing)
+    # Join the bookings to their listings in a single query
+    # instead of one query per booking
+    listings = db.session.query(Listing).join(
+        Booking, Booking.listing_id == Listing.id).filter(
+        Booking.user_id == user_id).order_by(Booking.id).all()
     return listings
 
 
+def load_dashboard(user_id):
+    '''
+    Load everything shown on the user's profile page in two queries
+    Parameters:
+        user_id    (int):      user id
+    Returns:
+        A tuple (owned listings, bookings, booked listings)
+    '''
+    listings = find_listings(user_id)
+    # Fetch the bookings together with their listings
+    rows = db.session.query(Booking, Listing).outerjoin(
+        Listing, Booking.listing_id == Listing.id).filter(
+        Booking.user_id == user_id).order_by(Booking.id).all()
+    bookings = [booking for booking, _ in rows]
+    booked_listings = [listing for _, listing in rows if listing is not None]
+    return listings, bookings, booked_listings
+
+
+# Rows fetched at a time by the exports
+EXPORT_BATCH_SIZE = 1000
+
+# Columns of the exported bookings and listings
+BOOKING_EXPORT_COLUMNS = ('id', 'listing_id', 'user_id', 'owner_id', 'price',
+                          'date', 'start_date', 'end_date')
+LISTING_EXPORT_COLUMNS = ('id', 'title', 'description', 'price',
+                          'last_modified_date', 'property_id')
+
+
+def iter_user_bookings(user_id):
+    '''
+    Stream the bookings the user made, and the bookings of the user's
+    listings, without loading them all in memory (server-side cursor)
+    Parameters:
+        user_id    (int):      user id
+    Returns:
+        A generator of rows with the BOOKING_EXPORT_COLUMNS
+    '''
+    columns = [getattr(Booking, name) for name in BOOKING_EXPORT_COLUMNS]
+    return db.session.query(*columns).filter(
+        (Booking.user_id == user_id) | (Booking.owner_id == user_id)
+    ).order_by(Booking.id).yield_per(EXPORT_BATCH_SIZE)
+
+
+def iter_user_listings(owner_id):
+    '''
+    Stream the listings of an owner, without loading them all in memory
+    (server-side cursor)
+    Parameters:
+        owner_id    (int):      owner id
+    Returns:
+        A generator of rows with the LISTING_EXPORT_COLUMNS
+    '''
+    columns = [getattr(Listing, name) for name in LISTING_EXPORT_COLUMNS]
+    return db.session.query(*columns).filter(
+        Listing.owner_id == owner_id
+    ).order_by(Listing.id).yield_per(EXPORT_BATCH_SIZE)
+
+
+@cache.cached(tags=lambda email: ['balance:%s' % email])
 def get_user_balance(email):
     '''
     Determine the balance of the user
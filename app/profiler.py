@@ -0,0 +1,161 @@
+import cProfile
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from flask import Response, g, request
+from app import app
+from app.controllers import authenticate
+
+'''
+This file defines the profilers of a running worker:
+
+- GET /debug/profile?seconds=N samples the stacks of the other threads
+  of the process for N seconds and answers with the collapsed stacks
+  (one "frame;frame;frame count" line per stack), the input of
+  flamegraph.pl and speedscope. Only the frames from the first frame of
+  the app (the route, or a request hook) down are kept, so the roots of
+  the flame graph are the Flask routes and the threads waiting for work
+  are left out. Only the users whose email is in ADMIN_EMAILS may call
+  it. With gunicorn, it sees the requests of the threads of the worker
+  that answered it (web_threads).
+- With profile_requests=1 in the environment, every request slower than
+  PROFILE_MIN_MS runs under cProfile, and its stats are written to
+  PROFILE_DIR, one file per request, to read with pstats or snakeviz.
+  The files are named after the time, the endpoint, the process id and
+  a counter of the process, so the requests of the same second in
+  several workers do not overwrite each other.
+
+Nothing is registered for the requests while profile_requests is off,
+and the endpoint costs nothing until it is called.
+'''
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two samples of the stacks
+SAMPLE_INTERVAL = 0.005
+
+# Longest profile of /debug/profile, in seconds
+MAX_SECONDS = 60
+
+# One profile at a time: the sampling holds a thread of the worker
+profile_lock = threading.Lock()
+
+# Number of the request profiles written by this process
+profile_numbers = itertools.count(1)
+
+
+def frame_name(frame):
+    return '{}:{}'.format(frame.f_globals.get('__name__', '?'),
+                          frame.f_code.co_name)
+
+
+def collapse(frame, root='app.'):
+    '''
+    Collapse a stack for the flame graphs
+      Parameters:
+        frame (frame):  innermost frame of the stack
+        root  (string): prefix of the modules where the stack starts
+      Returns:
+        The names of the frames from the first one in a module under
+        root, outermost first and joined by ';', or None if no frame
+        is under root
+    '''
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    for i, name in enumerate(names):
+        if name.startswith(root):
+            return ';'.join(names[i:])
+    return None
+
+
+def sample_stacks(seconds, interval=SAMPLE_INTERVAL, root='app.'):
+    '''
+    Sample the stacks of the other threads of the process
+      Parameters:
+        seconds  (float):  how long to sample
+        interval (float):  seconds between two samples
+        root     (string): see collapse
+      Returns:
+        The number of times each collapsed stack was seen (a Counter),
+        and the number of samples taken
+    '''
+    me = threading.get_ident()
+    stacks = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident != me:
+                stack = collapse(frame, root)
+                if stack is not None:
+                    stacks[stack] += 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+@authenticate
+def debug_profile(user):
+    if user.email not in app.config['ADMIN_EMAILS']:
+        return Response('Admins only\n', status=403, mimetype='text/plain')
+    try:
+        seconds = float(request.args.get('seconds', '10'))
+    except ValueError:
+        seconds = 0
+    if not 0 < seconds <= MAX_SECONDS:
+        return Response('seconds must be between 0 and {}\n'.format(
+            MAX_SECONDS), status=400, mimetype='text/plain')
+    if not profile_lock.acquire(blocking=False):
+        return Response('A profile is already running\n', status=409,
+                        mimetype='text/plain')
+    try:
+        stacks, samples = sample_stacks(seconds)
+    finally:
+        profile_lock.release()
+    body = ''.join('{} {}\n'.format(stack, count)
+                   for stack, count in stacks.most_common())
+    response = Response(body, mimetype='text/plain')
+    response.headers['X-Profile-Samples'] = str(samples)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def start_request_profile():
+    g.profile = cProfile.Profile()
+    g.profile_started = time.perf_counter()
+    g.profile.enable()
+
+
+def finish_request_profile(response):
+    '''
+    Stop the profile of the request, and keep it if the request was
+    slower than PROFILE_MIN_MS
+    '''
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    profile.disable()
+    elapsed = time.perf_counter() - g.pop('profile_started')
+    if elapsed * 1000 < app.config['PROFILE_MIN_MS']:
+        return response
+    os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+    path = os.path.join(app.config['PROFILE_DIR'], '{}-{}-{}-{}.prof'.format(
+        time.strftime('%Y%m%dT%H%M%S'), request.endpoint or 'unmatched',
+        os.getpid(), next(profile_numbers)))
+    profile.dump_stats(path)
+    logger.info('profiled %s %s in %.1f ms: %s', request.method,
+                request.path, elapsed * 1000, path)
+    return response
+
+
+app.add_url_rule('/debug/profile', 'debug_profile', debug_profile)
+if app.config['PROFILE_REQUESTS']:
+    app.before_request(start_request_profile)
+    app.after_request(finish_request_profile)
@@ -0,0 +1,425 @@
+import heapq
+import math
+import re
+import threading
+import time
+from sqlalchemy import text
+
+'''
+This file defines the full-text search over the listing titles and
+descriptions.
+
+On SQLite, the index is the FTS5 table listing_fts, created by the
+migrations and kept up to date by triggers on the listing table, in
+the same transaction as every write. On the other databases, or
+without FTS5, an inverted index is built in each process on the first
+search, and kept up to date by the model functions and a periodic
+check for the listings changed by the other processes: every change
+of a listing gets a new, growing id in the listing_change table, and
+each process reads the changes after the last id it saw.
+
+Both match the listings having every word of the query, except the
+stop words, and rank them with BM25, the words of the title counting
+TITLE_WEIGHT times those of the description:
+
+- The words found in half the listings or more weigh nothing in BM25
+  (their IDF is clamped to zero), so they are stop words: they are left
+  out of a query having rarer words, which may then match listings
+  without them. A query made only of stop words returns the newest
+  listings having all of them, without ranking.
+- Only the RANK_LIMIT newest matches are ranked, so an older listing
+  may be missing from the results of a query matching more listings.
+'''
+
+# Table of the SQLite index
+FTS_TABLE = 'listing_fts'
+
+# Words are the runs of letters and digits: the spaces and the
+# punctuation allowed by desc_character_check separate them
+WORD = re.compile(r'[^\W_]+')
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+TITLE_WEIGHT = 2.0
+
+# Matches ranked at most (computing BM25 costs a few microseconds each)
+RANK_LIMIT = 1000
+
+# Newest matches read to estimate the share of the listings having a
+# word, with FTS5
+SAMPLE_SIZE = 200
+
+# Changes read again at each check: with concurrent writers (not on
+# SQLite), a change can be committed after a newer one was read
+CHANGE_OVERLAP = 100
+
+
+def tokenize(text):
+    '''
+    Split a text into lowercase words
+      Parameters:
+        text (string):  title, description or query
+      Returns:
+        The list of words
+    '''
+    return WORD.findall(text.lower())
+
+
+def fts_query(words):
+    '''
+    Build an FTS5 query matching every word, quoted so that words like
+    AND or NEAR are not read as operators
+    '''
+    return ' '.join('"{}"'.format(word) for word in words)
+
+
+def is_common(frequency, count):
+    '''
+    Returns:
+        True if a word found in `frequency` of `count` listings is a
+        stop word
+    '''
+    return 2 * frequency >= count
+
+
+def last_change(session):
+    '''
+    Returns:
+        The id of the last listing change (0 if none)
+    '''
+    return session.execute(text(
+        'SELECT max(id) FROM listing_change')).scalar() or 0
+
+
+def changed_listings(session, columns, after):
+    '''
+    Read the listings changed since a change
+      Parameters:
+        session (Session):  database session
+        columns (list):     columns of the listings to read
+        after   (int):      id of the last change already read
+      Returns:
+        The rows (change id, listing id, columns...), in the order of
+        the changes, from CHANGE_OVERLAP changes before `after`
+    '''
+    return session.execute(text(
+        'SELECT listing_change.id, listing.id, {} FROM listing_change '
+        'JOIN listing ON listing.id = listing_change.listing_id '
+        'WHERE listing_change.id > :after '
+        'ORDER BY listing_change.id'.format(', '.join(
+            'listing.' + column for column in columns))),
+        {'after': after - CHANGE_OVERLAP}).all()
+
+
+def fts5_available(conn):
+    '''
+    Returns:
+        True if the database is SQLite with the FTS5 module
+    '''
+    if conn.dialect.name != 'sqlite':
+        return False
+    try:
+        return conn.exec_driver_sql(
+            "SELECT 1 FROM pragma_module_list WHERE name = 'fts5'"
+        ).scalar() is not None
+    except Exception:
+        return False
+
+
+def create_fts_table(conn):
+    '''
+    Create and fill the FTS5 index of the listings, where available
+    '''
+    if not fts5_available(conn):
+        return
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = '{}'".format(FTS_TABLE)
+    ).scalar()
+    if exists:
+        return
+    # The tokenizer splits on the same characters as tokenize()
+    conn.exec_driver_sql(
+        "CREATE VIRTUAL TABLE {} USING fts5(title, description, "
+        "tokenize = 'unicode61 remove_diacritics 0')".format(FTS_TABLE))
+    insert = ('INSERT INTO {} (rowid, title, description) '
+              'VALUES (new.id, new.title, new.description);'
+              ).format(FTS_TABLE)
+    delete = 'DELETE FROM {} WHERE rowid = old.id;'.format(FTS_TABLE)
+    conn.exec_driver_sql(
+        'CREATE TRIGGER {0}_insert AFTER INSERT ON listing '
+        'BEGIN {1} END'.format(FTS_TABLE, insert))
+    conn.exec_driver_sql(
+        'CREATE TRIGGER {0}_update AFTER UPDATE OF title, description '
+        'ON listing BEGIN {1} {2} END'.format(FTS_TABLE, delete, insert))
+    conn.exec_driver_sql(
+        'CREATE TRIGGER {0}_delete AFTER DELETE ON listing '
+        'BEGIN {1} END'.format(FTS_TABLE, delete))
+    conn.exec_driver_sql(
+        'INSERT INTO {} (rowid, title, description) '
+        'SELECT id, title, description FROM listing'.format(FTS_TABLE))
+
+
+class InvertedIndex:
+    """
+    In-process inverted index: for each word, the weighted number of
+    times it appears in each listing. Not thread-safe, see
+    ListingSearch for the locking.
+    """
+
+    def __init__(self):
+        # word -> {listing id: weighted frequency}
+        self.postings = {}
+        # listing id -> (number of words, owner id, distinct words)
+        self.documents = {}
+        self.total_length = 0.0
+
+    def add(self, listing_id, title, description, owner_id=None):
+        '''
+        Index a listing, replacing its previous version
+        '''
+        self.remove(listing_id)
+        frequencies = {}
+        title = tokenize(title)
+        description = tokenize(description)
+        for word in title:
+            frequencies[word] = frequencies.get(word, 0) + TITLE_WEIGHT
+        for word in description:
+            frequencies[word] = frequencies.get(word, 0) + 1
+        for word, frequency in frequencies.items():
+            self.postings.setdefault(word, {})[listing_id] = frequency
+        length = len(title) + len(description)
+        self.documents[listing_id] = (length, owner_id, tuple(frequencies))
+        self.total_length += length
+
+    def remove(self, listing_id):
+        document = self.documents.pop(listing_id, None)
+        if document is None:
+            return
+        self.total_length -= document[0]
+        for word in document[2]:
+            posting = self.postings[word]
+            del posting[listing_id]
+            if not posting:
+                del self.postings[word]
+
+    def search(self, words, limit=20, exclude_owner=None,
+               rank_limit=RANK_LIMIT):
+        '''
+        Rank the listings having every word but the stop words with
+        BM25, among the rank_limit last indexed matches (see the top
+        of the file)
+          Parameters:
+            words         (list):   words of the query
+            limit         (int):    number of results
+            exclude_owner (int):    leave out the listings of this owner
+          Returns:
+            The ids of the best listings, best first
+        '''
+        words = set(words)
+        if not words or not self.documents:
+            return []
+        postings = [self.postings.get(word) for word in words]
+        if not all(postings):
+            return []
+        # Intersect from the rarest word
+        postings.sort(key=len)
+        count = len(self.documents)
+        documents = self.documents
+        ranked = [p for p in postings if not is_common(len(p), count)]
+        if not ranked:
+            return self.newest(postings, limit, exclude_owner)
+        postings = ranked
+        average = self.total_length / count
+        # Same formula as the bm25() of FTS5
+        idfs = [max(math.log((count - len(p) + 0.5) / (len(p) + 0.5)),
+                    1e-6) for p in postings]
+        scored = []
+        matches = 0
+        # Newest first: the postings are in the order of indexing
+        for listing_id, frequency in reversed(postings[0].items()):
+            if any(listing_id not in posting for posting in postings[1:]):
+                continue
+            matches += 1
+            if matches > rank_limit:
+                break
+            length, owner_id, _ = documents[listing_id]
+            if owner_id is not None and owner_id == exclude_owner:
+                continue
+            norm = K1 * (1 - B + B * length / average)
+            score = 0.0
+            for posting, idf in zip(postings, idfs):
+                frequency = posting[listing_id]
+                score += idf * frequency * (K1 + 1) / (frequency + norm)
+            scored.append((score, listing_id))
+        # Newest first for equal scores
+        return [listing_id for _, listing_id in
+                heapq.nlargest(limit, scored)]
+
+    def newest(self, postings, limit, exclude_owner):
+        # The newest listings having every word of the postings
+        found = []
+        for listing_id in reversed(postings[0]):
+            if any(listing_id not in posting for posting in postings[1:]):
+                continue
+            owner_id = self.documents[listing_id][1]
+            if owner_id is not None and owner_id == exclude_owner:
+                continue
+            found.append(listing_id)
+            if len(found) == limit:
+                break
+        return found
+
+
+class ListingSearch:
+    """
+    Searches the listings with FTS5 when the table exists, otherwise
+    with an InvertedIndex built on the first search.
+      Parameters:
+        session  (function):  returns the database session
+        refresh  (float):     seconds between two checks for listings
+                              changed by the other processes
+                              (in-process index only)
+    """
+
+    def __init__(self, session, refresh=5.0):
+        self.session = session
+        self.refresh = refresh
+        self.fts = None
+        self.index = None
+        # Id of the last listing change read
+        self.changed = 0
+        self.refreshed_at = 0.0
+        self.lock = threading.Lock()
+
+    def use_fts(self):
+        if self.fts is None:
+            conn = self.session().connection()
+            self.fts = fts5_available(conn) and conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE name = '{}'".format(
+                    FTS_TABLE)).scalar() is not None
+        return self.fts
+
+    def active(self):
+        '''
+        Returns:
+            True if the in-process index is built, and must be told
+            about the new and updated listings
+        '''
+        return self.index is not None and not self.use_fts()
+
+    def indexed(self, listings):
+        '''
+        Add new or updated listings to the in-process index (the FTS5
+        table is updated by its triggers)
+          Parameters:
+            listings (list):    objects or rows with the id, title,
+                                description and owner_id
+        '''
+        if not listings or self.use_fts():
+            return
+        with self.lock:
+            if self.index is None:
+                # Built from the database on the first search
+                return
+            for listing in listings:
+                self.index.add(listing.id, listing.title,
+                               listing.description, listing.owner_id)
+
+    def sync(self):
+        '''
+        Build the in-process index, or add the listings created or
+        updated since the last check (by any process)
+        '''
+        now = time.monotonic()
+        with self.lock:
+            if self.index is not None and \
+                    now - self.refreshed_at < self.refresh:
+                return
+            session = self.session()
+            if self.index is None:
+                # Read before the listings: the changes made meanwhile
+                # are read again at the next check
+                self.changed = last_change(session)
+                self.index = InvertedIndex()
+                rows = session.execute(text(
+                    'SELECT id, title, description, owner_id FROM listing'))
+                for listing_id, title, description, owner_id in rows:
+                    self.index.add(listing_id, title, description, owner_id)
+            else:
+                for change_id, listing_id, title, description, owner_id \
+                        in changed_listings(session, ['title', 'description',
+                                                      'owner_id'],
+                                            self.changed):
+                    self.index.add(listing_id, title, description, owner_id)
+                    self.changed = max(self.changed, change_id)
+            self.refreshed_at = now
+
+    def search(self, query, limit=20, exclude_owner=None):
+        '''
+        Find the listings having every word of the query but the stop
+        words (see the top of the file)
+          Parameters:
+            query         (string): words to search
+            limit         (int):    number of results
+            exclude_owner (int):    leave out the listings of this owner
+          Returns:
+            The ids of the best listings, best first
+        '''
+        words = tokenize(query)
+        if not words:
+            return []
+        if self.use_fts():
+            return self.search_fts(words, limit, exclude_owner)
+        self.sync()
+        with self.lock:
+            return self.index.search(words, limit, exclude_owner)
+
+    def search_fts(self, words, limit, exclude_owner):
+        session = self.session()
+        words = list(dict.fromkeys(words))
+        # The ids of the listings are about their number
+        count = session.execute(
+            text('SELECT max(id) FROM listing')).scalar() or 0
+        ranked = [word for word in words
+                  if not is_common(self.frequency(word, count), count)]
+        params = {'owner': exclude_owner, 'limit': limit}
+        if not ranked:
+            # Only stop words: the newest listings having all of them
+            sql = ('SELECT {0}.rowid FROM {0} '
+                   'JOIN listing ON listing.id = {0}.rowid '
+                   'WHERE {0} MATCH :query AND (:owner IS NULL '
+                   'OR listing.owner_id != :owner) '
+                   'ORDER BY {0}.rowid DESC LIMIT :limit').format(FTS_TABLE)
+            params['query'] = fts_query(words)
+        else:
+            # BM25 is only computed for the newest matches
+            sql = ('SELECT f.rowid FROM (SELECT rowid, bm25({0}, :weight, '
+                   '1.0) AS score FROM {0} WHERE {0} MATCH :query '
+                   'ORDER BY rowid DESC LIMIT :rank_limit) AS f '
+                   'JOIN listing ON listing.id = f.rowid '
+                   'WHERE :owner IS NULL OR listing.owner_id != :owner '
+                   'ORDER BY f.score, f.rowid DESC '
+                   'LIMIT :limit').format(FTS_TABLE)
+            params.update(query=fts_query(ranked), weight=TITLE_WEIGHT,
+                          rank_limit=RANK_LIMIT)
+        return [row[0] for row in session.execute(text(sql), params)]
+
+    def frequency(self, word, count):
+        '''
+        Estimate the number of listings having a word, from the ids of
+        its SAMPLE_SIZE newest matches (the exact number is a scan of
+        all of them)
+          Parameters:
+            word  (string):  a word of a query
+            count (int):     the highest listing id
+          Returns:
+            The estimated number of listings
+        '''
+        ids = [row[0] for row in self.session().execute(text(
+            'SELECT rowid FROM {0} WHERE {0} MATCH :word '
+            'ORDER BY rowid DESC LIMIT :sample'.format(FTS_TABLE)),
+            {'word': fts_query([word]), 'sample': SAMPLE_SIZE})]
+        if len(ids) < SAMPLE_SIZE:
+            return len(ids)
+        return len(ids) * count / (count - ids[-1] + 1)
@@ -0,0 +1,209 @@
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from app import app
+
+'''
+This file defines the slow query log: the SQL statements running longer
+than SLOW_QUERY_MS are logged by the app.slow_queries logger with the
+types of their parameters, the function of app.models that ran them,
+and their plan (EXPLAIN QUERY PLAN on SQLite, EXPLAIN elsewhere). The
+values of the parameters hold passwords and emails: they are only logged
+with SLOW_QUERY_LOG_PARAMETERS.
+
+The statements are timed by the engine events of app/metrics.py. At
+most SLOW_QUERY_LOG_RATE statements are logged per minute, and the plan
+of a statement is kept once explained, so that a burst of slow queries
+does not slow the database further. The plan is asked on a connection
+of its own from the pool: the statement's connection may still have a
+cursor open over its rows.
+'''
+
+logger = logging.getLogger(__name__)
+
+# Statements that EXPLAIN accepts
+EXPLAINED = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+# Characters of the parameters logged
+PARAMETERS_LENGTH = 500
+
+
+class SlowQueryLog:
+    """
+    Logs the slow statements, at most `per_minute` of them per minute.
+      Parameters:
+        threshold   (float):     seconds above which a statement is
+                                 slow (0 to log nothing)
+        per_minute  (int):       statements logged per minute at most
+        plans       (int):       number of plans kept
+        clock       (function):  returns the current time in seconds
+        values      (bool):      log the values of the parameters, not
+                                 only their types
+    """
+
+    def __init__(self, threshold, per_minute=10, plans=256,
+                 clock=time.monotonic, values=False):
+        self.threshold = threshold
+        self.per_minute = per_minute
+        self.values = values
+        self.clock = clock
+        self.lock = threading.Lock()
+        # Token bucket: refilled by per_minute tokens per minute
+        self.tokens = float(per_minute)
+        self.refilled_at = clock()
+        self.suppressed = 0
+        # statement -> plan, least recently used first
+        self.plans = OrderedDict()
+        self.max_plans = plans
+
+    def enabled(self):
+        return self.threshold > 0
+
+    def allow(self):
+        '''
+        Take a token from the bucket
+          Returns:
+            The number of slow statements not logged since the last
+            one, or None if this one must not be logged either
+        '''
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(
+                float(self.per_minute),
+                self.tokens + (now - self.refilled_at) * self.per_minute / 60)
+            self.refilled_at = now
+            if self.tokens < 1:
+                self.suppressed += 1
+                return None
+            self.tokens -= 1
+            suppressed, self.suppressed = self.suppressed, 0
+            return suppressed
+
+    def record(self, conn, statement, parameters, elapsed, executemany):
+        '''
+        Log a slow statement, unless over the rate
+          Parameters:
+            conn        (Connection): connection that ran it
+            statement   (string):     SQL sent to the database
+            parameters  (tuple):      its parameters (a list of them
+                                      if executemany)
+            elapsed     (float):      seconds it took
+            executemany (bool):       whether it ran once per parameters
+        '''
+        suppressed = self.allow()
+        if suppressed is None:
+            return
+        if executemany and parameters:
+            parameters = parameters[0]
+        shown = repr(parameters) if self.values else \
+            describe(parameters)
+        if len(shown) > PARAMETERS_LENGTH:
+            shown = shown[:PARAMETERS_LENGTH] + '...'
+        logger.warning(
+            'slow query: %.1f ms in %s%s\n%s\nparameters: %s\nplan:\n%s',
+            elapsed * 1000, calling_function(),
+            ' (%d more not logged)' % suppressed if suppressed else '',
+            statement, shown, self.plan(conn, statement, parameters))
+
+    def plan(self, conn, statement, parameters):
+        '''
+        Returns:
+            The plan of a statement, from the cache or explained on
+            another connection of the engine
+        '''
+        with self.lock:
+            if statement in self.plans:
+                self.plans.move_to_end(statement)
+                return self.plans[statement]
+        plan = explain(conn, statement, parameters)
+        with self.lock:
+            self.plans[statement] = plan
+            if len(self.plans) > self.max_plans:
+                self.plans.popitem(last=False)
+        return plan
+
+
+def describe(parameters):
+    '''
+    Describe parameters without their values
+      Returns:
+        The type of each parameter, with the length of the strings,
+        e.g. (str[12], int)
+    '''
+    def kind(value):
+        if isinstance(value, (str, bytes)):
+            return '{}[{}]'.format(type(value).__name__, len(value))
+        return type(value).__name__
+
+    if isinstance(parameters, dict):
+        return '{' + ', '.join('{!r}: {}'.format(name, kind(value))
+                               for name, value in parameters.items()) + '}'
+    if isinstance(parameters, (list, tuple)):
+        return '(' + ', '.join(kind(value) for value in parameters) + ')'
+    return kind(parameters)
+
+
+def explain(conn, statement, parameters):
+    '''
+    Ask the database for the plan of a statement, on a DBAPI connection
+    checked out of the pool of the engine: the engine events do not see
+    it, and the cursors of `conn` are left alone
+      Returns:
+        The plan, one line per step
+    '''
+    words = statement.split(None, 1)
+    if not words or words[0].upper() not in EXPLAINED:
+        return '  (not explained)'
+    sqlite = conn.dialect.name == 'sqlite'
+    try:
+        connection = conn.engine.raw_connection()
+    except Exception as error:
+        return '  (EXPLAIN failed: {})'.format(error)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(('EXPLAIN QUERY PLAN ' if sqlite else 'EXPLAIN ') +
+                       statement, parameters)
+        rows = cursor.fetchall()
+        cursor.close()
+    except Exception as error:
+        return '  (EXPLAIN failed: {})'.format(error)
+    finally:
+        connection.close()
+    if sqlite:
+        # (id, parent id, unused, detail): indent the children
+        depths = {0: -1}
+        lines = []
+        for row in rows:
+            depths[row[0]] = depths.get(row[1], -1) + 1
+            lines.append('  ' * (depths[row[0]] + 1) + str(row[-1]))
+        return '\n'.join(lines)
+    return '\n'.join('  ' + ' | '.join(str(value) for value in row)
+                     for row in rows)
+
+
+def calling_function():
+    '''
+    Returns:
+        The innermost function of app.models on the stack, or else of
+        the app, as module.function:line
+    '''
+    frame = sys._getframe(1)
+    fallback = 'unknown'
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module == 'app.models':
+            return '{}.{}:{}'.format(module, frame.f_code.co_name,
+                                     frame.f_lineno)
+        if fallback == 'unknown' and module.startswith('app.') and \
+                module not in ('app.metrics', __name__):
+            fallback = '{}.{}:{}'.format(module, frame.f_code.co_name,
+                                         frame.f_lineno)
+        frame = frame.f_back
+    return fallback
+
+
+slow_query_log = SlowQueryLog(
+    app.config['SLOW_QUERY_MS'] / 1000, app.config['SLOW_QUERY_LOG_RATE'],
+    values=app.config['SLOW_QUERY_LOG_PARAMETERS'])
@@ -0,0 +1,186 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from sqlalchemy import text
+from app.search import changed_listings, last_change
+
+'''
+This file defines the autocompletion of the listing titles.
+
+Each process keeps the titles in a list sorted without case, so that
+the titles starting with a prefix are a contiguous run found with a
+binary search: O(log n) to find the first one, then one step per
+suggestion. The index is built on the first lookup, kept up to date by
+the model functions, and checks every few seconds for the listings
+created or updated by the other processes, in the listing_change table
+(like ListingSearch in app/search.py).
+'''
+
+
+def fold(title):
+    # Sort and match key of a title
+    return title.lower()
+
+
+class TitleIndex:
+    """
+    Sorted array of titles, with their folded key, listing id and owner
+    id at the same position (the keys are a list of their own so that
+    bisect can search them without a key function, which needs Python
+    3.10). Not thread-safe, see TitleSuggest for the
+    locking.
+    """
+
+    def __init__(self):
+        self.titles = []
+        self.keys = []
+        self.ids = array('q')
+        self.owners = array('q')
+        # listing id -> title, to find the entry of an updated listing
+        self.by_id = {}
+
+    def __len__(self):
+        return len(self.titles)
+
+    def load(self, rows):
+        '''
+        Build the index from scratch (faster than adding each row)
+          Parameters:
+            rows (iterable):    tuples (listing id, title, owner id)
+        '''
+        entries = sorted(((fold(title), title, listing_id, owner_id)
+                          for listing_id, title, owner_id in rows))
+        self.titles = [entry[1] for entry in entries]
+        self.keys = [entry[0] for entry in entries]
+        self.ids = array('q', (entry[2] for entry in entries))
+        self.owners = array('q', (-1 if entry[3] is None else entry[3]
+                                  for entry in entries))
+        self.by_id = {entry[2]: entry[1] for entry in entries}
+
+    def add(self, listing_id, title, owner_id=None):
+        '''
+        Index a listing, replacing its previous title
+        '''
+        if self.by_id.get(listing_id) == title:
+            return
+        self.remove(listing_id)
+        key = fold(title)
+        position = bisect_left(self.keys, key)
+        self.titles.insert(position, title)
+        self.keys.insert(position, key)
+        self.ids.insert(position, listing_id)
+        self.owners.insert(position, -1 if owner_id is None else owner_id)
+        self.by_id[listing_id] = title
+
+    def remove(self, listing_id):
+        title = self.by_id.pop(listing_id, None)
+        if title is None:
+            return
+        # Titles differing only by case share the key: look for the id
+        position = bisect_left(self.keys, fold(title))
+        while self.ids[position] != listing_id:
+            position += 1
+        del self.titles[position]
+        del self.keys[position]
+        del self.ids[position]
+        del self.owners[position]
+
+    def lookup(self, prefix, limit=10, exclude_owner=None):
+        '''
+        Find the titles starting with a prefix, without case
+          Parameters:
+            prefix        (string): start of the title
+            limit         (int):    number of suggestions
+            exclude_owner (int):    leave out the listings of this owner
+          Returns:
+            A list of (listing id, title), in alphabetical order
+        '''
+        prefix = fold(prefix)
+        keys = self.keys
+        found = []
+        position = bisect_left(keys, prefix)
+        while position < len(keys) and len(found) < limit and \
+                keys[position].startswith(prefix):
+            if exclude_owner is None or \
+                    self.owners[position] != exclude_owner:
+                found.append((self.ids[position], self.titles[position]))
+            position += 1
+        return found
+
+
+class TitleSuggest:
+    """
+    The TitleIndex of the listings of the database.
+      Parameters:
+        session  (function):  returns the database session
+        refresh  (float):     seconds between two checks for listings
+                              changed by the other processes
+    """
+
+    def __init__(self, session, refresh=5.0):
+        self.session = session
+        self.refresh = refresh
+        self.index = None
+        # Id of the last listing change read
+        self.changed = 0
+        self.refreshed_at = 0.0
+        self.lock = threading.Lock()
+
+    def active(self):
+        '''
+        Returns:
+            True if the index is built, and must be told about the new
+            and updated listings
+        '''
+        return self.index is not None
+
+    def indexed(self, listings):
+        '''
+        Add new or updated listings to the index
+          Parameters:
+            listings (list):    objects or rows with the id, title
+                                and owner_id
+        '''
+        with self.lock:
+            if self.index is None:
+                # Built from the database on the first lookup
+                return
+            for listing in listings:
+                self.index.add(listing.id, listing.title, listing.owner_id)
+
+    def sync(self):
+        '''
+        Build the index, or add the listings created or updated since
+        the last check (by any process)
+        '''
+        now = time.monotonic()
+        with self.lock:
+            if self.index is not None and \
+                    now - self.refreshed_at < self.refresh:
+                return
+            session = self.session()
+            if self.index is None:
+                # Read before the listings: the changes made meanwhile
+                # are read again at the next check
+                self.changed = last_change(session)
+                self.index = TitleIndex()
+                self.index.load(session.execute(text(
+                    'SELECT id, title, owner_id FROM listing')))
+            else:
+                for change_id, listing_id, title, owner_id in \
+                        changed_listings(session, ['title', 'owner_id'],
+                                         self.changed):
+                    self.index.add(listing_id, title, owner_id)
+                    self.changed = max(self.changed, change_id)
+            self.refreshed_at = now
+
+    def lookup(self, prefix, limit=10, exclude_owner=None):
+        '''
+        See TitleIndex.lookup
+        '''
+        if not prefix:
+            return []
+        self.sync()
+        with self.lock:
+            return self.index.lookup(prefix, limit, exclude_owner)
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from app import app
+
+'''
+This file defines the in-process cache of logged in users
+'''
+
+
+class UserCache:
+    """
+    A short-lived cache of user snapshots, keyed by user id.
+    Entries expire after `ttl` seconds and are dropped as soon as the
+    user changes (see invalidate). Each worker process has its own
+    cache, so the ttl bounds how stale another worker's copy can be.
+    At most `max_entries` users are kept, the least recently used are
+    dropped first.
+    """
+
+    def __init__(self, ttl=5.0, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # user id -> (expiry time, snapshot), least recently used first
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, user_id, load):
+        '''
+        Find a user in the cache, loading it on a miss
+          Parameters:
+            user_id (int):        user id
+            load    (function):   called with the id on a miss, returns
+                                  a snapshot of the user or None
+          Returns:
+            The snapshot of the user, or None if it does not exist
+        '''
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        user = load(user_id)
+        if user is not None:
+            with self.lock:
+                self.entries[user_id] = (now + self.ttl, user)
+                self.entries.move_to_end(user_id)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return user
+
+    def invalidate(self, user_id):
+        '''
+        Drop the cached copy of a user after it was updated
+        '''
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        '''
+        Returns:
+            The hit, miss and eviction counters, and the hit ratio
+        '''
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.entries),
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+
+def snapshot(user):
+    '''
+    Copy the columns of a user into a plain object, which stays
+    readable once the database session that loaded the user is gone
+    '''
+    return SimpleNamespace(**{
+        column.key: getattr(user, column.key)
+        for column in user.__table__.columns
+    })
+
+
+user_cache = UserCache(app.config['USER_CACHE_TTL'],
+                       app.config['USER_CACHE_SIZE'])
@@ -0,0 +1,73 @@
+'''
+This file defines the character checks of the user and listing fields.
+
+The checks remove the characters allowed besides letters and digits,
+then test the rest of the string at once with the str methods, instead
+of looping over the characters in Python.
+'''
+
+# Characters allowed in a description besides letters and digits
+DESC_PUNCTUATION = str.maketrans('', '', ' .,!')
+
+
+def desc_character_check(description):
+    '''
+    Check if the given description satisfies:
+    R4-9: The description of the product has to be alphanumeric, and
+    the only other characters allowed are commas, periods, exclamation
+    marks, and spaces.
+    Parameters:
+        description (string):       description of the listing
+    Returns:
+        True if the requirements are meant, otherwise False
+    '''
+    rest = description.translate(DESC_PUNCTUATION)
+    # isalnum() is False for an empty string
+    return not rest or rest.isalnum()
+
+
+def alphanumeric_check(title):
+    '''
+    Check if the given title satisfies:
+    R4-1: The title of the product has to be alphanumeric-only,
+    and space allowed only if it is not as prefix and suffix.
+    Parameters:
+        title (string):       title of the listing
+    Returns:
+        True if the requirements are meant, otherwise False
+    '''
+    if title[0] == " " or title[-1] == " ":
+        return False
+    rest = title.replace(" ", "")
+    return not rest or rest.isalnum()
+
+
+# Ensures the real name is less than 80 chars, and is either alpha or spaces
+def real_name_check(name):
+    # We don't need a real name, but if we have one, do the checks
+    if name is None:
+        return True
+
+    if len(name) > 80 or "\n" in name:
+        return False
+    # split() drops every whitespace character, like isspace()
+    rest = "".join(name.split())
+    return not rest or rest.isalpha()
+
+
+def postal_code_check(postal_code):
+    '''
+    R3-2, R3-3: Ensures postal code is a valid Canadian postal code.
+    Parameters:
+        postal_code (String):   new or updated code
+    Returns:
+        True if the postal code is valid, False otherwise
+    '''
+    if len(postal_code) != 7:
+        return False
+
+    # Format: A1A 1A1
+    return (postal_code[0].isalpha() and postal_code[1].isnumeric() and
+            postal_code[2].isalpha() and postal_code[3] == " " and
+            postal_code[4].isnumeric() and postal_code[5].isalpha() and
+            postal_code[6].isnumeric())
@@ -0,0 +1,44 @@
+import atexit
+import logging
+from app import app
+from app.models import db
+from app import controllers  # noqa: F401
+
+'''
+WSGI entry point used by production servers. The settings of the
+pre-fork server are in gunicorn.conf.py at the project root:
+
+    gunicorn app.wsgi:application
+
+Importing this module connects the routes, and applies the migrations
+once when the server preloads the app before forking the workers.
+'''
+
+logger = logging.getLogger(__name__)
+
+application = app
+
+
+def after_fork():
+    '''
+    Called in each worker right after the fork: drop the connections
+    inherited from the parent without closing them, since the parent
+    still owns the sockets. The worker opens its own on first use.
+    '''
+    db.engine.dispose(close=False)
+
+
+def shutdown():
+    '''
+    Graceful shutdown: close the pooled database connections
+    once the in-flight requests are done.
+    '''
+    logger.info('Closing database connections')
+    db.session.remove()
+    db.engine.dispose()
+
+
+# The connections opened at import (migrations) must not be shared
+# with the forked workers
+db.engine.dispose()
+atexit.register(shutdown)
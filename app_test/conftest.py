@@ -17,8 +17,10 @@ def pytest_sessionstart():
     '''
     print('Setting up environment..')
     db_file = 'db.sqlite'
-    if os.path.exists(db_file):
-        os.remove(db_file)
+    # Also remove the write-ahead log of the previous run
+    for path in (db_file, db_file + '-wal', db_file + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
     app.app_context().push()
 
 
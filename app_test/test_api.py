@@ -0,0 +1,105 @@
+from app import app
+from app.models import register, User, Listing, db
+
+
+def setup_users():
+    register('apihost', 'apihost@test.com', 'Api Host', '12345Aa#')
+    register('apibuyer', 'apibuyer@test.com', 'Api Buyer', '12345Aa#')
+    return (User.query.filter_by(email='apihost@test.com').one().id,
+            User.query.filter_by(email='apibuyer@test.com').one().id)
+
+
+def api_client(email):
+    client = app.test_client()
+    response = client.post('/api/v1/login',
+                           json={'email': email, 'password': '12345Aa#'})
+    assert response.status_code == 200
+    assert 'password' not in response.json
+    return client
+
+
+def test_api_listings():
+    '''
+    Testing the JSON API: create, read, update and browse listings,
+    with field selection.
+    '''
+    host, buyer = setup_users()
+    assert app.test_client().get('/api/v1/user').status_code == 401
+
+    client = api_client('apihost@test.com')
+    response = client.post('/api/v1/listings', json={
+        'title': 'Api listing', 'description': 'This is a description.',
+        'price': 50})
+    assert response.status_code == 201
+    listing = response.json
+    assert listing['owner_id'] == host
+    assert client.post('/api/v1/listings', json={
+        'title': 'Api listing', 'description': 'This is a description.',
+        'price': 50}).status_code == 400
+    assert client.post('/api/v1/listings', json={
+        'title': 'Api listing 2', 'description': ['not', 'text'],
+        'price': 50}).json == {'error': 'Invalid description'}
+
+    response = client.get('/api/v1/listings/{}?fields=id,price'.format(
+        listing['id']))
+    assert response.json == {'id': listing['id'], 'price': 50}
+    assert client.get('/api/v1/listings/{}?fields=password'.format(
+        listing['id'])).status_code == 400
+    assert client.get('/api/v1/listings/999999').status_code == 404
+
+    response = client.patch('/api/v1/listings/{}'.format(listing['id']),
+                            json={'price': 60})
+    assert response.status_code == 200
+    assert response.json['price'] == 60
+    assert response.json['title'] == 'Api listing'
+    for body in ({'title': 12}, {'description': None}):
+        assert client.patch('/api/v1/listings/{}'.format(listing['id']),
+                            json=body).status_code == 400
+    assert client.get('/api/v1/user/listings?fields=title').json == \
+        {'listings': [{'title': 'Api listing'}]}
+
+    # Other users can browse and book the listing, but not update it
+    client = api_client('apibuyer@test.com')
+    assert client.patch('/api/v1/listings/{}'.format(listing['id']),
+                        json={'price': 70}).status_code == 403
+    response = client.get('/api/v1/listings?fields=title&q=Api&limit=1')
+    assert response.json == {'listings': [{'title': 'Api listing'}],
+                             'next': None}
+    price = db.session.get(Listing, listing['id']).price
+    assert price == 60
+
+
+def test_api_profile_and_bookings():
+    '''
+    Testing the JSON API: profile, bookings and logout.
+    '''
+    client = api_client('apibuyer@test.com')
+    profile = client.get('/api/v1/user').json
+    assert profile['username'] == 'apibuyer'
+    assert client.get('/api/v1/user?fields=balance').json == \
+        {'balance': profile['balance']}
+
+    response = client.patch('/api/v1/user',
+                            json={'username': 'apibuyer2'})
+    assert response.status_code == 200
+    assert response.json['username'] == 'apibuyer2'
+    assert client.patch('/api/v1/user',
+                        json={'email': 'not an email'}).status_code == 400
+    for body in ({'username': 5}, {'postal_code': 12345},
+                 {'password': None}, {'billing_address': {}}):
+        assert client.patch('/api/v1/user', json=body).status_code == 400
+
+    listing = Listing.query.filter_by(title='Api listing').one()
+    url = '/api/v1/listings/{}/bookings'.format(listing.id)
+    assert client.post(url, json={'start': 'soon'}).status_code == 400
+    assert client.post(url, json={'start': '2022-12-01',
+                                  'end': '2022-12-03'}).status_code == 201
+    assert client.post(url, json={'start': '2022-12-02',
+                                  'end': '2022-12-04'}).status_code == 409
+    bookings = client.get('/api/v1/user/bookings?fields=listing_id,'
+                          'start_date').json['bookings']
+    assert bookings == [{'listing_id': listing.id,
+                         'start_date': '2022-12-01'}]
+
+    assert client.post('/api/v1/logout').status_code == 204
+    assert client.get('/api/v1/user').status_code == 401
@@ -0,0 +1,118 @@
+import random
+from datetime import date, datetime, timedelta
+from app.availability import Availability, AvailabilityEngine
+
+
+def overlaps(start_date, end_date, start, end):
+    '''
+    The three-way overlap predicate formerly used by create_booking
+    '''
+    return ((start_date <= start and end_date >= end)
+            or (end_date <= end and end_date >= start)
+            or (start_date >= start and start_date <= end))
+
+
+def test_is_free_matches_overlap_query():
+    '''
+    Testing the availability engine: for random bookings, is_free gives
+    the same answer as the former overlap query.
+    '''
+    rnd = random.Random(327)
+    origin = date(2022, 1, 1)
+    booked = []
+    availability = Availability()
+    for _ in range(2000):
+        start = origin + timedelta(days=rnd.randint(0, 400))
+        end = start + timedelta(days=rnd.randint(0, 10))
+        expected = not any(overlaps(start, end, s, e) for s, e in booked)
+        assert availability.is_free(start, end) is expected
+        if expected:
+            booked.append((start, end))
+            availability.add(start, end)
+    assert len(availability) == len(booked)
+
+    # Built from the database rows, in any order
+    assert Availability(reversed(booked)).starts == availability.starts
+
+
+def test_is_free_boundaries():
+    '''
+    Testing the availability engine: ranges are closed, so the next
+    day is free but the last booked day is not.
+    '''
+    availability = Availability([(date(2022, 12, 1), date(2022, 12, 3))])
+    assert availability.is_free(date(2022, 12, 1), date(2022, 12, 3)) is False
+    assert availability.is_free(date(2022, 12, 3), date(2022, 12, 5)) is False
+    assert availability.is_free(date(2022, 11, 25),
+                                date(2022, 12, 1)) is False
+    assert availability.is_free(date(2022, 12, 4), date(2022, 12, 10)) is True
+    assert availability.is_free(date(2022, 11, 1), date(2022, 11, 30)) is True
+    # Datetimes from the booking form are compared as dates
+    assert availability.is_free(datetime(2022, 12, 2, 10),
+                                datetime(2022, 12, 2, 12)) is False
+
+
+def test_next_free_window():
+    '''
+    Testing the availability engine: the first free window skips
+    booked ranges and gaps that are too short.
+    '''
+    availability = Availability([
+        (date(2022, 12, 1), date(2022, 12, 3)),
+        (date(2022, 12, 6), date(2022, 12, 8)),
+        (date(2022, 12, 12), date(2022, 12, 20)),
+    ])
+    # Free right away
+    assert availability.next_free_window(3, date(2022, 11, 1)) == \
+        (date(2022, 11, 1), date(2022, 11, 4))
+    # Starts inside a booking, the gap before the next one is too short
+    assert availability.next_free_window(3, date(2022, 12, 2)) == \
+        (date(2022, 12, 21), date(2022, 12, 24))
+    # Fits in the gap between two bookings
+    assert availability.next_free_window(2, date(2022, 12, 2)) == \
+        (date(2022, 12, 9), date(2022, 12, 11))
+    start, end = availability.next_free_window(2, date(2022, 12, 2))
+    assert availability.is_free(start, end) is True
+
+
+def test_engine_versions():
+    '''
+    Testing the availability engine cache: the version given by the
+    caller saves the version query, a new version rebuilds the ranges,
+    and the least recently used listings are dropped.
+    '''
+    booked = {1: [(date(2022, 12, 1), date(2022, 12, 3))], 2: [], 3: []}
+    versions = {1: 1, 2: 1, 3: 1}
+    loads, reads = [], []
+
+    def load(listing_id):
+        loads.append(listing_id)
+        return booked[listing_id]
+
+    def version(listing_id):
+        reads.append(listing_id)
+        return versions[listing_id]
+
+    engine = AvailabilityEngine(load, version, max_listings=2)
+    assert not engine.is_free(1, date(2022, 12, 2), date(2022, 12, 4), 1)
+    assert engine.is_free(1, date(2022, 12, 4), date(2022, 12, 5), 1)
+    assert loads == [1] and reads == []
+
+    # A booking of this process keeps the ranges
+    engine.added(1, date(2022, 12, 4), date(2022, 12, 5), 2)
+    assert not engine.is_free(1, date(2022, 12, 4), date(2022, 12, 4), 2)
+    assert loads == [1]
+    # A booking of another process bumped the version
+    booked[1].append((date(2022, 12, 10), date(2022, 12, 12)))
+    versions[1] = 3
+    assert not engine.is_free(1, date(2022, 12, 11), date(2022, 12, 11))
+    assert loads == [1, 1] and reads == [1]
+    # Added for an older version than cached: dropped, not trusted
+    engine.added(1, date(2022, 12, 20), date(2022, 12, 21), 3)
+    assert 1 not in engine.listings
+
+    engine.get(1, 3)
+    engine.get(2, 1)
+    engine.get(1, 3)
+    engine.get(3, 1)
+    assert list(engine.listings) == [1, 3]
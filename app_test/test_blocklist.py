@@ -0,0 +1,60 @@
+import os
+from app.blocklist import Blocklist, PatternMatcher, is_blocked, SQLI_FILE
+from app.models import pw_check
+
+
+def test_blocklist_exact_match():
+    '''
+    Testing the SQL injection blocklist: every line of the file is
+    blocked as-is, and ordinary passwords are not.
+    '''
+    with open(SQLI_FILE, 'r') as f:
+        lines = [line.rstrip('\r\n') for line in f if line.strip()]
+
+    for line in lines:
+        assert is_blocked(line) is True
+
+    assert is_blocked('12345Aa#') is False
+    # The line break is not part of the entry
+    assert is_blocked(lines[0] + '\n') is False
+
+
+def test_pw_check_blocked():
+    '''
+    Testing pw_check: a password meeting the complexity rules
+    is still rejected when it is a blocked injection string.
+    '''
+    assert pw_check('benchmark(10000000,MD5(1))#') is False
+    assert pw_check("Passw0rd!") is True
+
+
+def test_pattern_matcher():
+    '''
+    Testing the multi-pattern matcher on overlapping patterns.
+    '''
+    matcher = PatternMatcher(['he', 'she', 'his', 'hers'])
+    assert matcher.find('ushers') == {'he', 'she', 'hers'}
+    assert matcher.find('ahishers') == {'his', 'he', 'she', 'hers'}
+    assert matcher.find('xyz') == set()
+    assert PatternMatcher([]).find('anything') == set()
+
+
+def test_blocklist_reload(tmp_path):
+    '''
+    Testing the blocklist is reloaded once the file changes.
+    '''
+    path = tmp_path / 'blocklist.txt'
+    path.write_text('first\n')
+    blocklist = Blocklist(str(path))
+    assert blocklist.is_blocked('first') is True
+    assert blocklist.is_blocked('second') is False
+
+    path.write_text('second\n')
+    # Force a new mtime and skip the check interval
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    blocklist.checked_at = 0.0
+
+    assert blocklist.is_blocked('first') is False
+    assert blocklist.is_blocked('second') is True
+    assert blocklist.find('the second one') == {'second'}
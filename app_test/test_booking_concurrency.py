@@ -0,0 +1,109 @@
+import threading
+from datetime import date
+from app import app
+from app.models import create_booking, User, Listing, Booking, db
+
+
+def setup_users(count, balance=100):
+    '''
+    Replace every user, listing and booking with `count` new users
+    '''
+    User.query.delete()
+    Listing.query.delete()
+    Booking.query.delete()
+    db.session.commit()
+    users = [User(username='user%d' % i, email='user%d@test.com' % i,
+                  balance=balance, password='12345Aa#',
+                  billing_address='', postal_code='')
+             for i in range(count)]
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def add_listing(owner_id, price=10):
+    listing = Listing(title='Listing', description='This is a description.',
+                      price=price, owner_id=owner_id,
+                      last_modified_date=date(2022, 1, 1))
+    db.session.add(listing)
+    db.session.commit()
+    return listing.id
+
+
+def run_threads(calls):
+    '''
+    Run each create_booking call in its own thread (and app context),
+    all starting at the same time
+    '''
+    results = [None] * len(calls)
+    barrier = threading.Barrier(len(calls))
+
+    def worker(i, args):
+        with app.app_context():
+            barrier.wait()
+            results[i] = create_booking(*args)
+
+    threads = [threading.Thread(target=worker, args=(i, args))
+               for i, args in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    db.session.expire_all()
+    return results
+
+
+def test_concurrent_bookings_same_dates():
+    '''
+    Testing concurrent bookings: 50 users book the same listing for
+    overlapping dates at the same time, exactly one of them wins.
+    '''
+    users = setup_users(51)
+    listing_id = add_listing(users[0])
+
+    results = run_threads([
+        (listing_id, uid, date(2022, 12, 1 + i % 3), date(2022, 12, 5))
+        for i, uid in enumerate(users[1:])])
+
+    assert results.count(True) == 1
+    assert Booking.query.filter_by(listing_id=listing_id).count() == 1
+    # Only the winner paid
+    winner = users[1 + results.index(True)]
+    balances = {user.id: user.balance for user in User.query.all()}
+    assert balances.pop(winner) == 90
+    assert set(balances.values()) == {100}
+
+
+def test_concurrent_bookings_same_user():
+    '''
+    Testing concurrent bookings: a user books 10 listings at the same
+    time and cannot spend more than their balance.
+    '''
+    owner, renter = setup_users(2)
+    listings = [add_listing(owner, price=30) for _ in range(10)]
+
+    results = run_threads([
+        (listing_id, renter, date(2022, 12, 1), date(2022, 12, 5))
+        for listing_id in listings])
+
+    renter_balance = User.query.filter_by(id=renter).one().balance
+    assert results.count(True) == Booking.query.count()
+    assert renter_balance == 100 - 30 * results.count(True)
+    assert renter_balance >= 0
+    assert results.count(True) >= 1
+
+
+def test_concurrent_bookings_other_dates():
+    '''
+    Testing concurrent bookings: bookings of separate dates
+    all succeed.
+    '''
+    users = setup_users(11)
+    listing_id = add_listing(users[0])
+
+    results = run_threads([
+        (listing_id, uid, date(2022, 1 + i, 1), date(2022, 1 + i, 5))
+        for i, uid in enumerate(users[1:])])
+
+    assert all(results)
+    assert Booking.query.filter_by(listing_id=listing_id).count() == 10
@@ -0,0 +1,206 @@
+import pickle
+import threading
+import time
+import pytest
+from datetime import date, datetime
+from types import SimpleNamespace
+from app.cache import Cache, CacheError, LRUBackend, RedisBackend, \
+    NullBackend, cache, backend_from_url, dumps, loads
+from app.cache_server import CacheServer
+from app.models import find_listing_by_id, update_listing, register, User, \
+    Listing, create_booking, create_bookings_bulk, get_user_balance, \
+    update_user, db
+
+
+def test_lru_backend():
+    '''
+    Testing the in-process backend: least recently used entries are
+    evicted first, and expired entries are misses.
+    '''
+    backend = LRUBackend(max_entries=2)
+    backend.set_many({'a': 1, 'b': 2})
+    assert backend.get_many(['a']) == {'a': 1}
+    backend.set_many({'c': 3})
+    assert backend.get_many(['a', 'b', 'c']) == {'a': 1, 'c': 3}
+    assert backend.evictions == 1
+    backend.set_many({'d': 4}, ttl=0.01)
+    time.sleep(0.02)
+    assert backend.get_many(['d']) == {}
+
+
+def check_cache(cache):
+    cache.clear()
+    cache.set('a', [1, 2])
+    cache.set_many({'b': None, 'c': 'three'}, ttl=0)
+    assert cache.get('a') == [1, 2]
+    assert cache.get_many(['a', 'b', 'x']) == {'a': [1, 2], 'b': None}
+    assert cache.get('x', 'default') == 'default'
+    cache.delete('a')
+    assert cache.get('a') is None
+
+    # Namespaces do not share keys, but share the tags
+    users = cache.namespace('users')
+    users.set('c', 'user c', tags=['t1'])
+    cache.set('d', 'd', tags=['t1', 't2'])
+    cache.set('e', 'e', tags=['t2'])
+    assert users.get('c') == 'user c' and cache.get('c') == 'three'
+    cache.invalidate_tags('t1')
+    assert users.get('c') is None
+    assert cache.get_many(['d', 'e']) == {'e': 'e'}
+
+    stats = cache.stats()
+    assert stats['hits'] == 6 and stats['misses'] == 5
+    assert stats['sets'] == 6 and stats['errors'] == 0
+    assert abs(stats['hit_ratio'] - 6 / 11) < 1e-9
+
+
+def test_cache_memory():
+    '''
+    Testing the cache: get, set, delete, namespaces and tags.
+    '''
+    check_cache(Cache(LRUBackend()))
+
+
+def test_cache_redis():
+    '''
+    Testing the cache on the Redis protocol, with the stand-in server,
+    then with the server gone: the cache only misses.
+    '''
+    server = CacheServer(('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        backend = backend_from_url('redis://127.0.0.1:{}/1'.format(
+            server.server_address[1]))
+        assert isinstance(backend, RedisBackend) and backend.db == 1
+        check_cache(Cache(backend))
+        assert backend.execute(['PING'], ['DBSIZE']) == ['PONG', 7]
+        backend.set_many({'ttl': 1}, ttl=0.01)
+        time.sleep(0.02)
+        assert backend.get_many(['ttl']) == {}
+
+        # Values that are not JSON, like pickles, are never loaded
+        local = Cache(backend)
+        backend.execute(['SET', 'pickled', pickle.dumps((1, []))])
+        assert local.get('pickled') is None
+        assert local.stats()['errors'] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+    backend.close()
+    down = Cache(backend)
+    down.set('a', 1)
+    assert down.get('a') is None
+    assert down.stats()['errors'] == 2
+
+
+def test_json_values():
+    '''
+    Testing the values stored on a cache server: the plain copies of
+    the rows, with their dates, come back equal.
+    '''
+    row = SimpleNamespace(id=1, title='A', price=10.5, owner_id=None,
+                          last_modified_date=date(2022, 1, 1),
+                          created=datetime(2022, 1, 1, 12, 30))
+    value = ([row], {'__date__': 'not a tag', 'n': 2})
+    assert loads(dumps(value)) == [[row], {'__date__': 'not a tag', 'n': 2}]
+    for bad in (object(), {1, 2}):
+        with pytest.raises(CacheError):
+            dumps(bad)
+    with pytest.raises(CacheError):
+        loads(b'\x80\x04K\x01.')
+
+
+def test_cached_decorator():
+    '''
+    Testing the decorator: results are cached by arguments, prepared,
+    and dropped with their tags.
+    '''
+    calls = []
+    local = Cache(LRUBackend())
+
+    @local.cached(tags=lambda n: ['n:%d' % n], prepare=tuple,
+                  cache_if=bool)
+    def numbers(n):
+        calls.append(n)
+        return list(range(n))
+
+    assert numbers(3) == (0, 1, 2)
+    assert numbers(3) == (0, 1, 2)
+    assert numbers(0) == () and numbers(0) == ()
+    assert calls == [3, 0, 0]
+    local.invalidate_tags('n:3')
+    numbers(3)
+    assert calls == [3, 0, 0, 3]
+
+    # Disabled: the function is called directly, without prepare
+    disabled = Cache(NullBackend())
+    assert disabled.cached(prepare=tuple)(numbers.uncached)(2) == [0, 1]
+
+
+def test_models_cached(monkeypatch):
+    '''
+    Testing the model functions opting in: find_listing_by_id is served
+    from the cache until the listing is updated.
+    '''
+    monkeypatch.setattr(cache, 'backend', LRUBackend())
+    register('cachehost', 'cachehost@test.com', 'Cache Host', '12345Aa#')
+    host = User.query.filter_by(email='cachehost@test.com').one().id
+    db.session.add(Listing(title='Cached listing',
+                           description='This is a description.',
+                           price=30, owner_id=host,
+                           last_modified_date=date(2022, 1, 1)))
+    db.session.commit()
+    listing_id = Listing.query.filter_by(title='Cached listing').one().id
+
+    hits = cache.stats()['hits']
+    assert find_listing_by_id(listing_id)[0].price == 30
+    assert find_listing_by_id(listing_id)[0].price == 30
+    assert cache.stats()['hits'] == hits + 1
+    assert find_listing_by_id(-1) == [] and find_listing_by_id(-1) == []
+
+    assert update_listing(listing_id, 'Cached listing',
+                          'This is a description.', 30, 40, host)
+    assert find_listing_by_id(listing_id)[0].price == 40
+
+
+def test_balances_cached_per_user(monkeypatch):
+    '''
+    Testing the cached balances: a booking or a profile update only
+    drops the balance of its user, and a sign-up drops none.
+    '''
+    monkeypatch.setattr(cache, 'backend', LRUBackend())
+    for name in ('balhost', 'balguest', 'balother'):
+        register(name, name + '@test.com', 'Balance User', '12345Aa#')
+    host = User.query.filter_by(email='balhost@test.com').one().id
+    guest = User.query.filter_by(email='balguest@test.com').one().id
+    db.session.add(Listing(title='Balance listing',
+                           description='This is a description.',
+                           price=30, owner_id=host,
+                           last_modified_date=date(2022, 1, 1)))
+    db.session.commit()
+    listing_id = Listing.query.filter_by(title='Balance listing').one().id
+    emails = ['balhost@test.com', 'balguest@test.com', 'balother@test.com']
+
+    def cached():
+        hits = cache.stats()['hits']
+        balances = [get_user_balance(email) for email in emails]
+        return balances, cache.stats()['hits'] - hits
+
+    assert cached() == ([100, 100, 100], 0)
+    register('balnew', 'balnew@test.com', 'Balance User', '12345Aa#')
+    assert cached() == ([100, 100, 100], 3)
+    assert create_booking(listing_id, guest, date(2022, 12, 1),
+                          date(2022, 12, 2))
+    assert cached() == ([100, 70, 100], 2)
+    assert create_bookings_bulk([
+        {'listing_id': listing_id, 'user_id': guest,
+         'start_date': '2022-12-05', 'end_date': '2022-12-06'}]) == [None]
+    assert cached() == ([100, 40, 100], 2)
+    assert update_user('balother', 'balother', 'balother2@test.com', '',
+                       '', '12345Aa#')
+    # The old email is not served from the cache any more
+    with pytest.raises(IndexError):
+        get_user_balance('balother@test.com')
+    emails[2] = 'balother2@test.com'
+    assert cached() == ([100, 40, 100], 2)
@@ -0,0 +1,68 @@
+import csv
+import io
+import json
+from datetime import date
+from app import app
+from app.models import User, Listing, Booking, db
+import app.controllers as controllers
+
+
+def test_export_bookings_and_listings(monkeypatch):
+    '''
+    Testing the exports: the bookings made by the user and on their
+    listings are streamed as CSV, their listings as JSON lines.
+    '''
+    # Several chunks even with a few rows
+    monkeypatch.setattr(controllers, 'EXPORT_CHUNK_ROWS', 2)
+    db.session.add_all([
+        User(username='exporthost', email='exporthost@test.com',
+             balance=100, password='12345Aa#', billing_address='',
+             postal_code=''),
+        User(username='exportbuyer', email='exportbuyer@test.com',
+             balance=100, password='12345Aa#', billing_address='',
+             postal_code='')])
+    db.session.commit()
+    host = User.query.filter_by(email='exporthost@test.com').one().id
+    buyer = User.query.filter_by(email='exportbuyer@test.com').one().id
+    for i in range(5):
+        db.session.add(Listing(title='Export listing %d' % i,
+                               description='This is a description.',
+                               price=20 + i, owner_id=host,
+                               last_modified_date=date(2022, 1, 1)))
+    db.session.commit()
+    listing = Listing.query.filter_by(owner_id=host).first().id
+    for day in (1, 5, 9):
+        db.session.add(Booking(listing_id=listing, user_id=buyer,
+                               owner_id=host, price=20,
+                               date=date(2022, 1, 1),
+                               start_date=date(2022, 12, day),
+                               end_date=date(2022, 12, day + 2)))
+    db.session.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = host
+
+    response = client.get('/export/bookings.csv')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.DictReader(io.StringIO(response.get_data(True))))
+    assert [row['start_date'] for row in rows] == \
+        ['2022-12-01', '2022-12-05', '2022-12-09']
+    assert {row['user_id'] for row in rows} == {str(buyer)}
+
+    response = client.get('/export/listings.jsonl')
+    assert response.status_code == 200
+    lines = [json.loads(line)
+             for line in response.get_data(True).splitlines()]
+    assert [line['title'] for line in lines] == \
+        ['Export listing %d' % i for i in range(5)]
+    assert lines[0]['last_modified_date'] == '2022-01-01'
+
+    # The buyer sees their bookings, and has no listings
+    with client.session_transaction() as session:
+        session['logged_in'] = buyer
+    response = client.get('/export/bookings.csv')
+    assert len(response.get_data(True).splitlines()) == 4
+    assert client.get('/export/listings.jsonl').get_data(True) == ''
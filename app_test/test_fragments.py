@@ -0,0 +1,86 @@
+from datetime import date
+from types import SimpleNamespace
+from app import app
+from app.fragments import FragmentCache, fragment_cache, listing_cells
+from app.models import update_listing, register, User, Listing, db
+
+
+def test_fragment_cache_lru():
+    '''
+    Testing the fragment cache: the least recently used fragments are
+    dropped to stay under the size cap.
+    '''
+    cache = FragmentCache(max_size=30)
+    renders = []
+
+    def render(text):
+        renders.append(text)
+        return text
+
+    assert cache.get((1, 1), lambda: render('a' * 10)) == 'a' * 10
+    cache.get((2, 1), lambda: render('b' * 10))
+    cache.get((1, 1), lambda: render('a' * 10))
+    cache.get((3, 1), lambda: render('c' * 10))
+    # 1 was used after 2, so 2 is dropped
+    cache.get((4, 1), lambda: render('d' * 10))
+    assert renders == ['a' * 10, 'b' * 10, 'c' * 10, 'd' * 10]
+    assert set(cache.entries) == {(1, 1), (3, 1), (4, 1)}
+    assert cache.stats()['size'] == 30
+
+    cache.get((1, 2), lambda: render('e' * 5))
+    assert set(cache.entries) == {(3, 1), (4, 1), (1, 2)}
+    cache.invalidate(1)
+    assert set(cache.entries) == {(3, 1), (4, 1)}
+    assert cache.stats()['size'] == 20
+    # Larger than the cap: rendered, never stored
+    assert cache.get((5, 1), lambda: 'f' * 40) == 'f' * 40
+    assert cache.stats()['entries'] == 2
+
+
+def test_listing_cells_escaped():
+    '''
+    Testing the listing rows: the fields are escaped once, and the
+    cached row is reused while the version is the same.
+    '''
+    listing = SimpleNamespace(id=-1, version=1, title='<b>',
+                              description='A & B', price=10.0)
+    html = listing_cells(listing)
+    assert '&lt;b&gt;' in html and 'A &amp; B' in html and '$10.0' in html
+    listing.title = 'changed'
+    assert listing_cells(listing) == html
+    listing.version = 2
+    assert 'changed' in listing_cells(listing)
+
+
+def test_browse_rows_cached():
+    '''
+    Testing the fragment cache on the browse page: the rows are only
+    rendered again once the listing is updated.
+    '''
+    register('fraghost', 'fraghost@test.com', 'Frag Host', '12345Aa#')
+    register('fragbuyer', 'fragbuyer@test.com', 'Frag Buyer', '12345Aa#')
+    host = User.query.filter_by(email='fraghost@test.com').one().id
+    buyer = User.query.filter_by(email='fragbuyer@test.com').one().id
+    db.session.add(Listing(title='Fragment listing',
+                           description='This is a description.',
+                           price=30, owner_id=host,
+                           last_modified_date=date(2022, 1, 1)))
+    db.session.commit()
+    listing = Listing.query.filter_by(title='Fragment listing').one()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = buyer
+    url = '/browse-listings?q=Fragment'
+    assert b'This is a description.' in client.get(url).data
+    misses = fragment_cache.stats()['misses']
+    assert b'This is a description.' in client.get(url).data
+    assert fragment_cache.stats()['misses'] == misses
+
+    assert update_listing(listing.id, 'Fragment listing',
+                          'This is the new description.', 30, 35, host)
+    assert (listing.id, 1) not in fragment_cache.entries
+    page = client.get(url).data
+    assert b'This is the new description.' in page
+    assert b'$35.0' in page
+    assert b"/book-listing/%d/%d'" % (listing.id, buyer) in page
@@ -0,0 +1,137 @@
+import math
+import random
+from sqlalchemy.dialects import mysql
+from app import app
+from app.geo import encode, covering_cells, KM_PER_DEGREE, MAX_CELLS
+from app.models import create_property, create_listing, register, \
+    browse_listings_page, location_facets, filter_location, prefix_range, \
+    User, Listing, Property, db
+
+
+def test_geohash_cells():
+    '''
+    Testing the grid: known geohashes, and the cells around a point
+    hold every point within the radius.
+    '''
+    assert encode(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+    assert encode(44.2253, -76.4951, 5) == 'drcee'
+    rnd = random.Random(3)
+    for _ in range(200):
+        latitude = rnd.uniform(-60, 60)
+        longitude = rnd.uniform(-179, 179)
+        km = rnd.choice([0.5, 5, 50, 500])
+        cells = covering_cells(latitude, longitude, km)
+        assert 1 <= len(cells) <= MAX_CELLS
+        angle = rnd.uniform(0, 2 * math.pi)
+        distance = km / KM_PER_DEGREE
+        point = encode(latitude + distance * math.sin(angle),
+                       longitude + distance * math.cos(angle) /
+                       math.cos(math.radians(latitude)))
+        assert any(point.startswith(cell) for cell in cells)
+    assert covering_cells(80, 0, 2000) is None
+
+
+def test_prefix_range():
+    '''
+    Testing the prefix conditions: the upper bound is ASCII, so that a
+    latin1 MySQL table stores it as is, and other prefixes use LIKE.
+    '''
+    def compiled(prefix):
+        return str(prefix_range(Property.zip_code, prefix).compile(
+            dialect=mysql.dialect(), compile_kwargs={'literal_binds': True}))
+
+    assert compiled('K1A') == "property.zip_code >= 'K1A' AND " \
+        "property.zip_code < 'K1B'"
+    assert compiled('dpz').endswith("< 'dp{'")
+    assert 'LIKE' in compiled('É') and 'LIKE' in compiled('')
+    assert compiled('K1A').isascii()
+
+
+def test_browse_by_location():
+    '''
+    Testing the location filters of the browse page: facets, zip
+    prefixes and radius, which reads the geohash index.
+    '''
+    register('geohost', 'geohost@test.com', 'Geo Host', '12345Aa#')
+    register('geouser', 'geouser@test.com', 'Geo User', '12345Aa#')
+    host = User.query.filter_by(email='geohost@test.com').one().id
+    user = User.query.filter_by(email='geouser@test.com').one().id
+    # Kingston, 2 km from it, Ottawa (about 150 km away), no coordinates
+    places = [
+        ('Kingston', 'Ontario', 'k7l 3n6', 44.2253, -76.4951),
+        ('Kingston', 'Ontario', 'K7L 4V1', 44.2433, -76.4951),
+        ('Ottawa', 'Ontario', 'K1P 1J1', 45.4215, -75.6972),
+        ('Montreal', 'Quebec', 'H2Y 1C6', None, None)]
+    ids = []
+    for i, (city, state, zip_code, latitude, longitude) in \
+            enumerate(places):
+        prop = create_property('{} Main St'.format(i + 1), 900, 4, city,
+                               state, 'Geoland', zip_code, host, latitude,
+                               longitude)
+        assert prop is not None
+        assert create_listing('Geo listing {}'.format(i),
+                              'A listing to test the locations.', 100,
+                              host, prop.id)
+        ids.append(Listing.query.filter_by(
+            title='Geo listing {}'.format(i)).one().id)
+    assert db.session.get(Property, prop.id).geohash is None
+    assert create_property('1 Main St', 900, 4, 'Kingston', 'Ontario',
+                           'Geoland', 'K7L 3N6', host, 91, 0) is None
+    assert not create_listing('Geo listing x', 'Not the owner of it.', 100,
+                              user, prop.id)
+
+    def browse(**filters):
+        listings, _ = browse_listings_page(user, **filters)
+        return sorted(listing.id for listing in listings)
+
+    assert browse(country='Geoland', state='Ontario') == ids[:3]
+    assert browse(country='Geoland', city='Kingston') == ids[:2]
+    assert browse(zip_prefix='k7l') == ids[:2]
+    assert browse(zip_prefix='K7L 4') == [ids[1]]
+    assert browse(near=(44.2253, -76.4951, 1)) == [ids[0]]
+    assert browse(near=(44.2253, -76.4951, 5)) == ids[:2]
+    assert browse(near=(44.2253, -76.4951, 200)) == ids[:3]
+    assert browse(near=(44.2253, -76.4951, 140)) == ids[:2]
+
+    assert location_facets(user, 'Geoland') == [('Ontario', 3),
+                                                ('Quebec', 1)]
+    assert location_facets(user, 'Geoland', 'Ontario') == \
+        [('Kingston', 2), ('Ottawa', 1)]
+    assert ('Geoland', 4) in location_facets(user)
+    assert location_facets(host, 'Geoland') == []
+
+    # The radius reads the geohash index, not every property
+    query = filter_location(Listing.query, near=(44.2253, -76.4951, 5))
+    plan = db.session.execute(db.text('EXPLAIN QUERY PLAN ' + str(
+        query.statement.compile(db.engine, compile_kwargs={
+            'literal_binds': True})))).all()
+    assert any('ix_property_geohash' in row[-1] for row in plan)
+
+    client = app.test_client()
+    client.post('/api/v1/login', json={'email': 'geouser@test.com',
+                                       'password': '12345Aa#'})
+    response = client.get('/api/v1/listings?fields=id&lat=44.2253'
+                          '&lon=-76.4951&km=5')
+    assert sorted(row['id'] for row in response.json['listings']) == \
+        ids[:2]
+    response = client.get('/api/v1/locations?country=Geoland')
+    assert response.json == {'locations': [
+        {'name': 'Ontario', 'listings': 3}, {'name': 'Quebec', 'listings': 1}]}
+    response = client.get('/browse-listings?city=Ottawa&country=Geoland')
+    assert b'Geo listing 2' in response.data
+    assert b'Geo listing 0' not in response.data
+
+    # Properties created through the API, and listings attached to them
+    response = client.post('/api/v1/properties', json={
+        'address': '9 Main St', 'size': 700, 'guests': 2, 'city': 'Kingston',
+        'state': 'Ontario', 'country': 'Geoland', 'zip_code': 'K7L 1A1',
+        'latitude': 44.23, 'longitude': -76.5})
+    assert response.status_code == 201
+    assert response.json['zip_code'] == 'K7L 1A1'
+    response = client.post('/api/v1/listings', json={
+        'title': 'Geo listing api', 'description': 'A listing of a property.',
+        'price': 80, 'property_id': response.json['id']})
+    assert response.status_code == 201
+    assert response.json['property_id'] is not None
+    assert client.post('/api/v1/properties', json={
+        'address': '9 Main St'}).status_code == 400
@@ -0,0 +1,57 @@
+from datetime import date
+from app import app
+from app.models import register, update_listing, create_booking, User, \
+    Listing, db
+
+
+def test_conditional_get():
+    '''
+    Testing the ETags: an unchanged page is answered with a 304, and
+    updating or booking a listing changes the ETags.
+    '''
+    register('etaghost', 'etaghost@test.com', 'Etag Host', '12345Aa#')
+    register('etagbuyer', 'etagbuyer@test.com', 'Etag Buyer', '12345Aa#')
+    host = User.query.filter_by(email='etaghost@test.com').one().id
+    buyer = User.query.filter_by(email='etagbuyer@test.com').one().id
+    db.session.add(Listing(title='Etag listing',
+                           description='This is a description.',
+                           price=20, owner_id=host,
+                           last_modified_date=date(2022, 1, 1)))
+    db.session.commit()
+    listing = Listing.query.filter_by(title='Etag listing').one()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = buyer
+    urls = ['/browse-listings', '/update-listing/%d' % listing.id,
+            '/book-listing/%d/%d' % (listing.id, buyer)]
+    etags = {}
+    for url in urls:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+        assert response.last_modified is None
+        etag = etags[url] = response.get_etag()[0]
+        response = client.get(url, headers={'If-None-Match': '"%s"' % etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert response.get_etag()[0] == etag
+
+        # Only the ETag is validated
+        response = client.get(url, headers={
+            'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        assert response.status_code == 200
+
+    assert update_listing(listing.id, 'Etag listing', 'This is a new'
+                          ' description.', 20, 25, host)
+    for url in urls:
+        response = client.get(url, headers={
+            'If-None-Match': '"%s"' % etags[url]})
+        assert response.status_code == 200
+        etags[url] = response.get_etag()[0]
+
+    assert create_booking(listing.id, buyer, date(2022, 12, 1),
+                          date(2022, 12, 3))
+    for url in urls:
+        assert client.get(url, headers={
+            'If-None-Match': '"%s"' % etags[url]}).status_code == 200
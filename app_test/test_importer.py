@@ -0,0 +1,119 @@
+import json
+from datetime import date
+from app.importer import main, import_rows, read_rows
+from app.models import create_bookings_bulk, get_user_balance, User, \
+    Listing, Booking, booked_dates, db
+
+
+def clear_tables():
+    User.query.delete()
+    Listing.query.delete()
+    Booking.query.delete()
+    db.session.commit()
+    # The ids of the deleted listings are given again
+    booked_dates.invalidate()
+
+
+def test_import_users_and_listings(tmp_path):
+    '''
+    Testing the importer: CSV and JSON-lines files are imported, and
+    the rejected rows are written to the errors file.
+    '''
+    clear_tables()
+    users = tmp_path / 'users.csv'
+    users.write_text(
+        'name,email,real_name,password\n'
+        'host,host@test.com,Real Name,12345Aa#\n'
+        'buyer,buyer@test.com,,12345Aa#\n'
+        'copy,host@test.com,Real Name,12345Aa#\n'
+        'weak,weak@test.com,Real Name,12345\n')
+    errors = tmp_path / 'errors.txt'
+    assert main(['users', str(users), '--errors', str(errors),
+                 '--chunk-size', '2']) == 0
+    assert errors.read_text() == ('3: Email already used\n'
+                                  '4: Invalid password\n')
+    assert User.query.count() == 2
+    assert get_user_balance('buyer@test.com') == 100
+
+    host = User.query.filter_by(email='host@test.com').one().id
+    listings = tmp_path / 'listings.jsonl'
+    listings.write_text('\n'.join(json.dumps(
+        {'title': 'Listing %d' % i, 'description': 'This is a description.',
+         'price': 10 + i, 'owner_id': host}) for i in range(25))
+        + '\nnot json\n[1, 2]\n"x"\n3\n')
+    assert main(['listings', str(listings), '--chunk-size', '10',
+                 '--errors', str(errors)]) == 0
+    assert Listing.query.count() == 25
+    assert [line.split(':')[0] for line in
+            errors.read_text().splitlines()] == ['26', '27', '28', '29']
+
+
+def test_import_rows_streams_chunks():
+    '''
+    Testing the importer: rows are read lazily, one chunk at a time.
+    '''
+    read = []
+
+    def rows():
+        for i in range(10):
+            read.append(i)
+            yield {'name': 'user%d' % i, 'email': 'bad email',
+                   'password': '12345Aa#'}
+
+    chunks_seen = []
+
+    def progress(total, imported):
+        # Only the rows of the chunks done so far were read
+        chunks_seen.append((total, len(read)))
+
+    rejected = []
+    assert import_rows('users', rows(), chunk_size=4,
+                       on_error=lambda n, e: rejected.append(n),
+                       progress=progress) == (10, 0)
+    assert chunks_seen == [(4, 4), (8, 8), (10, 10)]
+    assert rejected == list(range(1, 11))
+    assert list(read_rows(iter(['{"a": 1}', '', 'x', '[1]', 'null']),
+                          'jsonl')) == [{'a': 1}, {}, {}, {}]
+
+
+def test_create_bookings_bulk():
+    '''
+    Testing bulk bookings: same rules as create_booking, including
+    conflicts and balance within the batch.
+    '''
+    clear_tables()
+    db.session.add_all([
+        User(username='host', email='host@test.com', balance=100,
+             password='12345Aa#', billing_address='', postal_code=''),
+        User(username='buyer', email='buyer@test.com', balance=100,
+             password='12345Aa#', billing_address='', postal_code='')])
+    db.session.commit()
+    host = User.query.filter_by(email='host@test.com').one().id
+    buyer = User.query.filter_by(email='buyer@test.com').one().id
+    for price in (40, 50):
+        db.session.add(Listing(title='Listing %d' % price,
+                               description='This is a description.',
+                               price=price, owner_id=host,
+                               last_modified_date=date(2022, 1, 1)))
+    db.session.commit()
+    first, second = [x.id for x in Listing.query.order_by(Listing.price)]
+
+    def row(listing_id, start, end, uid=buyer):
+        return {'listing_id': listing_id, 'user_id': uid,
+                'start_date': start, 'end_date': end}
+
+    errors = create_bookings_bulk([
+        row(first, '2022-12-01', '2022-12-03'),
+        row(first, '2022-12-03', '2022-12-05'),     # overlaps the first
+        row(first, '2022-12-04', '2022-12-05'),
+        row(second, '2022-12-01', '2022-12-03'),    # 40 + 40 + 50 > 100
+        row(first, '2022-12-10', '2022-12-11', uid=host),
+        row(999, '2022-12-01', '2022-12-03'),
+        row(first, 'tomorrow', '2022-12-03'),
+    ])
+    assert errors == [None, 'Dates already booked', None, 'Balance too low',
+                      'User owns the listing',
+                      'User or listing does not exist',
+                      'Invalid ids or dates']
+    assert Booking.query.count() == 2
+    assert get_user_balance('buyer@test.com') == 20
@@ -0,0 +1,72 @@
+import logging
+from app import app
+from app.metrics import Histogram, Metrics, RequestTiming
+
+
+def test_histogram_lines():
+    '''
+    Testing the Prometheus histograms: cumulative buckets, sum, count.
+    '''
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+    assert histogram.lines('t', 'endpoint="home",method="GET"') == [
+        't_bucket{endpoint="home",method="GET",le="0.1"} 2',
+        't_bucket{endpoint="home",method="GET",le="1.0"} 3',
+        't_bucket{endpoint="home",method="GET",le="+Inf"} 4',
+        't_sum{endpoint="home",method="GET"} 3.65',
+        't_count{endpoint="home",method="GET"} 4']
+
+    metrics = Metrics()
+    timing = RequestTiming()
+    timing.duration, timing.sql_count, timing.sql_time = 0.02, 3, 0.004
+    metrics.observe('home', 'GET', 200, timing)
+    metrics.observe('home', 'GET', 200, timing)
+    text = metrics.render()
+    assert 'qbnb_requests_total{endpoint="home",method="GET",status="200"} 2' \
+        in text
+    assert 'qbnb_request_db_statements_bucket{endpoint="home",method="GET",' \
+        'le="2"} 0' in text
+    assert 'qbnb_request_db_statements_bucket{endpoint="home",method="GET",' \
+        'le="5"} 2' in text
+    assert '# TYPE qbnb_request_duration_seconds histogram' in text
+
+
+def test_request_instrumentation(caplog, monkeypatch):
+    '''
+    Testing the instrumented requests: Server-Timing header, log line
+    and /metrics, only served with the token.
+    '''
+    client = app.test_client()
+    with caplog.at_level(logging.INFO, logger='app.metrics'):
+        response = client.get('/login')
+    timing = response.headers['Server-Timing']
+    assert timing.startswith('app;dur=')
+    assert 'db;dur=' in timing and 'render;dur=' in timing
+    assert any('endpoint=login_get status=200' in record.getMessage()
+               for record in caplog.records)
+
+    assert client.get('/metrics').status_code == 404
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'scraper-token')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={
+        'Authorization': 'Bearer wrong'}).status_code == 401
+
+    # The statements are counted
+    headers = {'Authorization': 'Bearer scraper-token'}
+    client.post('/api/v1/login', json={'email': 'nobody@test.com',
+                                       'password': '12345Aa#'})
+    response = client.get('/metrics', headers=headers)
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert 'qbnb_requests_total{endpoint="login_get",method="GET",' \
+        'status="200"}' in text
+    assert 'qbnb_request_render_seconds_count{endpoint="login_get",' \
+        'method="GET"}' in text
+    lines = [line for line in text.splitlines() if line.startswith(
+        'qbnb_request_db_statements_bucket{endpoint="api.api_login",'
+        'method="POST",le="0"}')]
+    assert lines and lines[0].endswith(' 0')
+    client.get('/no-such-page')
+    assert 'endpoint="unmatched",method="GET",status="404"' in \
+        client.get('/metrics', headers=headers).get_data(as_text=True)
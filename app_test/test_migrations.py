@@ -0,0 +1,92 @@
+import sqlite3
+from sqlalchemy import create_engine, inspect
+from app.migrations import MIGRATIONS, upgrade, current_version
+from app.models import db
+
+
+def test_upgrade_to_latest():
+    '''
+    Testing the migrations: the database is at the latest version
+    and upgrading again is a no-op.
+    '''
+    latest = MIGRATIONS[-1][0]
+    assert upgrade() == latest
+    assert upgrade() == latest
+    with db.engine.connect() as conn:
+        assert current_version(conn) == latest
+
+
+def test_indexes_created():
+    '''
+    Testing migration 2: the filtered columns are indexed.
+    '''
+    inspector = inspect(db.engine)
+    names = {index['name'] for table in ('user', 'listing', 'booking',
+                                         'review', 'property')
+             for index in inspector.get_indexes(table)}
+    assert {'ix_user_username', 'ix_listing_owner_id', 'ix_listing_title',
+            'ix_booking_user_id', 'ix_booking_owner_id',
+            'ix_booking_listing_dates',
+            'ix_review_listing_id', 'ix_listing_property_id',
+            'ix_property_location', 'ix_property_zip_code',
+            'ix_property_geohash'} <= names
+
+
+# Schema of the databases created before the migrations (db.create_all()
+# of the first version of the models)
+BASELINE_SCHEMA = '''
+CREATE TABLE property (id INTEGER NOT NULL, address VARCHAR(120) NOT NULL,
+    size INTEGER NOT NULL, guests INTEGER NOT NULL, city VARCHAR(80) NOT NULL,
+    country VARCHAR(80) NOT NULL, state VARCHAR(80) NOT NULL,
+    zip_code VARCHAR(80) NOT NULL, owner_id INTEGER NOT NULL,
+    PRIMARY KEY (id));
+CREATE TABLE listing (id INTEGER NOT NULL, title VARCHAR(80) NOT NULL,
+    description VARCHAR(200) NOT NULL, owner_id INTEGER NOT NULL,
+    price FLOAT NOT NULL, last_modified_date DATE NOT NULL,
+    property_id INTEGER, PRIMARY KEY (id));
+CREATE TABLE booking (id INTEGER NOT NULL, listing_id INTEGER NOT NULL,
+    price FLOAT NOT NULL, date DATE NOT NULL, user_id INTEGER NOT NULL,
+    owner_id INTEGER, review_id INTEGER, start_date DATE, end_date DATE,
+    PRIMARY KEY (id));
+CREATE TABLE user (id INTEGER NOT NULL, username VARCHAR(80) NOT NULL,
+    email VARCHAR(120) NOT NULL, balance INTEGER NOT NULL,
+    password VARCHAR(80) NOT NULL, billing_address VARCHAR(200) NOT NULL,
+    postal_code VARCHAR(100) NOT NULL, real_name VARCHAR(80),
+    PRIMARY KEY (id), UNIQUE (email));
+CREATE TABLE review (id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+    listing_id INTEGER NOT NULL, review_text VARCHAR(200) NOT NULL,
+    date DATE NOT NULL, review_score INTEGER, PRIMARY KEY (id));
+INSERT INTO user VALUES (1, 'olduser', 'old@test.com', 100, '12345Aa#',
+    '', '', 'Old User');
+INSERT INTO listing VALUES (1, 'Old listing', 'A listing from before.', 1,
+    100, '2022-01-01', NULL);
+'''
+
+
+def test_upgrade_baseline(tmp_path):
+    '''
+    Testing the migrations on a database created before them: every
+    migration applies in turn, one version at a time, and the result
+    has the columns and indexes of the models.
+    '''
+    path = str(tmp_path / 'baseline.sqlite')
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+    engine = create_engine('sqlite:///' + path)
+    try:
+        for number, _, _ in MIGRATIONS:
+            assert upgrade(number, engine) == number
+        inspector = inspect(engine)
+        for table in db.metadata.sorted_tables:
+            columns = {column['name']
+                       for column in inspector.get_columns(table.name)}
+            assert set(table.c.keys()) <= columns
+            names = {index['name']
+                     for index in inspector.get_indexes(table.name)}
+            assert {index.name for index in table.indexes} <= names
+        with engine.connect() as conn:
+            assert conn.exec_driver_sql(
+                'SELECT version FROM listing WHERE id = 1').scalar() == 1
+    finally:
+        engine.dispose()
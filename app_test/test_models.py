@@ -3,8 +3,11 @@ from app.models import alphanumeric_check, email_check, \
     postal_code_check, unique_title_check, owner_check, length_check, \
     pw_check, range_check, register, login, description_length_check, \
     date_check, update_user, update_listing, find_listing, get_user_balance, \
-    desc_character_check, create_booking, User, Listing, db, Booking
+    desc_character_check, create_booking, User, Listing, db, Booking, \
+    find_booked_listing, load_dashboard, browse_listings_page, \
+    create_listings_bulk
 from datetime import date
+from sqlalchemy import event
 from app_test.injection_tests import test_sqli_create_listing, \
     test_sqli_register, test_sqli_booking
 
@@ -543,3 +546,170 @@ def test_sqli_listing():
     test_sqli_create_listing()
     test_sqli_register()
     test_sqli_booking()
+
+
+def count_queries(func, *args):
+    '''
+    Call func and return the number of SQL statements it issued
+    '''
+    statements = []
+
+    def before_execute(conn, cursor, statement, *_):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_execute)
+    try:
+        func(*args)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_execute)
+    return len(statements)
+
+
+def test_dashboard_query_count():
+    '''
+    Testing the profile page queries: the number of queries
+    does not grow with the number of bookings.
+    '''
+    User.query.delete()
+    Listing.query.delete()
+    Booking.query.delete()
+    db.session.commit()
+
+    assert register('u999', 'host@test.com',
+                    'real username', '12345Aa#') is True
+    assert register('u9999', 'buyer@test.com',
+                    'real username', '12345Aa#') is True
+    host = User.query.filter_by(email='host@test.com').one()
+    buyer = User.query.filter_by(email='buyer@test.com').one()
+
+    counts = []
+    for n in (1, 10, 50):
+        for i in range(n):
+            listing = Listing(title='Listing %d %d' % (n, i),
+                              description='This is a description.',
+                              price=10, owner_id=host.id,
+                              last_modified_date=date(2022, 1, 1))
+            db.session.add(listing)
+            db.session.flush()
+            db.session.add(Booking(listing_id=listing.id, price=10,
+                                   date=date(2022, 1, 1), user_id=buyer.id,
+                                   start_date=date(2022, 12, 1),
+                                   end_date=date(2022, 12, 3)))
+        db.session.commit()
+        counts.append((count_queries(load_dashboard, buyer.id),
+                       count_queries(find_booked_listing, buyer.id)))
+
+    # At most two round-trips, whatever the number of bookings
+    assert counts[0] == counts[1] == counts[2]
+    assert counts[0][0] <= 2
+    assert counts[0][1] == 1
+
+    listings, bookings, booked = load_dashboard(buyer.id)
+    assert listings == []
+    assert len(bookings) == len(booked) == 61
+    assert [b.listing_id for b in bookings] == [x.id for x in booked]
+    assert find_booked_listing(buyer.id) == booked
+
+
+def test_browse_listings_page():
+    '''
+    Testing browse pagination: walking the pages returns every listing
+    not owned by the user once, in order, and applies the filters.
+    '''
+    User.query.delete()
+    Listing.query.delete()
+    Booking.query.delete()
+    db.session.commit()
+
+    for i in range(45):
+        db.session.add(Listing(title='Listing %d' % i,
+                               description='This is a description.',
+                               price=10 + i % 7, owner_id=1 + i % 3,
+                               last_modified_date=date(2022, 1, 1 + i % 9)))
+    db.session.commit()
+    expected = Listing.query.filter(Listing.owner_id != 1).all()
+
+    for sort, key in (('price', lambda x: (x.price, x.id)),
+                      ('newest', lambda x: (x.last_modified_date, x.id))):
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = browse_listings_page(1, sort=sort, after=cursor,
+                                                limit=7)
+            assert len(page) <= 7
+            seen.extend(page)
+            if cursor is None:
+                break
+        assert len(seen) == len(expected)
+        assert seen == sorted(expected, key=key, reverse=sort == 'newest')
+
+    # Filters
+    page, _ = browse_listings_page(1, min_price=12, max_price=13,
+                                   limit=100)
+    assert page and all(12 <= x.price <= 13 for x in page)
+    page, cursor = browse_listings_page(1, title_prefix='Listing 1',
+                                        limit=100)
+    assert cursor is None
+    assert {x.title for x in page} == {
+        x.title for x in expected if x.title.startswith('Listing 1')}
+    assert browse_listings_page(1, title_prefix='Listing%')[0] == []
+
+    # The page size is capped, and a bad cursor restarts from the start
+    assert len(browse_listings_page(1, limit=10 ** 6)[0]) == len(expected)
+    assert browse_listings_page(1, after='garbage')[0] == \
+        browse_listings_page(1)[0]
+
+
+def test_create_listings_bulk():
+    '''
+    Testing bulk listing creation: the batch is checked with the same
+    rules as create_listing, with a fixed number of queries, and the
+    rejected rows come back with their reason.
+    '''
+    User.query.delete()
+    Listing.query.delete()
+    Booking.query.delete()
+    db.session.commit()
+    assert register('u999', 'host@test.com',
+                    'real username', '12345Aa#') is True
+    owner = User.query.filter_by(email='host@test.com').one().id
+    assert create_listing("Taken Title", "This is a description.",
+                          10, owner) is True
+
+    def row(title, description='This is a description.', price=100,
+            owner_id=owner):
+        return {'title': title, 'description': description,
+                'price': price, 'owner_id': owner_id}
+
+    rows = [row('Listing %d' % i) for i in range(2000)] + [
+        row('Taken Title'),                 # already in the database
+        row('Listing 5'),                   # used earlier in the batch
+        row('Bad Owner', owner_id=owner + 1),
+        row('Cheap', price=5),
+        row(' Title'),
+        row(''),
+        row('Bad Description', description='No <tags> allowed here'),
+        row('Short', description='Too short'),
+        row('Bad Price', price='abc'),
+        {'title': 'Missing description', 'price': 100, 'owner_id': owner},
+    ]
+    statements = count_queries(create_listings_bulk, rows)
+    errors = create_listings_bulk([])
+    assert errors == []
+
+    errors = create_listings_bulk([row('Another Listing')])
+    assert errors == [None]
+
+    # Owners and titles are checked with one query per 900 rows,
+    # all the listings are inserted together, and logged in
+    # listing_change with two statements per 900 rows
+    assert statements <= 2 * 3 + 2 + 2 * 3
+    assert Listing.query.count() == 2002
+    assert find_listing_by_title('Listing 1999')[0].owner_id == owner
+
+    errors = create_listings_bulk(rows[-10:])
+    assert errors == ['Title already used', 'Title already used',
+                      'Owner does not exist', 'Invalid price',
+                      'Invalid title', 'Invalid title',
+                      'Invalid description', 'Invalid description',
+                      'Invalid price', 'Missing title or description']
@@ -0,0 +1,82 @@
+import os
+import pstats
+import sys
+import threading
+from app import app
+from app.models import register, find_listing_by_title
+from app.profiler import collapse, sample_stacks, start_request_profile, \
+    finish_request_profile
+
+
+def test_sample_stacks():
+    '''
+    Testing the sampling profiler: the stacks of the other threads,
+    collapsed from the first frame of the app.
+    '''
+    stop = threading.Event()
+
+    def work():
+        with app.app_context():
+            while not stop.is_set():
+                find_listing_by_title('A sampled title')
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    try:
+        stacks, samples = sample_stacks(0.3, interval=0.001)
+    finally:
+        stop.set()
+        thread.join()
+    assert samples > 10
+    assert stacks
+    assert all(stack.startswith('app.') for stack in stacks)
+    assert any(stack.startswith('app.models:find_listing_by_title')
+               for stack in stacks)
+    # No frame of the app: left out
+    assert collapse(sys._getframe(), root='nowhere.') is None
+
+
+def test_debug_profile(tmp_path):
+    '''
+    Testing /debug/profile (admins only) and the per-request profiles.
+    '''
+    register('profadmin', 'profadmin@test.com', 'Prof Admin', '12345Aa#')
+    register('profuser', 'profuser@test.com', 'Prof User', '12345Aa#')
+    admins = app.config['ADMIN_EMAILS']
+    app.config['ADMIN_EMAILS'] = frozenset(['profadmin@test.com'])
+    try:
+        client = app.test_client()
+        assert client.get('/debug/profile').status_code == 302
+        client.post('/login', data={'email': 'profuser@test.com',
+                                    'password': '12345Aa#'})
+        assert client.get('/debug/profile?seconds=1').status_code == 403
+
+        client = app.test_client()
+        client.post('/login', data={'email': 'profadmin@test.com',
+                                    'password': '12345Aa#'})
+        assert client.get('/debug/profile?seconds=x').status_code == 400
+        assert client.get('/debug/profile?seconds=61').status_code == 400
+        response = client.get('/debug/profile?seconds=0.1')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        assert int(response.headers['X-Profile-Samples']) > 0
+    finally:
+        app.config['ADMIN_EMAILS'] = admins
+
+    directory = app.config['PROFILE_DIR']
+    app.config['PROFILE_DIR'] = str(tmp_path)
+    try:
+        # Within the same second, each profile gets its own file
+        for _ in range(2):
+            with app.test_request_context('/login'):
+                start_request_profile()
+                find_listing_by_title('A profiled title')
+                finish_request_profile(app.response_class())
+    finally:
+        app.config['PROFILE_DIR'] = directory
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == 2 and all(name.endswith('.prof') for name in files)
+    assert '-{}-'.format(os.getpid()) in files[0]
+    stats = pstats.Stats(str(tmp_path / files[0]))
+    assert any(name == 'find_listing_by_title'
+               for _, _, name in stats.stats)
@@ -0,0 +1,108 @@
+from datetime import date
+from app.search import InvertedIndex, ListingSearch, tokenize
+from app.models import create_listing, create_listings_bulk, update_listing, \
+    search_listings, listing_search, register, User, Listing, \
+    ListingChange, db
+
+
+def test_tokenize():
+    '''
+    Testing the words: split on the spaces and punctuation allowed in
+    the descriptions, lowercase.
+    '''
+    assert tokenize('Lake view, 2 rooms! Quiet.') == \
+        ['lake', 'view', '2', 'rooms', 'quiet']
+    assert tokenize('Café Zürich') == ['café', 'zürich']
+    assert tokenize('  ,.! ') == []
+
+
+def test_inverted_index_bm25():
+    '''
+    Testing the in-process index: every word must match, rarer words
+    and title matches rank higher, the words of half the listings are
+    stop words, updates replace the old words.
+    '''
+    index = InvertedIndex()
+    index.add(1, 'Lake house', 'A house by the lake.')
+    index.add(2, 'City flat', 'A flat with a view of the lake.')
+    index.add(3, 'Lake cabin', 'A cabin, not a house.', owner_id=7)
+    index.add(4, 'Big house', 'A house, a house, and a house.')
+    for listing_id in range(5, 11):
+        index.add(listing_id, 'Studio', 'A quiet studio.')
+    assert index.search(['lake']) == [1, 3, 2]
+    assert index.search(['house', 'lake']) == [1, 3]
+    assert index.search(['lake'], exclude_owner=7) == [1, 2]
+    assert index.search(['lake', 'castle']) == []
+    assert index.search(['lake'], limit=1) == [1]
+    # Only the newest matches are ranked
+    assert index.search(['house'], rank_limit=2) == [4, 3]
+    # Stop words are left out, or only filter the newest listings
+    assert index.search(['a', 'lake']) == index.search(['lake'])
+    assert index.search(['a'], limit=3) == [10, 9, 8]
+    assert index.search(['a', 'studio'], limit=3) == [10, 9, 8]
+    # ... so a listing without them matches a query having rarer words
+    index.add(11, 'Lakeside', 'Lake room.')
+    assert 'a' not in index.documents[11][2]
+    assert 11 in index.search(['a', 'lake'])
+    assert 11 not in index.search(['a'])
+    index.remove(11)
+
+    index.add(2, 'City flat', 'A flat with a view of the park.')
+    assert index.search(['lake']) == [1, 3]
+    index.remove(1)
+    assert index.search(['house']) == [4, 3]
+    assert 'lake' in index.postings and 'by' not in index.postings
+
+
+def test_search_listings():
+    '''
+    Testing the search: new, bulk and updated listings are found, with
+    FTS5 and with the in-process index.
+    '''
+    register('searchhost', 'searchhost@test.com', 'Search Host', '12345Aa#')
+    host = User.query.filter_by(email='searchhost@test.com').one().id
+    assert create_listing('Seaside loft', 'Bright loft facing the harbour.',
+                          100, host)
+    assert create_listings_bulk([
+        {'title': 'Harbour room', 'description': 'Small room, harbour view.',
+         'price': 50, 'owner_id': host},
+        {'title': 'Mountain hut', 'description': 'Far away from any sea.',
+         'price': 40, 'owner_id': host}]) == [None, None]
+    assert listing_search.use_fts()
+    titles = [listing.title for listing in search_listings('HARBOUR')]
+    assert titles == ['Harbour room', 'Seaside loft']
+    assert search_listings('harbour', user_id=host) == []
+
+    loft = Listing.query.filter_by(title='Seaside loft').one()
+    assert update_listing(loft.id, 'Seaside loft',
+                          'Bright loft facing the mountains.', 100, 100,
+                          host)
+    rows = search_listings('harbour', fields=['title'])
+    assert [row.title for row in rows] == ['Harbour room']
+
+    # Same results from the in-process index
+    fallback = ListingSearch(lambda: db.session)
+    fallback.fts = False
+    for words in ('harbour', 'mountain', 'loft mountains', 'sea'):
+        assert fallback.search(words) == listing_search.search(words)
+    # It is kept up to date once built
+    listing = Listing(title='Harbour cabin',
+                      description='A cabin on the harbour.', price=10,
+                      owner_id=host, last_modified_date=date(2022, 1, 1))
+    db.session.add(listing)
+    db.session.flush()
+    fallback.indexed([listing])
+    db.session.commit()
+    assert listing.id in fallback.search('harbour')
+
+    # The changes made by another process are read from the change log,
+    # not by reading again every listing modified today
+    other = ListingSearch(lambda: db.session, refresh=0)
+    other.fts = False
+    assert loft.id in other.search('mountains')
+    assert update_listing(loft.id, 'Seaside loft',
+                          'Bright loft facing the harbour.', 100, 100,
+                          host)
+    assert loft.id not in other.search('mountains')
+    assert loft.id in other.search('harbour')
+    assert ListingChange.query.filter_by(listing_id=loft.id).count() == 1
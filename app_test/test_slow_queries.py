@@ -0,0 +1,61 @@
+import logging
+from app.models import find_listing_by_title
+from app.slow_queries import SlowQueryLog, describe, slow_query_log
+
+
+def test_slow_query_rate():
+    '''
+    Testing the rate limit of the slow query log: the statements over
+    the rate are counted, and reported with the next one logged.
+    '''
+    now = [0.0]
+    log = SlowQueryLog(0.1, per_minute=2, clock=lambda: now[0])
+    assert log.allow() == 0
+    assert log.allow() == 0
+    assert log.allow() is None
+    assert log.allow() is None
+    # One token back after 30 seconds
+    now[0] = 30
+    assert log.allow() == 2
+    assert log.allow() is None
+    assert not SlowQueryLog(0).enabled()
+
+
+def test_slow_query_logged(caplog):
+    '''
+    Testing a slow statement: logged with the types of its parameters,
+    the model function that ran it and its plan.
+    '''
+    threshold = slow_query_log.threshold
+    # Every statement is slow, and the bucket is full
+    slow_query_log.threshold = 1e-9
+    slow_query_log.tokens = float(slow_query_log.per_minute)
+    try:
+        with caplog.at_level(logging.WARNING, logger='app.slow_queries'):
+            find_listing_by_title('A slow title')
+    finally:
+        slow_query_log.threshold = threshold
+    messages = [record.getMessage() for record in caplog.records
+                if record.name == 'app.slow_queries']
+    assert messages
+    message = messages[0]
+    assert 'in app.models.find_listing_by_title:' in message
+    assert 'A slow title' not in message
+    assert 'str[12]' in message
+    assert 'FROM listing' in message
+    assert 'SEARCH listing USING INDEX' in message
+
+
+def test_slow_query_parameters(caplog):
+    '''
+    Testing the parameters logged: only their types and lengths, unless
+    the values are asked for.
+    '''
+    assert describe(('secret@test.com', 3, None)) == \
+        '(str[15], int, NoneType)'
+    assert describe({'password': b'12345Aa#'}) == "{'password': bytes[8]}"
+    log = SlowQueryLog(1e-9, values=True)
+    log.plan = lambda conn, statement, parameters: '  (plan)'
+    with caplog.at_level(logging.WARNING, logger='app.slow_queries'):
+        log.record(None, 'SELECT ?', ('secret@test.com',), 1, False)
+    assert "('secret@test.com',)" in caplog.records[-1].getMessage()
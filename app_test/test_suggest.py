@@ -0,0 +1,79 @@
+from app import app
+from app.suggest import TitleIndex, TitleSuggest
+from app.models import create_listing, create_listings_bulk, update_listing, \
+    register, title_suggest, db, User, Listing
+
+
+def test_title_index():
+    '''
+    Testing the prefix index: any case, alphabetical order, limit,
+    owner filter, updates and removals.
+    '''
+    index = TitleIndex()
+    index.load([(1, 'Lake house', 1), (2, 'lake cabin', 2),
+                (3, 'City flat', 1)])
+    index.add(4, 'Lakeside loft', 2)
+    assert index.lookup('LAKE') == \
+        [(2, 'lake cabin'), (1, 'Lake house'), (4, 'Lakeside loft')]
+    assert index.lookup('lake ', limit=1) == [(2, 'lake cabin')]
+    assert index.lookup('lake', exclude_owner=2) == [(1, 'Lake house')]
+    assert index.lookup('castle') == []
+
+    index.add(2, 'Mountain cabin', 2)
+    assert [title for _, title in index.lookup('l')] == \
+        ['Lake house', 'Lakeside loft']
+    index.add(5, 'LAKE HOUSE', 1)
+    index.remove(1)
+    assert index.lookup('lake h') == [(5, 'LAKE HOUSE')]
+    assert len(index) == 4 and list(index.ids) == [3, 5, 4, 2]
+
+
+def test_suggest_titles():
+    '''
+    Testing /api/v1/listings/suggest: new, bulk and updated listings are
+    suggested, but not those of the user.
+    '''
+    register('suggesthost', 'suggesthost@test.com', 'Suggest Host',
+             '12345Aa#')
+    register('suggestuser', 'suggestuser@test.com', 'Suggest User',
+             '12345Aa#')
+    host = User.query.filter_by(email='suggesthost@test.com').one().id
+    assert create_listing('Quayside flat', 'A flat facing the quay.', 100,
+                          host)
+    client = app.test_client()
+    assert client.post('/api/v1/login', json={
+        'email': 'suggestuser@test.com',
+        'password': '12345Aa#'}).status_code == 200
+    assert client.get('/api/v1/listings/suggest?q=quays').json == \
+        {'suggestions': [{'id': Listing.query.filter_by(
+            title='Quayside flat').one().id, 'title': 'Quayside flat'}]}
+
+    # Kept up to date once built
+    assert title_suggest.active()
+    assert create_listings_bulk([
+        {'title': 'Quayside room', 'description': 'A small room by the quay.',
+         'price': 50, 'owner_id': host}]) == [None]
+    assert create_listing('Quay studio', 'A studio on the quay.', 80, host)
+    flat = Listing.query.filter_by(title='Quayside flat').one()
+    assert update_listing(flat.id, 'Harbourside flat',
+                          'A flat facing the quay.', 100, 100, host)
+    response = client.get('/api/v1/listings/suggest?q=QUAY&limit=5')
+    assert [row['title'] for row in response.json['suggestions']] == \
+        ['Quay studio', 'Quayside room']
+    assert client.get('/api/v1/listings/suggest?q=').json == \
+        {'suggestions': []}
+
+    # The changes made by another process are read from the change log
+    other = TitleSuggest(lambda: db.session, refresh=0)
+    assert other.lookup('harbourside') == [(flat.id, 'Harbourside flat')]
+    assert update_listing(flat.id, 'Quayside flat',
+                          'A flat facing the quay.', 100, 100, host)
+    assert other.lookup('harbourside') == []
+    assert (flat.id, 'Quayside flat') in other.lookup('quayside')
+
+    # Not the listings of the user
+    client = app.test_client()
+    client.post('/api/v1/login', json={'email': 'suggesthost@test.com',
+                                       'password': '12345Aa#'})
+    assert client.get('/api/v1/listings/suggest?q=quay').json == \
+        {'suggestions': []}
@@ -0,0 +1,69 @@
+from app.models import register, update_user, User, db
+from app.user_cache import UserCache, user_cache, snapshot
+
+
+def test_user_cache_hits():
+    '''
+    Testing the user cache: a user is loaded once, then served
+    from the cache until invalidated or expired.
+    '''
+    loads = []
+
+    def load(user_id):
+        loads.append(user_id)
+        return {'id': user_id}
+
+    cache = UserCache(ttl=60)
+    assert cache.get(1, load) == {'id': 1}
+    assert cache.get(1, load) == {'id': 1}
+    assert cache.get(2, load) == {'id': 2}
+    assert loads == [1, 2]
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+    cache.invalidate(1)
+    cache.get(1, load)
+    assert loads == [1, 2, 1]
+
+    # Missing users are not cached
+    assert cache.get(3, lambda _: None) is None
+    assert cache.stats()['size'] == 2
+
+    # The least recently used users are dropped first
+    cache = UserCache(ttl=60, max_entries=2)
+    cache.get(1, load)
+    cache.get(2, load)
+    cache.get(1, load)
+    cache.get(3, load)
+    assert list(cache.entries) == [1, 3]
+    assert cache.stats()['evictions'] == 1
+    del loads[:]
+    cache.get(1, load)
+    cache.get(2, load)
+    assert loads == [2]
+
+    # Expired entries are loaded again
+    cache = UserCache(ttl=0)
+    cache.get(1, load)
+    cache.get(1, load)
+    assert loads == [2, 1, 1]
+
+
+def test_user_cache_invalidated_by_update_user():
+    '''
+    Testing the user cache: update_user drops the cached copy.
+    '''
+    User.query.filter_by(email='cache@test.com').delete()
+    User.query.filter_by(email='cache2@test.com').delete()
+    db.session.commit()
+    assert register('cacheuser', 'cache@test.com',
+                    'real username', '12345Aa#') is True
+    user = User.query.filter_by(email='cache@test.com').one()
+
+    def load(user_id):
+        return snapshot(User.query.filter_by(id=user_id).one())
+
+    assert user_cache.get(user.id, load).username == 'cacheuser'
+    assert update_user('cacheuser', 'cacheuser2', 'cache2@test.com',
+                       'address', 'K7L 3N6', '12345Aa#') is True
+    assert user_cache.get(user.id, load).username == 'cacheuser2'
@@ -0,0 +1,89 @@
+from hypothesis import given, settings, strategies as st
+from app.validation import desc_character_check, alphanumeric_check, \
+    real_name_check, postal_code_check
+
+'''
+Equivalence of the validators with their former character loops
+'''
+
+
+def original_desc_character_check(description):
+    for element in range(0, len(description)):
+        if not (description[element].isalnum() or description[element] == " "
+                or description[element] == "." or description[element] == ","
+                or description[element] == "!"):
+            return False
+    return True
+
+
+def original_alphanumeric_check(title):
+    if title[0] == " " or title[-1] == " ":
+        return False
+    for element in range(0, len(title)):
+        if not (title[element].isalnum() or title[element] == " "):
+            return False
+    return True
+
+
+def original_real_name_check(name):
+    if name is None:
+        return True
+
+    if len(name) > 80 or "\n" in name:
+        return False
+    return all(c.isalpha() or c.isspace() for c in name)
+
+
+def original_postal_code_check(postal_code):
+    if len(postal_code) != 7:
+        return False
+
+    if (
+        (not postal_code[0].isalpha()) or
+        (not postal_code[1].isnumeric()) or
+        (not postal_code[2].isalpha()) or
+        (not postal_code[3] == " ") or
+        (not postal_code[4].isnumeric()) or
+        (not postal_code[5].isalpha()) or
+        (not postal_code[6].isnumeric())
+    ):
+        return False
+    else:
+        return True
+
+
+# Mostly the characters the checks care about, plus any character
+interesting = st.sampled_from(
+    list('aZ09 .,!_\n\té²٣　 #')) | st.characters()
+texts = st.text(interesting, max_size=100)
+
+
+@settings(max_examples=1000)
+@given(texts)
+def test_desc_character_check_equivalent(text):
+    assert desc_character_check(text) is \
+        original_desc_character_check(text)
+
+
+@settings(max_examples=1000)
+@given(texts.filter(len))
+def test_alphanumeric_check_equivalent(text):
+    assert alphanumeric_check(text) is original_alphanumeric_check(text)
+
+
+@settings(max_examples=1000)
+@given(st.none() | texts)
+def test_real_name_check_equivalent(text):
+    assert real_name_check(text) is original_real_name_check(text)
+
+
+@settings(max_examples=1000)
+@given(texts | st.text(interesting, min_size=7, max_size=7))
+def test_postal_code_check_equivalent(text):
+    assert postal_code_check(text) is original_postal_code_check(text)
+
+
+def test_postal_code_examples():
+    assert postal_code_check("k1k 5m5") is True
+    assert postal_code_check("K7L 3N6") is True
+    assert postal_code_check("K7L3N6 ") is False
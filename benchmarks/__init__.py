@@ -0,0 +1,3 @@
+'''
+an init file is required for this folder to be considered as a module
+'''
@@ -0,0 +1,133 @@
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import date
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from app.geo import encode
+from app.models import db, filter_location, Listing
+
+'''
+Time the location filters of the browse page (filter_location, on the
+first page sorted by price) on a seeded SQLite database, one listing
+per property.
+
+    python -m benchmarks.geo --rows 1000000
+
+The properties are spread uniformly over a box around Ontario and
+Quebec (about 1500 x 1000 km), so a 10 km radius holds about 0.02% of
+them.
+'''
+
+# South-west and north-east corners of the box
+BOX = ((42.0, -83.0), (51.0, -64.0))
+
+
+def seed(path, rows):
+    engine = create_engine('sqlite:///' + path)
+    # With their indexes
+    for name in ('property', 'listing'):
+        db.metadata.tables[name].create(bind=engine)
+    engine.dispose()
+    rnd = random.Random(11)
+    conn = sqlite3.connect(path)
+    points = [(rnd.uniform(BOX[0][0], BOX[1][0]),
+               rnd.uniform(BOX[0][1], BOX[1][1])) for _ in range(rows)]
+    conn.executemany(
+        'INSERT INTO property (id, address, size, guests, city, state, '
+        'country, zip_code, owner_id, latitude, longitude, geohash) '
+        'VALUES (?, ?, 900, 4, ?, ?, ?, ?, 1, ?, ?, ?)',
+        ((i, '{} Main St'.format(i), 'City {}'.format(i % 500),
+          'State {}'.format(i % 10), 'Canada',
+          'K{}L {}N{}'.format(i % 10, i % 7, i % 9),
+          latitude, longitude, encode(latitude, longitude))
+         for i, (latitude, longitude) in enumerate(points, 1)))
+    conn.executemany(
+        'INSERT INTO listing (id, title, description, owner_id, price, '
+        'last_modified_date, property_id) VALUES (?, ?, ?, 1, ?, ?, ?)',
+        ((i, 'Listing {}'.format(i), 'A listing of the benchmark.',
+          rnd.randint(10, 1000), date(2022, 1, 1).isoformat(), i)
+         for i in range(1, rows + 1)))
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def measure(calls):
+    '''
+    Returns:
+        The p50, p95 and maximum time of a call, in ms
+    '''
+    times = []
+    for call in calls:
+        begin = time.perf_counter()
+        call()
+        times.append((time.perf_counter() - begin) * 1000)
+    times.sort()
+    return (statistics.median(times), times[int(len(times) * 0.95)],
+            times[-1])
+
+
+def run(rows, count):
+    path = os.path.join(tempfile.mkdtemp(), 'geo.sqlite')
+    print('{} properties and listings'.format(rows))
+    seed(path, rows)
+    engine = create_engine('sqlite:///' + path)
+    session = Session(engine)
+    rnd = random.Random(7)
+    centers = [(rnd.uniform(BOX[0][0] + 1, BOX[1][0] - 1),
+                rnd.uniform(BOX[0][1] + 1, BOX[1][1] - 1))
+               for _ in range(count)]
+
+    def browse(**filters):
+        # Same query as the first page of browse_listings_page
+        query = filter_location(session.query(Listing.id, Listing.price),
+                                **filters)
+        return query.order_by(Listing.price, Listing.id).limit(21).all()
+
+    for km in (1, 10, 50):
+        found = []
+        times = measure(
+            (lambda center=center: found.append(len(browse(
+                near=(center[0], center[1], km)))))
+            for center in centers)
+        print('  within {:2} km:  p50 {:.2f} ms, p95 {:.2f} ms, max {:.2f} '
+              'ms, {:.1f} listings per page'.format(
+                  km, *times, statistics.mean(found)))
+    print('  zip prefix:     p50 {:.2f} ms, p95 {:.2f} ms, '
+          'max {:.2f} ms'.format(*measure(
+              (lambda i=i: browse(zip_prefix='K{}L {}'.format(i % 10, i % 7)))
+              for i in range(count))))
+    print('  city:           p50 {:.2f} ms, p95 {:.2f} ms, '
+          'max {:.2f} ms'.format(*measure(
+              (lambda i=i: browse(country='Canada',
+                                  state='State {}'.format(i % 10),
+                                  city='City {}'.format(i % 500)))
+              for i in range(count))))
+    query = filter_location(session.query(Listing.id),
+                            near=(centers[0][0], centers[0][1], 10))
+    plan = session.execute(text('EXPLAIN QUERY PLAN ' + str(
+        query.statement.compile(engine, compile_kwargs={
+            'literal_binds': True}))))
+    print('  radius plan: ' + '; '.join(dict.fromkeys(
+        row[-1] for row in plan if not row[-1].startswith('INDEX '))))
+    session.close()
+    engine.dispose()
+    os.remove(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.geo')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args(argv)
+    run(args.rows, args.queries)
+
+
+if __name__ == '__main__':
+    main()
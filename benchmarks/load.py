@@ -0,0 +1,311 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, \
+    build_opener
+
+from benchmarks.models import DAY, DESCRIPTION, PASSWORD, percentile
+
+'''
+Load test of the HTML routes: virtual users, each with its own session
+cookie, log in and then browse, create listings and book them, for a
+given time. Each virtual user repeats a session:
+
+    POST /login, then ACTIONS weighted actions, then GET /logout
+
+where an action is GET /, GET /browse-listings, GET then POST
+/create-listing, or GET then POST /book-listing. The number of requests,
+the requests per second and the p50, p95, p99 and maximum latency are
+reported per route, with the status codes.
+
+    python -m benchmarks.load --users 32 --duration 30
+    python -m benchmarks.load --url http://127.0.0.1:8000 --users 16
+
+Without --url, the app is served in this process by the threaded
+werkzeug server on a free port of localhost, with a seeded temporary
+SQLite database (--listings listings of the virtual users). The load
+generator then shares the process, and the GIL, with the server: use
+--url for a server started on its own (gunicorn), whose database must
+already hold listings of other users. The virtual users are registered
+by the harness there, so their balance is the $100 of a new user and
+most of their bookings fail once it is spent.
+'''
+
+# Relative weights of the actions of a session
+ACTIONS = (('home', 30), ('browse', 40), ('create', 10), ('book', 20))
+
+# Actions of a session between login and logout
+SESSION_ACTIONS = 10
+
+# Distinct booking dates for every booking of the run
+booking_days = itertools.count()
+
+
+class NoRedirect(HTTPRedirectHandler):
+    # The redirects are timed as requests of their own route
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Results:
+    """
+    Latencies and status codes of the requests, per route
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # route -> list of ms
+        self.times = {}
+        # route -> {status: count}
+        self.statuses = {}
+
+    def add(self, route, ms, status):
+        with self.lock:
+            self.times.setdefault(route, []).append(ms)
+            counts = self.statuses.setdefault(route, {})
+            counts[status] = counts.get(status, 0) + 1
+
+    def summary(self, seconds):
+        '''
+        Returns:
+            For each route, the number of requests, the requests per
+            second, the latency percentiles in ms and the status codes
+        '''
+        summary = {}
+        for route in sorted(self.times):
+            times = sorted(self.times[route])
+            summary[route] = {
+                'requests': len(times),
+                'per_sec': round(len(times) / seconds, 1),
+                'p50_ms': round(statistics.median(times), 2),
+                'p95_ms': round(percentile(times, 0.95), 2),
+                'p99_ms': round(percentile(times, 0.99), 2),
+                'max_ms': round(times[-1], 2),
+                'statuses': {str(status): count for status, count in
+                             sorted(self.statuses[route].items())}}
+        return summary
+
+
+class VirtualUser:
+    """
+    A browser: one cookie jar, requests timed into the results
+    """
+
+    def __init__(self, base_url, email, results, rnd):
+        self.base_url = base_url
+        self.email = email
+        self.results = results
+        self.rnd = rnd
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()),
+                                   NoRedirect)
+        self.id = None
+        self.listings = []
+
+    def request(self, route, path, form=None):
+        '''
+        Send a request, time it under `route` unless it is None
+          Returns:
+            The status code and the body
+        '''
+        data = urlencode(form).encode() if form is not None else None
+        begin = time.perf_counter()
+        try:
+            with self.opener.open(self.base_url + path, data) as response:
+                status, body = response.status, response.read()
+        except HTTPError as error:
+            status, body = error.code, error.read()
+        if route is not None:
+            self.results.add(route, (time.perf_counter() - begin) * 1000,
+                             status)
+        return status, body
+
+    def setup(self, register):
+        '''
+        Find the user id and the listings of the other users, through
+        the JSON API (not timed)
+        '''
+        if register:
+            self.request(None, '/register', {
+                'email': self.email, 'name': self.email.split('@')[0],
+                'real_name': 'Load User', 'password': PASSWORD,
+                'password2': PASSWORD})
+        self.login(None)
+        status, body = self.request(None, '/api/v1/user?fields=id')
+        if status != 200:
+            raise RuntimeError('cannot log in as ' + self.email)
+        self.id = json.loads(body)['id']
+        _, body = self.request(None, '/api/v1/listings?fields=id&limit=100')
+        self.listings = [row['id'] for row in json.loads(body)['listings']]
+
+    def login(self, route='POST /login'):
+        self.request(route, '/login', {'email': self.email,
+                                       'password': PASSWORD})
+
+    def session(self):
+        self.login()
+        actions = [name for name, _ in ACTIONS]
+        weights = [weight for _, weight in ACTIONS]
+        for action in self.rnd.choices(actions, weights, k=SESSION_ACTIONS):
+            getattr(self, action)()
+        self.request('GET /logout', '/logout')
+
+    def home(self):
+        self.request('GET /', '/')
+
+    def browse(self):
+        self.request('GET /browse-listings', '/browse-listings')
+
+    def create(self):
+        self.request('GET /create-listing', '/create-listing')
+        self.request('POST /create-listing', '/create-listing', {
+            'title': 'Load listing %d %d' % (self.id, self.rnd.randrange(
+                10 ** 9)),
+            'description': DESCRIPTION, 'price': 50})
+
+    def book(self):
+        if not self.listings:
+            return
+        listing = self.rnd.choice(self.listings)
+        path = '/book-listing/%d/%d' % (listing, self.id)
+        self.request('GET /book-listing', path)
+        start = date(2030, 1, 1) + timedelta(days=next(booking_days))
+        self.request('POST /book-listing', path, {
+            'start': start.isoformat(),
+            'end': (start + timedelta(days=1)).isoformat()})
+
+
+def seed(path, users, listings):
+    '''
+    Add the virtual users, with a large balance, and their listings to
+    the database created by the migrations of the app
+    '''
+    rnd = random.Random(25)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        'INSERT INTO user (id, username, email, real_name, balance, '
+        'password, billing_address, postal_code) '
+        'VALUES (?, ?, ?, "Load User", ?, ?, "", "")',
+        ((i, 'load%d' % i, 'load%d@load.com' % i, 10 ** 9, PASSWORD)
+         for i in range(1, users + 1)))
+    conn.executemany(
+        'INSERT INTO listing (id, title, description, owner_id, price, '
+        'last_modified_date) VALUES (?, ?, ?, ?, ?, ?)',
+        ((i, 'Listing %d' % i, DESCRIPTION, rnd.randint(1, users),
+          rnd.randint(10, 500), DAY.isoformat())
+         for i in range(1, listings + 1)))
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def serve(users, listings):
+    '''
+    Serve the app on a free port of localhost, in a thread
+      Returns:
+        The base URL and the server
+    '''
+    path = os.path.join(tempfile.mkdtemp(), 'load.sqlite')
+    os.environ['db_string'] = 'sqlite:///' + path
+    # Imported here: the app connects to db_string when imported
+    from werkzeug.serving import make_server
+    from app import app, models
+    from app import controllers  # noqa: F401
+    seed(path, users, listings)
+    # The date checks of the listings only accept dates until 2025
+    date_check = models.date_check
+    models.date_check = lambda day, low, high: date_check(
+        DAY if day == date.today() else day, low, high)
+    # Not one log line per request
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:%d' % server.server_port, server
+
+
+def run(base_url, users, duration, register):
+    '''
+    Run the virtual users for `duration` seconds
+      Returns:
+        The summary of Results, and the total requests per second
+    '''
+    results = Results()
+    clients = [VirtualUser(base_url, 'load%d@load.com' % i, results,
+                           random.Random(i)) for i in range(1, users + 1)]
+    for client in clients:
+        client.setup(register)
+    deadline = time.monotonic() + duration
+
+    def loop(client):
+        while time.monotonic() < deadline:
+            client.session()
+
+    threads = [threading.Thread(target=loop, args=(client,))
+               for client in clients]
+    begin = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The last sessions end after the deadline
+    seconds = time.monotonic() - begin
+    summary = results.summary(seconds)
+    total = sum(route['requests'] for route in summary.values())
+    return summary, total / seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load')
+    parser.add_argument('--url', help='server to load (default: serve the '
+                                      'app in this process)')
+    parser.add_argument('--users', type=int, default=16,
+                        help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds of load')
+    parser.add_argument('--listings', type=int, default=1000,
+                        help='listings seeded without --url')
+    parser.add_argument('--output', help='write the results to this file')
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        base_url, server = serve(args.users, args.listings)
+    summary, per_sec = run(base_url, args.users, args.duration,
+                           register=args.url is not None)
+    if server is not None:
+        server.shutdown()
+
+    print('{} virtual users, {:.0f} s: {:.1f} requests/s'.format(
+        args.users, args.duration, per_sec))
+    print('{:<22} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}  {}'.format(
+        'route', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+        'max ms', 'statuses'))
+    for route, row in summary.items():
+        print('{:<22} {:>8} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f}  {}'
+              .format(route, row['requests'], row['per_sec'], row['p50_ms'],
+                      row['p95_ms'], row['p99_ms'], row['max_ms'],
+                      ' '.join('{}:{}'.format(status, count) for status, count
+                               in row['statuses'].items())))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'users': args.users, 'duration': args.duration,
+                       'url': args.url, 'per_sec': round(per_sec, 1),
+                       'routes': summary}, output, indent=2)
+            output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+'''
+Time the hot paths of app.models on a seeded SQLite database: register,
+login, create_listing, update_listing, create_booking, browse_listings,
+find_booked_listing and get_user_balance.
+
+    python -m benchmarks.models --users 100000 --listings 100000 \\
+        --bookings 1000000 --output results.json
+
+prints the p50, p95 and p99 time of a call and the calls per second of
+each function, and writes them to --output as JSON. With --baseline, the
+results are compared to a former output, and the command exits with
+status 1 if the median call of a function is more than --tolerance
+slower (20% by default): the medians vary less between runs than the
+tails. benchmarks/baseline.json holds the results of the default
+volumes.
+
+The model functions run against the database given to the app in
+db_string, so the app is imported once the database is chosen. The
+model cache is disabled (cache_url is cleared) so that every call reads
+the database, and the date checks of the listings, which only accept
+dates until 2025, see the day DAY instead of today.
+'''
+
+# Day seen by the date checks of the listings
+DAY = date(2024, 6, 1)
+
+# Password of the seeded users
+PASSWORD = '12345Aa#'
+
+# Users who can own the new listings (listing_field_error)
+MAX_OWNER = 10000
+
+DESCRIPTION = 'A quiet room near the lake, with a view of the water.'
+
+
+def seed(path, users, listings, bookings):
+    '''
+    Fill the tables of the app (created by its migrations) with sqlite3:
+    the listings belong to random users, the bookings are one to three
+    night stays of random users in 2022-2024, and their owner column
+    matches their listing.
+    '''
+    rnd = random.Random(24)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        'INSERT INTO user (id, username, email, real_name, balance, '
+        'password, billing_address, postal_code) '
+        'VALUES (?, ?, ?, "Bench User", ?, ?, "", "")',
+        ((i, 'user%d' % i, 'user%d@bench.com' % i, 10 ** 9, PASSWORD)
+         for i in range(1, users + 1)))
+    owners = [rnd.randint(1, users) for _ in range(listings)]
+    prices = [rnd.randint(10, 5000) for _ in range(listings)]
+    conn.executemany(
+        'INSERT INTO listing (id, title, description, owner_id, price, '
+        'last_modified_date) VALUES (?, ?, ?, ?, ?, ?)',
+        ((i, 'Listing %d' % i, DESCRIPTION, owners[i - 1], prices[i - 1],
+          DAY.isoformat()) for i in range(1, listings + 1)))
+
+    def rows():
+        for i in range(1, bookings + 1):
+            listing = rnd.randint(1, listings)
+            start = date(2022, 1, 1) + timedelta(days=rnd.randint(0, 1000))
+            yield (i, listing, prices[listing - 1], DAY.isoformat(),
+                   rnd.randint(1, users), owners[listing - 1],
+                   start.isoformat(),
+                   (start + timedelta(days=rnd.randint(1, 3))).isoformat())
+    conn.executemany(
+        'INSERT INTO booking (id, listing_id, price, date, user_id, '
+        'owner_id, start_date, end_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        rows())
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+    return owners, prices
+
+
+def percentile(times, p):
+    # Nearest rank
+    return times[max(int(math.ceil(p * len(times))) - 1, 0)]
+
+
+def measure(calls):
+    '''
+    Call each function, checking it succeeded
+      Returns:
+        The p50, p95 and p99 time of a call in ms, and the calls per
+        second
+    '''
+    times = []
+    for call in calls:
+        begin = time.perf_counter()
+        result = call()
+        times.append((time.perf_counter() - begin) * 1000)
+        if result is None or result is False:
+            raise RuntimeError('a benchmarked call failed')
+    total = sum(times) / 1000
+    times.sort()
+    return {'p50_ms': round(statistics.median(times), 4),
+            'p95_ms': round(percentile(times, 0.95), 4),
+            'p99_ms': round(percentile(times, 0.99), 4),
+            'ops_per_sec': round(len(times) / total, 1),
+            'calls': len(times)}
+
+
+def run(users, listings, bookings, calls, browse_calls):
+    '''
+    Returns:
+        The results of each function, by name
+    '''
+    path = os.path.join(tempfile.mkdtemp(), 'models.sqlite')
+    os.environ['db_string'] = 'sqlite:///' + path
+    os.environ['cache_url'] = ''
+    # Imported here: the app connects to db_string when imported, and
+    # creates the tables with its migrations
+    from app import models
+
+    begin = time.perf_counter()
+    owners, prices = seed(path, users, listings, bookings)
+    print('Seeded {} users, {} listings and {} bookings in {:.1f} s'.format(
+        users, listings, bookings, time.perf_counter() - begin))
+
+    date_check = models.date_check
+    models.date_check = lambda day, low, high: date_check(
+        DAY if day == date.today() else day, low, high)
+    rnd = random.Random(7)
+
+    def user():
+        return rnd.randint(1, users)
+
+    def booking(i):
+        # A free night after the seeded bookings, someone else's listing
+        listing = rnd.randint(1, listings)
+        guest = user()
+        while guest == owners[listing - 1]:
+            guest = user()
+        start = date(2030, 1, 1) + timedelta(days=i)
+        return (lambda: models.create_booking(
+            listing, guest, start, start + timedelta(days=1)))
+
+    def update(i):
+        listing = rnd.randint(1, listings)
+        return (lambda: models.update_listing(
+            listing, 'Updated listing %d' % i, DESCRIPTION,
+            prices[listing - 1], prices[listing - 1],
+            owners[listing - 1]))
+
+    operations = [
+        ('register', calls, lambda i: lambda: models.register(
+            'bench%d' % i, 'bench%d@bench.com' % i, 'Bench User',
+            PASSWORD)),
+        ('login', calls, lambda i: (
+            lambda email='user%d@bench.com' % user():
+                models.login(email, PASSWORD))),
+        ('create_listing', calls, lambda i: (
+            lambda owner=rnd.randint(1, min(users, MAX_OWNER)):
+                models.create_listing('Bench listing %d' % i, DESCRIPTION,
+                                      100, owner))),
+        ('update_listing', calls, update),
+        ('create_booking', calls, booking),
+        ('browse_listings', browse_calls, lambda i: (
+            lambda uid=user(): models.browse_listings(uid))),
+        ('find_booked_listing', calls, lambda i: (
+            lambda uid=user(): models.find_booked_listing(uid))),
+        ('get_user_balance', calls, lambda i: (
+            lambda email='user%d@bench.com' % user():
+                models.get_user_balance(email))),
+    ]
+    results = {}
+    print('{:<20} {:>10} {:>10} {:>10} {:>10}'.format(
+        'function', 'p50 ms', 'p95 ms', 'p99 ms', 'ops/sec'))
+    for name, count, make in operations:
+        result = measure(make(i) for i in range(count))
+        # Drop the objects this function loaded before the next one
+        models.db.session.remove()
+        results[name] = result
+        print('{:<20} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.1f}'.format(
+            name, result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            result['ops_per_sec']))
+    models.db.engine.dispose()
+    os.remove(path)
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    '''
+    Returns:
+        The (name, p50, baseline p50) of the functions whose median
+        is more than `tolerance` (a fraction) above the baseline
+    '''
+    slower = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before and result['p50_ms'] > before['p50_ms'] * (1 + tolerance):
+            slower.append((name, result['p50_ms'], before['p50_ms']))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.models')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--listings', type=int, default=10000)
+    parser.add_argument('--bookings', type=int, default=100000)
+    parser.add_argument('--calls', type=int, default=200,
+                        help='calls of each function')
+    parser.add_argument('--browse-calls', type=int, default=10,
+                        help='calls of browse_listings, which loads '
+                             'every listing')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--baseline', help='results to compare to')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    volumes = {'users': args.users, 'listings': args.listings,
+               'bookings': args.bookings}
+    results = run(args.users, args.listings, args.bookings, args.calls,
+                  args.browse_calls)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'volumes': volumes,
+                       'python': platform.python_version(),
+                       'sqlite': sqlite3.sqlite_version,
+                       'results': results}, output, indent=2)
+            output.write('\n')
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['volumes'] != volumes:
+            print('The baseline was seeded with {}'.format(
+                baseline['volumes']))
+        slower = regressions(results, baseline['results'], args.tolerance)
+        for name, p50, before in slower:
+            print('REGRESSION {}: p50 {:.3f} ms, baseline {:.3f} ms'.format(
+                name, p50, before))
+        if slower:
+            sys.exit(1)
+        print('No regression beyond {:.0%}'.format(args.tolerance))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, select, func
+from app.models import db, User, Listing, Booking, Review
+from app.migrations import index_filtered_columns
+
+'''
+Compare the query plans and timings of the model lookups before and
+after the indexes of migration 2, on a seeded SQLite database.
+
+    python -m benchmarks.query_plans --rows 1000000
+'''
+
+
+def seed(path, rows):
+    '''
+    Fill a new database with `rows` bookings, and a tenth as many
+    users, listings and reviews. The indexes are not created yet.
+    '''
+    engine = create_engine('sqlite:///' + path)
+    for table in db.metadata.sorted_tables:
+        # Create the bare tables, like a database made before migration 2
+        indexes = set(table.indexes)
+        table.indexes.clear()
+        table.create(bind=engine)
+        table.indexes.update(indexes)
+
+    small = max(rows // 10, 1)
+    today = date(2022, 1, 1)
+    rnd = random.Random(327)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        'INSERT INTO user (id, username, email, balance, password, '
+        'billing_address, postal_code) VALUES (?, ?, ?, 100, ?, "", "")',
+        ((i, 'user%d' % i, 'user%d@test.com' % i, '12345Aa#')
+         for i in range(1, small + 1)))
+    conn.executemany(
+        'INSERT INTO listing (id, title, description, owner_id, price, '
+        'last_modified_date) VALUES (?, ?, ?, ?, ?, ?)',
+        ((i, 'Listing %d' % i, 'A description for listing %d.' % i,
+          rnd.randint(1, small), rnd.randint(10, 10000), today.isoformat())
+         for i in range(1, small + 1)))
+
+    def bookings():
+        for i in range(1, rows + 1):
+            start = today + timedelta(days=rnd.randint(0, 1000))
+            end = start + timedelta(days=rnd.randint(1, 14))
+            yield (i, rnd.randint(1, small), 10, today.isoformat(),
+                   rnd.randint(1, small), start.isoformat(), end.isoformat())
+    conn.executemany(
+        'INSERT INTO booking (id, listing_id, price, date, user_id, '
+        'start_date, end_date) VALUES (?, ?, ?, ?, ?, ?, ?)', bookings())
+    conn.executemany(
+        'INSERT INTO review (id, user_id, listing_id, review_text, date) '
+        'VALUES (?, ?, ?, "Great stay", ?)',
+        ((i, rnd.randint(1, small), rnd.randint(1, small), today.isoformat())
+         for i in range(1, small + 1)))
+    conn.commit()
+    conn.close()
+    return engine
+
+
+def queries(rows):
+    '''
+    The statements issued by the model functions
+    '''
+    small = max(rows // 10, 1)
+    start, end = date(2023, 3, 1), date(2023, 3, 5)
+    return [
+        ('register / login', select(User).where(
+            User.email == 'user%d@test.com' % small)),
+        ('update_user', select(User).where(
+            User.username == 'user%d' % small)),
+        ('find_listings', select(Listing).where(Listing.owner_id == small)),
+        ('unique_title_check', select(Listing).where(
+            Listing.title == 'Listing %d' % small)),
+        ('find_bookings', select(Booking).where(Booking.user_id == small)),
+        ('create_booking overlap', select(func.count()).where(
+            Booking.listing_id == small,
+            ((start <= Booking.start_date) & (end >= Booking.end_date))
+            | ((end <= Booking.end_date) & (end >= Booking.start_date))
+            | ((start >= Booking.start_date)
+               & (start <= Booking.end_date)))),
+        ('reviews of a listing', select(Review).where(
+            Review.listing_id == small)),
+    ]
+
+
+def run(engine, rows, repeat):
+    '''
+    Print the plan and the mean time of each query
+    '''
+    with engine.connect() as conn:
+        for name, stmt in queries(rows):
+            compiled = stmt.compile(engine)
+            params = tuple(
+                v.isoformat() if isinstance(v, date) else v
+                for v in (compiled.params[k] for k in compiled.positiontup))
+            plan = conn.exec_driver_sql(
+                'EXPLAIN QUERY PLAN ' + str(compiled), params).all()
+            begin = time.perf_counter()
+            for _ in range(repeat):
+                conn.exec_driver_sql(str(compiled), params).all()
+            elapsed = (time.perf_counter() - begin) / repeat
+            print('  {:<24} {:>10.3f} ms  {}'.format(
+                name, elapsed * 1000, '; '.join(p[-1] for p in plan)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000,
+                        help='number of bookings to seed')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.sqlite')
+        begin = time.perf_counter()
+        engine = seed(path, args.rows)
+        print('Seeded {} bookings in {:.1f} s'.format(
+            args.rows, time.perf_counter() - begin))
+
+        print('Before (no indexes):')
+        run(engine, args.rows, args.repeat)
+
+        with engine.begin() as conn:
+            index_filtered_columns(conn)
+            conn.exec_driver_sql('ANALYZE')
+        print('After (migration 2):')
+        run(engine, args.rows, args.repeat)
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import date
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from app.models import db
+from app.search import ListingSearch, create_fts_table
+
+'''
+Time the full-text search of the listings, with the FTS5 index and with
+the in-process index, on a seeded SQLite database.
+
+    python -m benchmarks.search --rows 1000000 --fallback-rows 100000
+
+The words of the titles and descriptions follow a Zipf distribution
+over a vocabulary, like natural text, and the queries are one or two
+words drawn uniformly from the vocabulary, plus the most common words.
+'''
+
+
+def vocabulary(size):
+    rnd = random.Random(1)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rnd.choice(letters)
+                          for _ in range(rnd.randint(3, 10))))
+    return sorted(words)
+
+
+def seed(path, rows, words, fts=True):
+    '''
+    Fill a new database with `rows` listings, then build the FTS5 index
+    '''
+    engine = create_engine('sqlite:///' + path)
+    # With the change log read by the in-process index
+    for name in ('listing', 'listing_change'):
+        db.metadata.tables[name].create(bind=engine)
+    rnd = random.Random(327)
+    weights = list(itertools.accumulate(
+        1 / rank for rank in range(1, len(words) + 1)))
+
+    def text(count):
+        return ' '.join(rnd.choices(words, cum_weights=weights, k=count))
+
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        'INSERT INTO listing (id, title, description, owner_id, price, '
+        'last_modified_date) VALUES (?, ?, ?, 1, 100, ?)',
+        ((i, '{} {}'.format(text(rnd.randint(2, 4)), i),
+          text(rnd.randint(20, 60)) + '.', date(2022, 1, 1).isoformat())
+         for i in range(1, rows + 1)))
+    conn.commit()
+    conn.close()
+    if not fts:
+        return engine
+    begin = time.perf_counter()
+    with engine.begin() as connection:
+        create_fts_table(connection)
+    print('  FTS5 index built in {:.1f} s'.format(
+        time.perf_counter() - begin))
+    return engine
+
+
+def measure(search, queries):
+    '''
+    Returns:
+        The p50, p95 and maximum time of a search, in ms
+    '''
+    times = []
+    for query in queries:
+        begin = time.perf_counter()
+        search.search(query, 20)
+        times.append((time.perf_counter() - begin) * 1000)
+    times.sort()
+    return (statistics.median(times), times[int(len(times) * 0.95)],
+            times[-1])
+
+
+def run(rows, fallback_rows, vocabulary_size, count):
+    words = vocabulary(vocabulary_size)
+    rnd = random.Random(42)
+    queries = [' '.join(rnd.sample(words, rnd.randint(1, 2)))
+               for _ in range(count)] + words[:5] + \
+        [' '.join(words[i:i + 2]) for i in range(0, 10, 2)]
+    print('Queries: {} random, 5 common words, 5 pairs of common words'
+          .format(count))
+
+    for label, size in (('FTS5', rows), ('in-process', fallback_rows)):
+        if not size:
+            continue
+        path = os.path.join(tempfile.mkdtemp(), 'search.sqlite')
+        print('{}: {} listings'.format(label, size))
+        engine = seed(path, size, words, fts=label == 'FTS5')
+        session = Session(engine)
+        search = ListingSearch(lambda: session)
+        if label == 'in-process':
+            search.fts = False
+            begin = time.perf_counter()
+            search.sync()
+            print('  in-process index built in {:.1f} s'.format(
+                time.perf_counter() - begin))
+        print('  random words:  p50 {:.2f} ms, p95 {:.2f} ms, '
+              'max {:.2f} ms'.format(*measure(search, queries[:count])))
+        print('  common words:  p50 {:.2f} ms, p95 {:.2f} ms, '
+              'max {:.2f} ms'.format(*measure(search, queries[count:])))
+        session.close()
+        engine.dispose()
+        os.remove(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.search')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--fallback-rows', type=int, default=100000,
+                        help='listings of the in-process index (0 to skip)')
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args(argv)
+    run(args.rows, args.fallback_rows, args.vocabulary, args.queries)
+
+
+if __name__ == '__main__':
+    main()
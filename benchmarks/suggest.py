@@ -0,0 +1,76 @@
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+
+from app.suggest import TitleIndex
+from benchmarks.search import vocabulary
+
+'''
+Time the title autocompletion on an in-memory index.
+
+    python -m benchmarks.suggest --rows 1000000
+
+The titles are two to four words of a vocabulary followed by a number,
+and the prefixes are the first 1 to 10 characters of existing titles.
+'''
+
+
+def measure(calls):
+    '''
+    Returns:
+        The p50, p95 and maximum time of a call, in ms
+    '''
+    times = []
+    for call, args in calls:
+        begin = time.perf_counter()
+        call(*args)
+        times.append((time.perf_counter() - begin) * 1000)
+    times.sort()
+    return (statistics.median(times), times[int(len(times) * 0.95)],
+            times[-1])
+
+
+def run(rows, vocabulary_size, count):
+    words = vocabulary(vocabulary_size)
+    rnd = random.Random(5)
+    titles = ['{} {}'.format(' '.join(rnd.sample(words, rnd.randint(2, 4))),
+                             i).capitalize() for i in range(rows)]
+    print('{} titles'.format(rows))
+
+    tracemalloc.start()
+    begin = time.perf_counter()
+    index = TitleIndex()
+    index.load((i, title, i % 1000) for i, title in enumerate(titles))
+    print('  built in {:.1f} s, {:.0f} MB'.format(
+        time.perf_counter() - begin,
+        tracemalloc.get_traced_memory()[0] / 2 ** 20))
+    tracemalloc.stop()
+
+    for length in (1, 3, 10):
+        prefixes = [rnd.choice(titles)[:length] for _ in range(count)]
+        print('  {:2} characters:  p50 {:.3f} ms, p95 {:.3f} ms, '
+              'max {:.3f} ms'.format(length, *measure(
+                  (index.lookup, (prefix, 10, 7)) for prefix in prefixes)))
+    print('  add:            p50 {:.3f} ms, p95 {:.3f} ms, '
+          'max {:.3f} ms'.format(*measure(
+              (index.add, (rows + i, 'New title {}'.format(i), 1))
+              for i in range(count))))
+    print('  update:         p50 {:.3f} ms, p95 {:.3f} ms, '
+          'max {:.3f} ms'.format(*measure(
+              (index.add, (i, 'Renamed {}'.format(i), 1))
+              for i in rnd.sample(range(rows), count))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suggest')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args(argv)
+    run(args.rows, args.vocabulary, args.queries)
+
+
+if __name__ == '__main__':
+    main()
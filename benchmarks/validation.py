@@ -0,0 +1,52 @@
+import timeit
+from app.validation import desc_character_check, alphanumeric_check, \
+    real_name_check, postal_code_check
+from app_test.test_validation import original_desc_character_check, \
+    original_alphanumeric_check, original_real_name_check, \
+    original_postal_code_check
+
+'''
+Time the validators against their former character loops:
+
+    python -m benchmarks.validation
+'''
+
+DESCRIPTION = ('A bright, quiet room near the lake. Free parking! '
+               * 40)[:2000]
+TITLE = 'Cozy Lakeside Cottage With A View 2'
+REAL_NAME = 'Jean Baptiste Emmanuel Zorg'
+POSTAL_CODE = 'K7L 3N6'
+
+CASES = [
+    ('desc_character_check (2000 chars)', DESCRIPTION,
+     original_desc_character_check, desc_character_check),
+    ('alphanumeric_check', TITLE,
+     original_alphanumeric_check, alphanumeric_check),
+    ('real_name_check', REAL_NAME,
+     original_real_name_check, real_name_check),
+    ('postal_code_check', POSTAL_CODE,
+     original_postal_code_check, postal_code_check),
+]
+
+
+def per_call(func, arg, number):
+    '''
+    Returns:
+        The best time of one call, in microseconds
+    '''
+    best = min(timeit.repeat(lambda: func(arg), number=number, repeat=5))
+    return best / number * 1e6
+
+
+def main():
+    print('{:<36} {:>12} {:>12} {:>8}'.format(
+        'check', 'before (us)', 'after (us)', 'speedup'))
+    for name, arg, before, after in CASES:
+        number = 2000 if len(arg) > 100 else 100000
+        old, new = per_call(before, arg, number), per_call(after, arg, number)
+        print('{:<36} {:>12.2f} {:>12.2f} {:>7.1f}x'.format(
+            name, old, new, old / new))
+
+
+if __name__ == '__main__':
+    main()
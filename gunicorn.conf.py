@@ -0,0 +1,38 @@
+import multiprocessing
+import os
+
+'''
+Settings of the production server (gunicorn loads this file from the
+working directory):
+
+    gunicorn app.wsgi:application
+
+Every setting can be changed with an environment variable.
+'''
+
+bind = '0.0.0.0:{}'.format(os.getenv('port', '8081'))
+
+# Worker processes, and threads per worker
+workers = int(os.getenv('web_workers', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('web_threads', '4'))
+worker_class = os.getenv('web_worker_class', 'gthread')
+
+# Import the app (and run the migrations) once, before forking
+preload_app = True
+
+# Seconds a worker has to finish its requests after a SIGTERM
+graceful_timeout = int(os.getenv('web_graceful_timeout', '30'))
+timeout = int(os.getenv('web_timeout', '60'))
+keepalive = 5
+
+accesslog = os.getenv('web_access_log', '-')
+
+
+def post_fork(server, worker):
+    from app.wsgi import after_fork
+    after_fork()
+
+
+def worker_exit(server, worker):
+    from app.wsgi import shutdown
+    shutdown()